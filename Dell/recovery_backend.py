@@ -31,21 +31,44 @@ import dbus
 import dbus.service
 import dbus.mainloop.glib
 import atexit
-import tempfile
+import contextlib
+import functools
+import hashlib
+import itertools
 import subprocess
 import tarfile
+import tempfile
 import shutil
 import datetime
-import lsb_release
-from hashlib import md5
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from Dell.recovery_common import (DOMAIN, LOCALEDIR,
-                                  walk_cleanup, create_new_uuid, white_tree,
+                                  create_new_uuid, white_tree,
                                   black_tree, fetch_output, check_version,
+                                  fetch_output_bytes, iter_output_lines,
                                   DBUS_BUS_NAME, DBUS_INTERFACE_NAME,
                                   RestoreFailed, CreateFailed, find_partition,
-                                  regenerate_md5sum, PermissionDeniedByPolicy)
-from Dell.recovery_threading import ProgressByPulse, ProgressBySize
+                                  regenerate_md5sum, PermissionDeniedByPolicy,
+                                  rp_package_version, md5sum_file)
+from Dell.recovery_threading import (ProgressByPulse, ProgressBySize,
+                                     ProgressPublisher)
+from Dell.recovery_dpkg import (RepackCache, changelog_distribution,
+                                installed_version)
+from Dell.recovery_fish import (extract_fish_archive, merge_tree, stage_file,
+                                FishCache, DigestCache, PackageValidator)
+from Dell.recovery_initrd import find_in_initrd
+from Dell.recovery_jobs import (JobManager, JobCancelled, check_cancelled,
+                                current_job, job_output)
+from Dell.recovery_workers import WorkerPool
+from Dell.recovery_mounts import MountRegistry
+from Dell.recovery_plan import (build_plan, fish_size, initrd_size, volume_free,
+                                CREATE_OVERHEAD, INITRD_EXPANSION)
+from Dell.recovery_history import BuildHistory, BuildRecord
+from Dell.recovery_profile import profile_class
+from Dell.recovery_telemetry import TimedPopen, timed_call, COMMAND_STATS
+from Dell.recovery_workspace import WorkspaceManager, InsufficientSpace
 from Dell.recovery_xml import BTOxml
 
 import fcntl
@@ -60,19 +83,83 @@ try:
 except ImportError:
     from debian_bundle import debian_support
 
-def safe_tar_extract(filename, destination):
-    """Safely extracts a tarball into destination"""
-    logging.debug('safe_tar_extract: %s to %s' % (filename, destination))
-
-    rfd = tarfile.open(filename)
-    dangerous_file = False
-    for name in rfd.getnames():
-        if name.startswith('..') or name.startswith('/'):
-            dangerous_file = True
-            break
-    if not dangerous_file:
-        rfd.extractall(destination)
-    rfd.close()
+#Shipped in the initrd of every BTO compatible image
+BOOTSTRAP_MEMBER = 'scripts/casper-bottom/99dell_bootstrap'
+
+#How many images a batch query inspects at once
+BATCH_WORKERS = 4
+
+#Seconds a successful polkit authorization is reused for
+POLKIT_CACHE_TTL = 30
+
+def _process_start_time(pid):
+    """Returns the start time of a process in clock ticks since boot, as
+       polkit expects it, or 0 if it can't be read"""
+    try:
+        with open('/proc/%d/stat' % pid) as rfd:
+            stat = rfd.read()
+    except (IOError, OSError):
+        return 0
+    #the command name may contain spaces, fields are counted after it
+    fields = stat.rsplit(')', 1)[-1].split()
+    try:
+        return int(fields[19])
+    except (IndexError, ValueError):
+        return 0
+
+def _fish_destination(fishie, assembly_tmp):
+    """Returns where a driver FISH file is copied to as it is, or None
+       for archives and anything else"""
+    if fishie.endswith('.deb'):
+        logging.debug("  Copying debian archive fishie %s", fishie)
+        return os.path.join(assembly_tmp, 'debs')
+    if fishie.endswith('.pdf'):
+        logging.debug("  Copying document fishie fishie %s", fishie)
+        return os.path.join(assembly_tmp, 'docs')
+    if fishie.endswith('.py') or fishie.endswith('.sh'):
+        logging.debug("  Copying python or shell fishie %s", fishie)
+        return os.path.join(assembly_tmp, 'scripts', 'chroot-scripts', 'fish')
+    return None
+
+def _graft_escape(path):
+    """Escapes a path for xorriso -graft-points"""
+    return path.replace('\\', '\\\\').replace('=', '\\=')
+
+def _call_scoped(function):
+    """Runs a backend method inside Backend._call_scope so the mounts
+       and workspaces it requests are released when it returns.  Goes above
+       @dbus.service.method, whose attributes it copies"""
+    @functools.wraps(function)
+    def _scoped(self, *args, **kwargs):
+        """Calls function within a mount scope"""
+        with self._call_scope():
+            return function(self, *args, **kwargs)
+    return _scoped
+
+def _build_recorded(function):
+    """Times the stages of a build method and stores them in the build
+       history when it returns.  Goes above @dbus.service.method"""
+    @functools.wraps(function)
+    def _recorded(self, *args, **kwargs):
+        """Calls function with a BuildRecord for this thread"""
+        if getattr(self._local, 'build', None) is not None:
+            return function(self, *args, **kwargs)
+        self._local.build = BuildRecord(function.__name__)
+        state = 'failed'
+        try:
+            result = function(self, *args, **kwargs)
+            state = 'finished'
+            return result
+        except JobCancelled:
+            state = 'cancelled'
+            raise
+        finally:
+            record, self._local.build = self._local.build, None
+            self.history.append(record.finish(state))
+            #jobs finish their progress when they complete
+            if current_job() is None:
+                self.progress_publisher.finish(None)
+    return _recorded
 
 class Backend(dbus.service.Object):
     '''Backend manager.
@@ -86,7 +173,7 @@ class Backend(dbus.service.Object):
     # D-BUS control API
     #
 
-    def __init__(self):
+    def __init__(self, workspace=None):
         dbus.service.Object.__init__(self)
 
         #initialize variables that will be used during create and run
@@ -95,14 +182,55 @@ class Backend(dbus.service.Object):
         self.main_loop = None
         self._timeout = False
         self.dbus_name = None
-        self.xml_obj = BTOxml()
+        #mounts are shared between requests and released once unused;
+        #anything requested outside of a scope is kept until exit
+        self.mounts = MountRegistry()
+        atexit.register(self.mounts.release_all)
+
+        #scratch space for builds, placed under workspace if given
+        self.workspaces = WorkspaceManager(workspace)
+        atexit.register(self.workspaces.release_all)
+        self._call_ids = itertools.count()
+        self._exit_requested = False
+
+        #long running operations started through the job API
+        self.jobs = JobManager()
+        self.jobs.on_progress = self._report_job_progress
+        self.jobs.on_complete = self._report_job_complete
+
+        #every progress signal is rate limited per job (None outside of one)
+        self.progress_publisher = ProgressPublisher(self._emit_progress)
+
+        #progress threads belong to the thread (job) that started them
+        self._local = threading.local()
+
+        #hashing, extraction and tree copies run outside of this process
+        self.workers = WorkerPool()
+
+        #stage timings of past builds, for plans and ETAs
+        self.history = BuildHistory()
+
+        #dell-recovery as installed, for injection into images
+        self.repacks = RepackCache()
+
+        #driver package validations by path
+        self.packages = PackageValidator()
+
+        #driver FISH extracted and FISH hashed by earlier builds
+        self.fish_cache = FishCache()
+        self.digests = DigestCache()
 
         # cached D-BUS interfaces for _check_polkit_privilege()
         self.dbus_info = None
         self.polkit = None
-        self.progress_thread = None
         self.enforce_polkit = True
 
+        # (sender, start time, privilege) -> expiry of an authorization,
+        # and the PID behind each sender
+        self._polkit_cache = {}
+        self._sender_pids = {}
+        self._polkit_lock = threading.Lock()
+
         #Enable translation for strings used
         bindtextdomain(DOMAIN, LOCALEDIR)
         textdomain(DOMAIN)
@@ -117,11 +245,18 @@ class Backend(dbus.service.Object):
         once the server is ready to take requests.
         '''
         dbus.service.Object.__init__(self, self.bus, '/RecoveryMedia')
+        self.bus.add_signal_receiver(self._name_owner_changed,
+                                     'NameOwnerChanged',
+                                     'org.freedesktop.DBus',
+                                     'org.freedesktop.DBus',
+                                     '/org/freedesktop/DBus')
         self.main_loop = GLib.MainLoop()
         self._timeout = False
         if timeout:
             def _quit():
                 """This function is ran at the end of timeout"""
+                if self.jobs.running():
+                    return True
                 self.main_loop.quit()
                 return True
             GLib.timeout_add(timeout * 1000, _quit)
@@ -135,16 +270,24 @@ class Backend(dbus.service.Object):
             if timeout:
                 self._timeout = True
             self.main_loop.run()
+        self.workers.close()
 
     @classmethod
-    def create_dbus_server(cls, session_bus=False):
+    def create_dbus_server(cls, session_bus=False, workspace=None, profiler=None):
         '''Return a D-BUS server backend instance.
 
         Normally this connects to the system bus. Set session_bus to True to
-        connect to the session bus (for testing).
+        connect to the session bus (for testing). Build scratch space goes
+        below workspace, or the system's temporary directory. If a
+        recovery_profile.Profiler is given, every D-BUS method call is
+        profiled by it.
 
         '''
-        backend = Backend()
+        if profiler:
+            backend = profile_class(Backend, profiler)(workspace)
+        else:
+            backend = Backend(workspace)
+        dbus.mainloop.glib.threads_init()
         dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
         if session_bus:
             backend.bus = dbus.SessionBus()
@@ -168,6 +311,98 @@ class Backend(dbus.service.Object):
 
         self._timeout = False
 
+    def _emit_from_main_loop(self, signal, *args):
+        '''Queues a D-BUS signal to be sent from the main loop thread.'''
+        def _emit():
+            """Sends the signal and removes the idle source"""
+            signal(*args)
+            return False
+        GLib.idle_add(_emit)
+
+    def _report_progress(self, this, that=''):
+        '''Sends progress to the job running in this thread, or through
+           report_progress when called outside of a job.'''
+        eta = self._build_eta(getattr(self._local, 'build', None), that)
+        if not self.jobs.progress(this, that, eta=eta):
+            self.progress_publisher.publish(None, this, that)
+
+    def _worker_progress(self, this):
+        '''Returns a progress callback for a worker task, reporting as
+           stage this of the job running in the calling thread.'''
+        job = current_job()
+        record = getattr(self._local, 'build', None)
+        def _progress(percent):
+            """Forwards progress read back from the worker"""
+            eta = self._build_eta(record, percent)
+            if not self.jobs.progress(this, percent, job, eta):
+                self.progress_publisher.publish(None, this, percent)
+        return _progress
+
+    def _build_eta(self, record, percent):
+        '''Estimates the seconds left in the build of record from the
+           build history, None if that isn't possible.'''
+        if record is None:
+            return None
+        return self.history.eta(record, percent)
+
+    def _build_stage(self, name, size=None):
+        '''Starts timing stage name of the build running in this thread.'''
+        record = getattr(self._local, 'build', None)
+        if record is not None:
+            record.stage(name, size)
+
+    def _add_build_timings(self, xml_obj):
+        '''Replaces the build timings in xml_obj with the stages timed
+           so far by the build running in this thread.'''
+        record = getattr(self._local, 'build', None)
+        if record is None:
+            return
+        xml_obj.clear_timings('build')
+        for span in record.spans:
+            xml_obj.add_timing('build', span['stage'], span['start'],
+                               span['end'], span['bytes'])
+
+    def _end_build_stage(self, size=None):
+        '''Ends the running stage of the build, size being the bytes it
+           actually processed if only known now.'''
+        record = getattr(self._local, 'build', None)
+        if record is not None:
+            record.end_stage(size)
+
+    def _report_job_progress(self, job, this, that):
+        '''Forwards progress of a job to its clients.'''
+        self.progress_publisher.publish(job.job_id, this, that)
+
+    def _emit_progress(self, job_id, this, that):
+        '''Sends an update let through by the progress publisher.'''
+        if job_id is None:
+            self.report_progress(this, that)
+        else:
+            self._emit_from_main_loop(self.report_job_progress, job_id,
+                                      this, str(that))
+
+    def _report_job_complete(self, job):
+        '''Announces the outcome of a job and exits if that was requested
+           while it was running.'''
+        self.progress_publisher.finish(job.job_id)
+        self._release_resources(job.job_id)
+        def _complete():
+            """Sends the signal and removes the idle source"""
+            self.report_job_complete(job.job_id, job.state, job.error)
+            if self._exit_requested and not self.jobs.running():
+                self.main_loop.quit()
+            return False
+        GLib.idle_add(_complete)
+
+    def _name_owner_changed(self, name, old_owner, new_owner):
+        '''Forgets cached authorizations of a client leaving the bus.'''
+        if not old_owner or new_owner:
+            return
+        with self._polkit_lock:
+            self._sender_pids.pop(old_owner, None)
+            for key in [key for key in self._polkit_cache if key[0] == old_owner]:
+                del self._polkit_cache[key]
+
     def _check_polkit_privilege(self, sender, conn, privilege):
         '''Verify that sender has a given PolicyKit privilege.
 
@@ -177,7 +412,8 @@ class Backend(dbus.service.Object):
         @dbus.service.methods). privilege is the PolicyKit privilege string.
 
         This method returns if the caller is privileged, and otherwise throws a
-        PermissionDeniedByPolicy exception.
+        PermissionDeniedByPolicy exception. Authorizations are reused for
+        POLKIT_CACHE_TTL seconds while the calling process stays the same.
         '''
         if sender is None and conn is None:
             # called locally, not through D-BUS
@@ -188,10 +424,23 @@ class Backend(dbus.service.Object):
             return
 
         # get peer PID
-        if self.dbus_info is None:
-            self.dbus_info = dbus.Interface(conn.get_object('org.freedesktop.DBus',
-                '/org/freedesktop/DBus/Bus', False), 'org.freedesktop.DBus')
-        pid = self.dbus_info.GetConnectionUnixProcessID(sender)
+        with self._polkit_lock:
+            pid = self._sender_pids.get(sender)
+        if pid is None:
+            if self.dbus_info is None:
+                self.dbus_info = dbus.Interface(conn.get_object('org.freedesktop.DBus',
+                    '/org/freedesktop/DBus/Bus', False), 'org.freedesktop.DBus')
+            pid = self.dbus_info.GetConnectionUnixProcessID(sender)
+            with self._polkit_lock:
+                self._sender_pids[sender] = pid
+
+        # a reused PID has a different start time, so it can't hit the cache
+        start_time = _process_start_time(pid)
+        key = (sender, start_time, privilege)
+        now = time.monotonic()
+        with self._polkit_lock:
+            if self._polkit_cache.get(key, 0) > now:
+                return
 
         # query PolicyKit
         if self.polkit is None:
@@ -202,7 +451,7 @@ class Backend(dbus.service.Object):
             # we don't need is_challenge return here, since we call with AllowUserInteraction
             (is_auth, unused, details) = self.polkit.CheckAuthorization( # pylint: disable=unused-variable
                     ('unix-process', {'pid': dbus.UInt32(pid, variant_level=1),
-                        'start-time': dbus.UInt64(0, variant_level=1)}),
+                        'start-time': dbus.UInt64(start_time, variant_level=1)}),
                     privilege, {'': ''}, dbus.UInt32(1), '', timeout=600)
         except dbus.DBusException as msg:
             if msg.get_dbus_name() == \
@@ -218,6 +467,14 @@ class Backend(dbus.service.Object):
                     sender, conn, pid, privilege, str(details))
             raise PermissionDeniedByPolicy(privilege)
 
+        now = time.monotonic()
+        with self._polkit_lock:
+            for expired in [item for item, expiry in self._polkit_cache.items()
+                            if expiry <= now]:
+                del self._polkit_cache[expired]
+            if start_time:
+                self._polkit_cache[key] = now + POLKIT_CACHE_TTL
+
     #
     # Internal API for calling from Handlers (not exported through D-BUS)
     #
@@ -235,58 +492,80 @@ class Backend(dbus.service.Object):
         if os.path.isdir(recovery):
             return recovery
 
-        #check for an existing mount
-        command = subprocess.Popen(['mount'], stdout=subprocess.PIPE,
-                                   universal_newlines=True)
-        output = command.communicate()[0].split('\n')
-        for line in output:
-            processed_line = line.split()
-            if len(processed_line) > 0 and processed_line[0] == recovery:
-                return processed_line[2]
-
-        #if not already, mounted, produce a mount point
-        mntdir = tempfile.mkdtemp()
-        mnt_args = ['mount', '-%s' %type, recovery, mntdir]
+        mnt_args = ['-%s' %type]
         if ".iso" in recovery:
-            mnt_args.insert(1, 'loop')
-            mnt_args.insert(1, '-o')
-        else:
+            mnt_args += ['-o', 'loop']
+        elif not self.mounts.find(recovery):
             self._check_polkit_privilege(sender, conn,
-                                                'com.dell.recoverymedia.create')
-        command = subprocess.Popen(mnt_args,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE,
-                                 universal_newlines=True)
-        output = command.communicate()
-        ret = command.wait()
-        if ret != 0:
-            os.rmdir(mntdir)
-            if ret == 32:
-                try:
-                    mntdir = output[1].strip('\n').split('on')[1].strip(' ')
-                except IndexError:
-                    mntdir = ''
-                    logging.warning("IndexError when operating on output string")
-            else:
-                mntdir = ''
-                logging.warning("Unable to mount recovery partition")
-                logging.warning(output)
-        else:
-            atexit.register(self._unmount_drive, mntdir)
-        return mntdir
+                                         'com.dell.recoverymedia.create')
 
-    def _unmount_drive(self, mnt):
-        """Unmounts something mounted at a particular mount point"""
-        logging.debug("_unmount_drive: %s" % mnt)
+        #the mount is held until the job or _call_scope requesting it ends
+        mntdir = self.mounts.acquire(recovery, self._resource_owner(), mnt_args)
+        if not mntdir:
+            logging.warning("Unable to mount recovery partition")
+        return mntdir
 
-        if os.path.exists(mnt):
-            ret = subprocess.call(['umount', mnt])
-            if ret != 0:
-                logging.warning(" _unmount_drive: Error unmounting %s" % mnt)
-            try:
-                os.rmdir(mnt)
-            except OSError as msg:
-                logging.warning(" _unmount_drive: Error cleaning up: %s" % str(msg))
+    def _resource_owner(self):
+        '''Returns who mounts and workspaces requested now belong to: the
+           job or the _call_scope running in this thread.  None means
+           they are kept until the backend exits.'''
+        job = current_job()
+        if job is not None:
+            return job.job_id
+        return getattr(self._local, 'call_owner', None)
+
+    def _release_resources(self, owner):
+        '''Unmounts and deletes everything owner held.'''
+        self.mounts.release(owner)
+        self.workspaces.release(owner)
+
+    @contextlib.contextmanager
+    def _call_scope(self):
+        '''Releases the mounts and workspaces requested inside the block
+           when it ends.  Inside a job, or an enclosing scope, they are
+           kept until that ends instead.'''
+        if self._resource_owner() is not None:
+            yield
+            return
+        owner = 'call-%d' % next(self._call_ids)
+        self._local.call_owner = owner
+        try:
+            yield
+        finally:
+            self._local.call_owner = None
+            self._release_resources(owner)
+
+    def _allocate_workspace(self, needed=0, prefix='tmp'):
+        '''Creates a scratch directory for the current job or call, with
+           room for needed bytes.'''
+        try:
+            return self.workspaces.allocate(self._resource_owner(), needed,
+                                            prefix)
+        except InsufficientSpace as msg:
+            raise CreateFailed(str(msg))
+
+    def _create_workspace_size(self, mntdir, iso, sender, conn):
+        """Estimates the bytes create_ubuntu writes to the workspace volume:
+           what it stages and, if it goes there too, the ISO"""
+        nested = os.path.join(mntdir, 'ubuntu.iso')
+        staged = 0
+        image = mntdir
+        if os.path.exists(nested):
+            staged = black_tree("size", re.compile('^ubuntu.iso|^.disk'), mntdir)
+            image = self.request_mount(nested, "r", sender, conn)
+        initrd = initrd_size(image)
+        needed = staged + initrd * (INITRD_EXPANSION + 1) + CREATE_OVERHEAD
+        if volume_free(iso)[1] == \
+           volume_free(os.path.join(self.workspaces.root, 'create'))[1]:
+            needed += staged + white_tree("size", re.compile(''), image)
+        return needed
+
+    def _load_build_xml(self, source):
+        """Starts the BTO XML data for a build from the source's bto.xml"""
+        xml_obj = BTOxml()
+        if os.path.exists(os.path.join(source, 'bto.xml')):
+            xml_obj.load_bto_xml(os.path.join(source, 'bto.xml'))
+        return xml_obj
 
     def _test_for_new_dell_recovery(self, mount, assembly_tmp):
         """Tests if the distro currently on the system matches the recovery media.
@@ -294,8 +573,7 @@ class Backend(dbus.service.Object):
         """
         logging.debug("_test_for_new_dell_recovery: testing mount %s and assembly_tmp %s" % (mount, assembly_tmp))
 
-        output = fetch_output(['zcat', '/usr/share/doc/dell-recovery/changelog.gz'])
-        package_distro = output.split('\n')[0].split()[2].strip(';')
+        package_distro = changelog_distribution('dell-recovery')
 
         for info in ('info.recovery', 'info'):
             file_path = os.path.join(mount, '.disk', info)
@@ -306,9 +584,7 @@ class Backend(dbus.service.Object):
 
         if rp_distro in package_distro:
             logging.debug("_test_for_new_dell_recovery: Distro %s matches %s", rp_distro, package_distro)
-            from apt.cache import Cache
-            cache = Cache()
-            package_version = cache['dell-recovery'].installed.version
+            package_version = installed_version('dell-recovery')
             rp_version = self.query_have_dell_recovery(mount)
 
             if debian_support.version_compare(package_version, rp_version) > 0:
@@ -316,85 +592,240 @@ class Backend(dbus.service.Object):
                 dest = os.path.join(assembly_tmp, 'debs')
                 if not os.path.isdir(dest):
                     os.makedirs(dest)
-                call = subprocess.Popen(['dpkg-repack', 'dell-recovery'],
-                                        cwd=dest, universal_newlines=True)
-                (out, err) = call.communicate() # pylint: disable=unused-variable
+                self._stage_repacked(dest)
         else:
             logging.debug("_test_for_new_dell_recovery: RP Distro %s doesn't match our distro %s, not injecting updated package", rp_distro, package_distro)
 
 
-    def _process_driver_fish(self, driver_fish, assembly_tmp):
-        """Processes a driver FISH archive"""
+    def _stage_repacked(self, dest, grafts=None):
+        """Stages dell-recovery as installed, repacked once per version"""
+        deb = self.repacks.fetch('dell-recovery')
+        if deb:
+            stage_file(deb, os.path.join(dest, os.path.basename(deb)), grafts)
+
+    def _process_driver_fish(self, driver_fish, assembly_tmp, xml_obj,
+                             grafts=None, md5sums=None):
+        """Processes driver FISH.  Archives are hashed, checked and
+           extracted in one pass, several at once on the worker pool, into
+           staging directories that are merged into the assembly in the
+           order of driver_fish so later FISH still wins on overlapping
+           paths.  Other FISH is staged with stage_file and grafts, and
+           its md5sum kept in md5sums"""
         logging.debug("_process_driver_fish: assmebly_tmp: %s" % assembly_tmp)
-        length = len(driver_fish)
+        pending = []
         for fishie in driver_fish:
-            logging.debug(" processing %s" % fishie)
-            self.report_progress(_('Processing FISH packages'),
-                                 driver_fish.index(fishie)/length*100)
-            if os.path.isfile(fishie):
-                with open(fishie, 'rb') as fish:
-                    md5sum = md5(fish.read()).hexdigest()
-                self.xml_obj.append_fish('driver', os.path.basename(fishie), md5sum)
-            dest = None
-            if fishie.endswith('.deb'):
-                dest = os.path.join(assembly_tmp, 'debs')
-                logging.debug("  Copying debian archive fishie %s", fishie)
-            elif fishie.endswith('.pdf'):
-                dest = os.path.join(assembly_tmp, 'docs')
-                logging.debug("  Copying document fishie fishie %s", fishie)
-            elif fishie.endswith('.py') or fishie.endswith('.sh'):
-                dest = os.path.join(assembly_tmp, 'scripts', 'chroot-scripts', 'fish')
-                logging.debug("  Copying python or shell fishie %s", fishie)
-            elif os.path.exists(fishie) and tarfile.is_tarfile(fishie):
-                nested = False
-                rfd = tarfile.open(fishie)
-                for member in rfd.getmembers():
-                    name = member.get_info()['name']
-                    if name.endswith('.html'):
-                        nested = name
-                        break
-                if nested:
-                    archive_tmp = tempfile.mkdtemp()
-                    atexit.register(walk_cleanup, archive_tmp)
-                    safe_tar_extract(fishie, archive_tmp)
-                    children = []
-                    for child in os.listdir(archive_tmp):
-                        if child != name:
-                            children.append(os.path.join(archive_tmp,child))
+            dest = _fish_destination(fishie, assembly_tmp)
+            staging = None
+            task = None
+            md5sum = None
+            if dest is None and os.path.isfile(fishie):
+                staging = tempfile.mkdtemp(prefix='.fish-', dir=assembly_tmp)
+                task = self.workers.submit(extract_fish_archive, fishie, staging,
+                                           self.fish_cache)
+            elif os.path.isfile(fishie):
+                md5sum = self.digests.get(fishie)
+                if md5sum is None:
+                    task = self.workers.submit(md5sum_file, fishie)
+            pending.append((fishie, dest, staging, task, md5sum))
+
+        length = len(pending)
+        try:
+            for index, (fishie, dest, staging, task, md5sum) in enumerate(pending):
+                logging.debug(" processing %s" % fishie)
+                check_cancelled()
+                self._report_progress(_('Processing FISH packages'),
+                                      index/length*100)
+                result = task.get() if task is not None else None
+                if staging is None:
+                    if result is not None:
+                        self.digests.put(fishie, result)
+                        md5sum = result
+                    if md5sum is not None:
+                        xml_obj.append_fish('driver', os.path.basename(fishie),
+                                            md5sum)
+                    #If we just do a flat copy
+                    if dest is not None:
+                        if not os.path.isdir(dest):
+                            os.makedirs(dest)
+                        stage_file(fishie, os.path.join(dest,
+                                                        os.path.basename(fishie)),
+                                   grafts)
+                        if md5sums is not None and md5sum is not None:
+                            md5sums[os.path.abspath(fishie)] = md5sum
+                    else:
+                        logging.debug("  ignoring fishie %s", fishie)
+                    continue
+
+                xml_obj.append_fish('driver', os.path.basename(fishie),
+                                    result['md5'])
+                if not result['tar'] or result['dangerous']:
+                    logging.debug("  ignoring fishie %s", fishie)
+                    shutil.rmtree(staging, ignore_errors=True)
+                elif result['nested']:
                     logging.debug("  Extracting nested archive %s", fishie)
-                    self._process_driver_fish(children, assembly_tmp)
+                    children = [os.path.join(staging, child)
+                                for child in sorted(os.listdir(staging))
+                                if child != result['nested']]
+                    #staging goes away, so its files can't be grafted
+                    try:
+                        self._process_driver_fish(children, assembly_tmp,
+                                                  xml_obj)
+                    finally:
+                        shutil.rmtree(staging)
                 else:
-                    safe_tar_extract(fishie, assembly_tmp)
                     logging.debug(":  Extracting tar fishie %s", fishie)
+                    merge_tree(staging, assembly_tmp)
                     pre_package = os.path.join(assembly_tmp, 'prepackage.dell')
                     if os.path.exists(pre_package):
                         os.remove(pre_package)
-            else:
-                logging.debug("  ignoring fishie %s", fishie)
+        except BaseException:
+            #don't leave workers writing into the assembly
+            for fishie, dest, staging, task, md5sum in pending:
+                if task is not None:
+                    task.wait()
+            raise
+
+    @_call_scoped
+    def _plan_build(self, base, driver_fish, application_fish, iso, assemble,
+                    sender=None, conn=None):
+        """Measures the inputs of a build without writing anything"""
+        mntdir = self.request_mount(base, "r", sender, conn)
+        if not mntdir:
+            raise CreateFailed("Unable to mount %s" % base)
+        base_bytes = white_tree("size", re.compile(''), mntdir)
+        #assemble_image copies the whole base to its workspace first
+        staged = base_bytes if assemble else 0
+
+        #create_ubuntu copies everything around a nested ISO
+        nested = os.path.join(mntdir, 'ubuntu.iso')
+        if os.path.exists(nested):
+            outer = black_tree("size", re.compile('^ubuntu.iso|^.disk'), mntdir)
+            staged += outer
+            mntdir = self.request_mount(nested, "r", sender, conn)
+            base_bytes = outer + white_tree("size", re.compile(''), mntdir)
+
+        driver_bytes = sum(fish_size(fishie) for fishie in driver_fish)
+        application_bytes = sum(os.path.getsize(fishie)
+                                for fishie in application_fish
+                                if os.path.isfile(fishie))
+        output_free, output_device = volume_free(iso)
+        shared = os.stat(self.workspaces.root).st_dev == output_device
+
+        plan = build_plan(base_bytes, driver_bytes, application_bytes,
+                          initrd_size(mntdir),
+                          os.path.exists(os.path.join(mntdir, 'md5sum.txt')),
+                          self.workspaces.available(), output_free,
+                          staged, shared, self.history.throughput())
+        plan['initrd_tools'] = int(os.path.exists('/usr/bin/unmkinitramfs'))
+        logging.debug("_plan_build: %s" % plan)
+        return plan
+
+    @_call_scoped
+    def _inspect_image(self, iso, sender=None, conn=None):
+        """Works out what type of image iso is without reporting it"""
+        def find_arch(input_str):
+            """Finds the architecture in an input string"""
+            for item in input_str.split():
+                for test in ('amd64', 'i386'):
+                    if test in item:
+                        return test
+            return fetch_output(['dpkg', '--print-architecture']).strip()
 
-            #If we just do a flat copy
-            if dest is not None:
-                if not os.path.isdir(dest):
-                    os.makedirs(dest)
-                shutil.copy(fishie, dest)
+        def find_float(input_str):
+            """Finds the floating point number in a string"""
+            for piece in input_str.split():
+                try:
+                    release = float(piece)
+                except ValueError:
+                    continue
+                logging.debug("query_iso_information: find_float found %d", release)
+                return piece
+            return ''
+        (bto_version, bto_date, bto_platform) = self.query_bto_version(iso, sender, conn)
 
+        distributor_str = 'Unknown Base Image'
+        distributor = ''
+
+        #Ubuntu disks have .disk/info
+        if os.path.isfile(iso) and iso.endswith('.iso'):
+            cmd = ['isoinfo', '-J', '-i', iso, '-x', '/.disk/info']
+            invokation = TimedPopen(cmd, stdout=subprocess.PIPE,
+                                    universal_newlines=True)
+            out, err = invokation.communicate()
+            if invokation.returncode is None:
+                invokation.wait()
+            if out:
+                distributor_str = out
+                distributor = "ubuntu"
+            if err:
+                logging.debug("error during isoinfo invokation: %s", err)
+        else:
+            mntdir = self.request_mount(iso, "r", sender, conn)
+
+            if os.path.exists(os.path.join(mntdir, '.disk', 'info')):
+                with open(os.path.join(mntdir, '.disk', 'info'), 'r') as rfd:
+                    distributor_str = rfd.readline().strip('\n')
+                distributor = "ubuntu"
+
+            #RHEL disks have .discinfo
+            elif os.path.exists(os.path.join(mntdir, '.discinfo')):
+                with open(os.path.join(mntdir, '.discinfo'), 'r') as rfd:
+                    timestamp = rfd.readline().strip('\n') # pylint: disable=unused-variable
+                    distributor_string = rfd.readline().strip('\n') # pylint: disable=unused-variable
+                    arch = rfd.readline().strip('\n')
+                distributor = "redhat"
+                distributor_str += ' ' + arch
+
+        release = find_float(distributor_str)
+        arch = find_arch(distributor_str)
+
+        if bto_version and bto_date:
+            distributor_str = "<b>Dell BTO Image</b>, version %s built on %s\n%s" % (bto_version.split('.')[0], bto_date, distributor_str)
+        elif bto_version == '[native]':
+            distributor_str = "<b>Dell BTO Compatible Image</b>\n%s" % distributor_str
+        else:
+            bto_version = ''
+
+        logging.debug(" returning bto_version %s, distributor %s, release %s, \
+arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, release, arch, distributor_str, bto_platform))
+        return (bto_version, distributor, release, arch, distributor_str, bto_platform)
+
+    def _report_iso_info_item(self, iso, future):
+        """Sends the result of one image inspected by a batch query"""
+        error = ''
+        try:
+            result = future.result()
+        except Exception as msg:
+            logging.warning("query_iso_information_batch: %s failed: %s", iso, msg)
+            result = ('', '', '', '', '', '')
+            error = str(msg)
+        self._emit_from_main_loop(self.report_iso_info_item, iso, *(result + (error,)))
+
+    def _report_package_info_item(self, package, future):
+        """Sends the result of one package validated by a batch"""
+        try:
+            result = future.result()
+        except Exception as msg:
+            logging.warning("validate_driver_packages: %s failed: %s", package, msg)
+            result = (-1, [''], str(msg))
+        self._emit_from_main_loop(self.report_package_info_item, package, *result)
 
     def start_sizable_progress_thread(self, input_str, mnt, w_size):
         """Initializes the extra progress thread, or resets it
            if it already exists'"""
-        self.progress_thread = ProgressBySize(input_str, mnt, w_size)
-        self.progress_thread.progress = self.report_progress
-        self.progress_thread.start()
+        self._local.progress_thread = ProgressBySize(input_str, mnt, w_size)
+        self._local.progress_thread.progress = self._report_progress
+        self._local.progress_thread.start()
 
     def stop_progress_thread(self):
         """Stops the extra thread for reporting progress"""
-        self.progress_thread.join()
+        self._local.progress_thread.join()
 
     def start_pulsable_progress_thread(self, input_str):
         """Starts the extra thread for pulsing progress in the UI"""
-        self.progress_thread = ProgressByPulse(input_str)
-        self.progress_thread.progress = self.report_progress
-        self.progress_thread.start()
+        self._local.progress_thread = ProgressByPulse(input_str)
+        self._local.progress_thread.progress = self._report_progress
+        self._local.progress_thread.start()
     #
     # Client API (through D-BUS)
     #
@@ -417,8 +848,14 @@ class Backend(dbus.service.Object):
         """Closes the backend and cleans up"""
         self._check_polkit_privilege(sender, conn, 'com.dell.recoverymedia.request_exit')
         self._timeout = True
+        if self.jobs.running():
+            logging.debug("request_exit: exiting once running jobs finish")
+            self._exit_requested = True
+            return
         self.main_loop.quit()
 
+    @_call_scoped
+    @_build_recorded
     @dbus.service.method(DBUS_INTERFACE_NAME,
         in_signature = 'sasa{ss}sssssb', out_signature = '', sender_keyword = 'sender',
         connection_keyword = 'conn')
@@ -446,25 +883,36 @@ class Backend(dbus.service.Object):
         self._reset_timeout()
 
         base_mnt = self.request_mount(base, "r", sender, conn)
-
-        assembly_tmp = tempfile.mkdtemp()
-        atexit.register(walk_cleanup, assembly_tmp)
+        xml_obj = self._load_build_xml(base_mnt)
 
         #copy the base iso/mnt point/etc
         white_pattern = re.compile('')
         w_size = white_tree("size", white_pattern, base_mnt)
+        fish_bytes = sum(os.path.getsize(fishie) for fishie in
+                         list(driver_fish) + list(application_fish)
+                         if os.path.isfile(fishie))
+        assembly_tmp = self._allocate_workspace(w_size + fish_bytes, 'assembly')
+        #FISH that could not be staged without a copy, read by xorriso,
+        #and the md5sums of staged FISH
+        grafts = {}
+        md5sums = {}
+        self._build_stage('copy', w_size)
         self.start_sizable_progress_thread(_('Adding in base image'),
                                            assembly_tmp,
                                            w_size)
-        white_tree("copy", white_pattern, base_mnt, assembly_tmp)
+        self.workers.run(white_tree, "copy", white_pattern, base_mnt, assembly_tmp)
         self.stop_progress_thread()
+        check_cancelled()
 
         #Add in driver FISH content
+        self._build_stage('fish', fish_bytes)
         if len(driver_fish) > 0:
             # record the base iso used
-            self.xml_obj.set_base(os.path.basename(base))
+            xml_obj.set_base(os.path.basename(base))
 
-            self._process_driver_fish(driver_fish, assembly_tmp)
+            self._process_driver_fish(driver_fish, assembly_tmp, xml_obj,
+                                      grafts, md5sums)
+            self.digests.save()
             logging.debug("assemble_image: done inserting driver fish")
 
         #Add in application FISH content
@@ -473,33 +921,232 @@ class Backend(dbus.service.Object):
             dest = os.path.join(assembly_tmp, 'srv')
             os.makedirs(dest)
             for fishie in application_fish:
-                with open(fishie, 'rb') as fish:
-                    md5sum = md5(fish.read()).hexdigest()
                 new_name = application_fish[fishie]
-                self.xml_obj.append_fish('application', os.path.basename(fishie), md5sum, new_name)
+                target = new_name
                 if fishie.endswith('.zip'):
-                    new_name += '.zip'
+                    target += '.zip'
                 elif os.path.exists(fishie) and tarfile.is_tarfile(fishie):
-                    new_name += '.tgz'
-                shutil.copyfile(fishie, os.path.join(dest, new_name))
+                    target += '.tgz'
+                md5sum = self.digests.get(fishie)
+                digest = hashlib.md5() if md5sum is None else None
+                method = stage_file(fishie, os.path.join(dest, target), grafts,
+                                    digest)
+                if md5sum is None:
+                    #a copy hashed the data on its way
+                    if method == 'copy':
+                        md5sum = digest.hexdigest()
+                    else:
+                        md5sum = self.workers.run(md5sum_file, fishie)
+                    self.digests.put(fishie, md5sum)
+                md5sums[os.path.abspath(fishie)] = md5sum
+                xml_obj.append_fish('application', os.path.basename(fishie), md5sum, new_name)
+            self.digests.save()
 
         #If dell-recovery needs to be injected into the image
         if dell_recovery_package:
-            self.xml_obj.replace_node_contents('deb_archive', dell_recovery_package)
+            xml_obj.replace_node_contents('deb_archive', dell_recovery_package)
             dest = os.path.join(assembly_tmp, 'debs')
             if not os.path.isdir(dest):
                 os.makedirs(dest)
             if 'dpkg-repack' in dell_recovery_package:
                 logging.debug("Repacking dell-recovery using dpkg-repack")
-                call = subprocess.Popen(['dpkg-repack', 'dell-recovery'],
-                                        cwd=dest, universal_newlines=True)
-                (out, err) = call.communicate() # pylint: disable=unused-variable
+                self._stage_repacked(dest, grafts)
             else:
                 logging.debug("Adding manually included dell-recovery package, %s", dell_recovery_package)
-                shutil.copy(dell_recovery_package, dest)
+                stage_file(dell_recovery_package,
+                           os.path.join(dest,
+                                        os.path.basename(dell_recovery_package)),
+                           grafts)
 
+        self._end_build_stage()
+        check_cancelled()
         function = getattr(Backend, create_fn)
-        function(self, assembly_tmp, version, iso, platform, no_update)
+        function(self, assembly_tmp, version, iso, platform, no_update,
+                 xml_obj=xml_obj, grafts=grafts, md5sums=md5sums)
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+        in_signature = 'sasa{ss}sssssb', out_signature = 's', sender_keyword = 'sender',
+        connection_keyword = 'conn')
+    def start_assemble_image(self,
+                             base,
+                             driver_fish,
+                             application_fish,
+                             dell_recovery_package,
+                             create_fn,
+                             version, iso, platform, no_update, sender=None, conn=None,
+                             stream=None):
+        """Runs assemble_image as a job and returns the job ID right away.
+           Progress and the outcome are sent through report_job_progress
+           and report_job_complete, and to stream (a file descriptor) as
+           JSON records if one is given"""
+        logging.debug("start_assemble_image: base %s, iso %s" % (base, iso))
+
+        self._reset_timeout()
+        self._check_polkit_privilege(sender, conn,
+                                                'com.dell.recoverymedia.create')
+        if create_fn != 'create_ubuntu':
+            raise CreateFailed("Unknown creation function %s" % create_fn)
+
+        return self.jobs.start('assemble_image', sender, self.assemble_image,
+                               base, driver_fish, application_fish,
+                               dell_recovery_package, create_fn, version, iso,
+                               platform, no_update, stream=stream)
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+        in_signature = 'sasa{ss}sssssbh', out_signature = 's', sender_keyword = 'sender',
+        connection_keyword = 'conn')
+    def start_assemble_image_stream(self,
+                                    base,
+                                    driver_fish,
+                                    application_fish,
+                                    dell_recovery_package,
+                                    create_fn,
+                                    version, iso, platform, no_update, stream,
+                                    sender=None, conn=None):
+        """Like start_assemble_image, also writing every progress update
+           and log message of the job to stream as JSON lines"""
+        stream = stream.take()
+        try:
+            return self.start_assemble_image(base, driver_fish, application_fish,
+                                             dell_recovery_package, create_fn,
+                                             version, iso, platform, no_update,
+                                             sender=sender, conn=conn,
+                                             stream=stream)
+        except:
+            os.close(stream)
+            raise
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+        in_signature = 'ssssb', out_signature = 's', sender_keyword = 'sender',
+        connection_keyword = 'conn')
+    def start_create_ubuntu(self, recovery, revision, iso, platform, no_update, sender=None, conn=None,
+                            stream=None):
+        """Runs create_ubuntu as a job and returns the job ID right away"""
+        logging.debug("start_create_ubuntu: recovery %s, iso %s" % (recovery, iso))
+
+        self._reset_timeout()
+        self._check_polkit_privilege(sender, conn,
+                                                'com.dell.recoverymedia.create')
+
+        return self.jobs.start('create_ubuntu', sender, self.create_ubuntu,
+                               recovery, revision, iso, platform, no_update,
+                               stream=stream)
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+        in_signature = 'ssssbh', out_signature = 's', sender_keyword = 'sender',
+        connection_keyword = 'conn')
+    def start_create_ubuntu_stream(self, recovery, revision, iso, platform, no_update, stream,
+                                   sender=None, conn=None):
+        """Like start_create_ubuntu, also writing every progress update
+           and log message of the job to stream as JSON lines"""
+        stream = stream.take()
+        try:
+            return self.start_create_ubuntu(recovery, revision, iso, platform,
+                                            no_update, sender=sender, conn=conn,
+                                            stream=stream)
+        except:
+            os.close(stream)
+            raise
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+        in_signature = 'sasa{ss}s', out_signature = 'a{sx}', sender_keyword = 'sender',
+        connection_keyword = 'conn')
+    def plan_assemble_image(self, base, driver_fish, application_fish, iso,
+                            sender=None, conn=None):
+        """Estimates what assemble_image would need without building.
+           Returns sizes in bytes (base, driver and application FISH,
+           initrd and its unpacked rebuild, staging, output and the space
+           free for both), estimated seconds per stage and in total, and
+           staging_fits/output_fits/initrd_tools flags (1 or 0)"""
+        logging.debug("plan_assemble_image: base %s, iso %s" % (base, iso))
+
+        self._reset_timeout()
+        self._check_polkit_privilege(sender, conn,
+                                                'com.dell.recoverymedia.create')
+        return self._plan_build(base, driver_fish, application_fish, iso,
+                                True, sender, conn)
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+        in_signature = 'ss', out_signature = 'a{sx}', sender_keyword = 'sender',
+        connection_keyword = 'conn')
+    def plan_create_ubuntu(self, recovery, iso, sender=None, conn=None):
+        """Estimates what create_ubuntu would need, like plan_assemble_image"""
+        logging.debug("plan_create_ubuntu: recovery %s, iso %s" % (recovery, iso))
+
+        self._reset_timeout()
+        self._check_polkit_privilege(sender, conn,
+                                                'com.dell.recoverymedia.create')
+        return self._plan_build(recovery, [], {}, iso, False, sender, conn)
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+        in_signature = 's', out_signature = 'b', sender_keyword = 'sender',
+        connection_keyword = 'conn')
+    def cancel_job(self, job_id, sender=None, conn=None):
+        """Asks a job to stop.  Returns False if it isn't running"""
+        logging.debug("cancel_job: %s" % job_id)
+
+        self._reset_timeout()
+        self._check_polkit_privilege(sender, conn,
+                                                'com.dell.recoverymedia.create')
+        return self.jobs.cancel(job_id)
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+        in_signature = 's', out_signature = 'a{ss}', sender_keyword = 'sender',
+        connection_keyword = 'conn')
+    def query_job(self, job_id, sender=None, conn=None):
+        """Describes a job, returns an empty dictionary for unknown jobs"""
+        self._reset_timeout()
+        self._check_polkit_privilege(sender, conn,
+                                                'com.dell.recoverymedia.create')
+        job = self.jobs.get(job_id)
+        if job is None:
+            return {}
+        return job.summary()
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+        in_signature = '', out_signature = 'aa{ss}', sender_keyword = 'sender',
+        connection_keyword = 'conn')
+    def list_jobs(self, sender=None, conn=None):
+        """Describes every running and recently completed job"""
+        self._reset_timeout()
+        self._check_polkit_privilege(sender, conn,
+                                                'com.dell.recoverymedia.create')
+        return [job.summary() for job in self.jobs.jobs()]
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+        in_signature = '', out_signature = 'a{ss}aa{ss}', sender_keyword = 'sender',
+        connection_keyword = 'conn')
+    def query_workspace_usage(self, sender=None, conn=None):
+        """Describes the workspace volume (root, free, reserve, reserved,
+           used...) and every live workspace (path, owner, needed)"""
+        self._reset_timeout()
+        self._check_polkit_privilege(sender, conn,
+                                                'com.dell.recoverymedia.create')
+        return self.workspaces.usage()
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+        in_signature = '', out_signature = 'aa{ss}', sender_keyword = 'sender',
+        connection_keyword = 'conn')
+    def query_command_stats(self, sender=None, conn=None):
+        """Describes the external commands run since the backend started:
+           runs, failures, wall/max_wall/cpu seconds, output bytes and a
+           histogram of wall times"""
+        self._reset_timeout()
+        self._check_polkit_privilege(sender, conn,
+                                                'com.dell.recoverymedia.create')
+        return COMMAND_STATS.commands()
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+        in_signature = '', out_signature = 'a{ss}aa{ss}', sender_keyword = 'sender',
+        connection_keyword = 'conn')
+    def query_build_history(self, sender=None, conn=None):
+        """Describes the builds remembered on this host (builds, finished,
+           failed, cancelled, median_seconds...) and the median duration and
+           throughput of every build stage"""
+        self._reset_timeout()
+        self._check_polkit_privilege(sender, conn,
+                                                'com.dell.recoverymedia.create')
+        return self.history.stats()
 
     @dbus.service.method(DBUS_INTERFACE_NAME,
         in_signature = 's', out_signature = 'ssssss', sender_keyword = 'sender',
@@ -507,80 +1154,37 @@ class Backend(dbus.service.Object):
     def query_iso_information(self, iso, sender=None, conn=None):
         """Queries what type of ISO this is.  This same method will be used regardless
            of OS."""
-        def find_arch(input_str):
-            """Finds the architecture in an input string"""
-            for item in input_str.split():
-                for test in ('amd64', 'i386'):
-                    if test in item:
-                        return test
-            return fetch_output(['dpkg', '--print-architecture']).strip()
-
-        def find_float(input_str):
-            """Finds the floating point number in a string"""
-            for piece in input_str.split():
-                try:
-                    release = float(piece)
-                except ValueError:
-                    continue
-                logging.debug("query_iso_information: find_float found %d", release)
-                return piece
-            return ''
         logging.debug("query_iso_information: iso %s" % iso)
 
         self._reset_timeout()
         self._check_polkit_privilege(sender, conn,
                                 'com.dell.recoverymedia.query_iso_information')
 
-        (bto_version, bto_date, bto_platform) = self.query_bto_version(iso, sender, conn)
-
-        distributor_str = 'Unknown Base Image'
-        distributor = ''
-
-        #Ubuntu disks have .disk/info
-        if os.path.isfile(iso) and iso.endswith('.iso'):
-            cmd = ['isoinfo', '-J', '-i', iso, '-x', '/.disk/info']
-            invokation = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                                          universal_newlines=True)
-            out, err = invokation.communicate()
-            if invokation.returncode is None:
-                invokation.wait()
-            if out:
-                distributor_str = out
-                distributor = "ubuntu"
-            if err:
-                logging.debug("error during isoinfo invokation: %s", err)
-        else:
-            mntdir = self.request_mount(iso, "r", sender, conn)
-
-            if os.path.exists(os.path.join(mntdir, '.disk', 'info')):
-                with open(os.path.join(mntdir, '.disk', 'info'), 'r') as rfd:
-                    distributor_str = rfd.readline().strip('\n')
-                distributor = "ubuntu"
+        result = self._inspect_image(iso, sender, conn)
+        self.report_iso_info(*result)
+        return result
 
-            #RHEL disks have .discinfo
-            elif os.path.exists(os.path.join(mntdir, '.discinfo')):
-                with open(os.path.join(mntdir, '.discinfo'), 'r') as rfd:
-                    timestamp = rfd.readline().strip('\n') # pylint: disable=unused-variable
-                    distributor_string = rfd.readline().strip('\n') # pylint: disable=unused-variable
-                    arch = rfd.readline().strip('\n')
-                distributor = "redhat"
-                distributor_str += ' ' + arch
-
-        release = find_float(distributor_str)
-        arch = find_arch(distributor_str)
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+        in_signature = 'as', out_signature = '', sender_keyword = 'sender',
+        connection_keyword = 'conn')
+    def query_iso_information_batch(self, isos, sender=None, conn=None):
+        """Queries many images at once, BATCH_WORKERS at a time.
+           Returns immediately, each result is sent through
+           report_iso_info_item as soon as it is ready"""
+        logging.debug("query_iso_information_batch: isos %s" % isos)
 
-        if bto_version and bto_date:
-            distributor_str = "<b>Dell BTO Image</b>, version %s built on %s\n%s" % (bto_version.split('.')[0], bto_date, distributor_str)
-        elif bto_version == '[native]':
-            distributor_str = "<b>Dell BTO Compatible Image</b>\n%s" % distributor_str
-        else:
-            bto_version = ''
+        self._reset_timeout()
+        self._check_polkit_privilege(sender, conn,
+                                'com.dell.recoverymedia.query_iso_information')
 
-        self.report_iso_info(bto_version, distributor, release, arch, distributor_str, bto_platform)
-        logging.debug(" returning bto_version %s, distributor %s, release %s, \
-arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, release, arch, distributor_str, bto_platform))
-        return (bto_version, distributor, release, arch, distributor_str, bto_platform)
+        executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+        for iso in isos:
+            future = executor.submit(self._inspect_image, iso, sender, conn)
+            future.add_done_callback(lambda future, iso=iso:
+                                     self._report_iso_info_item(iso, future))
+        executor.shutdown(wait=False)
 
+    @_call_scoped
     @dbus.service.method(DBUS_INTERFACE_NAME,
         in_signature = 's', out_signature = 'sss', sender_keyword = 'sender',
         connection_keyword = 'conn')
@@ -588,20 +1192,18 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
         """Queries the BTO version number internally stored in an ISO or RP"""
 
         def test_initrd(cmd0):
-            """Tests an initrd using the selected command"""
-            cmd1 = ['unlzma']
-            cmd2 = ['cpio', '-it', '--quiet']
-            chain0 = subprocess.Popen(cmd0, stdout=subprocess.PIPE)
-            chain1 = subprocess.Popen(cmd1, stdin=chain0.stdout, stdout=subprocess.PIPE)
-            chain2 = subprocess.Popen(cmd2, stdin=chain1.stdout, stdout=subprocess.PIPE,
-                                      universal_newlines=True)
-            out, err = chain2.communicate() # pylint: disable=unused-variable
-            if chain2.returncode is None:
-                chain2.wait()
-            if out:
-                for line in out.split('\n'):
-                    if 'scripts/casper-bottom/99dell_bootstrap' in line:
-                        return '[native]'
+            """Tests an initrd streamed by the selected command"""
+            chain0 = TimedPopen(cmd0, stdout=subprocess.PIPE)
+            try:
+                found = find_in_initrd(chain0.stdout, BOOTSTRAP_MEMBER)
+            finally:
+                #stop reading as soon as we know the answer
+                if chain0.poll() is None:
+                    chain0.kill()
+                chain0.stdout.close()
+                chain0.wait()
+            if found:
+                return '[native]'
             return ''
         logging.debug("query_bto_version: recovery %s" % recovery)
 
@@ -616,13 +1218,14 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
 
         if os.path.isfile(recovery) and recovery.endswith('.iso'):
             cmd = ['isoinfo', '-J', '-i', recovery, '-x', '/bto.xml']
-            out = fetch_output(cmd)
+            out = fetch_output_bytes(cmd)
             if out:
-                self.xml_obj.load_bto_xml(out)
-                version = self.xml_obj.fetch_node_contents('revision') or \
-                          self.xml_obj.fetch_node_contents('iso')
-                platform = self.xml_obj.fetch_node_contents('platform')
-                date = self.xml_obj.fetch_node_contents('date')
+                xml_obj = BTOxml()
+                xml_obj.load_bto_xml(out)
+                version = xml_obj.fetch_node_contents('revision') or \
+                          xml_obj.fetch_node_contents('iso')
+                platform = xml_obj.fetch_node_contents('platform')
+                date = xml_obj.fetch_node_contents('date')
             else:
                 cmd = ['isoinfo', '-J', '-i', recovery, '-x', '/bto_version']
                 out = fetch_output(cmd)
@@ -637,21 +1240,25 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
         else:
             mntdir = self.request_mount(recovery, "r", sender, conn)
             if os.path.exists(os.path.join(mntdir, 'bto.xml')):
-                self.xml_obj.load_bto_xml(os.path.join(mntdir, 'bto.xml'))
-                version = self.xml_obj.fetch_node_contents('revision') or \
-                          self.xml_obj.fetch_node_contents('iso')
-                platform = self.xml_obj.fetch_node_contents('platform')
-                date = self.xml_obj.fetch_node_contents('date')
+                xml_obj = BTOxml()
+                xml_obj.load_bto_xml(os.path.join(mntdir, 'bto.xml'))
+                version = xml_obj.fetch_node_contents('revision') or \
+                          xml_obj.fetch_node_contents('iso')
+                platform = xml_obj.fetch_node_contents('platform')
+                date = xml_obj.fetch_node_contents('date')
             elif os.path.exists(os.path.join(mntdir, 'bto_version')):
                 with open(os.path.join(mntdir, 'bto_version'), 'r') as rfd:
                     version = rfd.readline().strip('\n')
                     date = rfd.readline().strip('\n')
             #no /bto.xml or /bto_version found, check initrd for bootsrap files
             elif os.path.exists(os.path.join(mntdir, 'casper', 'initrd')):
-                version = test_initrd(['cat', os.path.join(mntdir, 'casper', 'initrd')])
+                with open(os.path.join(mntdir, 'casper', 'initrd'), 'rb') as rfd:
+                    if find_in_initrd(rfd, BOOTSTRAP_MEMBER):
+                        version = '[native]'
 
         return (version, date, platform)
 
+    @_call_scoped
     @dbus.service.method(DBUS_INTERFACE_NAME,
         in_signature = 's', out_signature = 's', sender_keyword = 'sender',
         connection_keyword = 'conn')
@@ -660,19 +1267,12 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
            package suite'''
 
         def run_isoinfo_command(cmd):
-            """Returns the output of an isoinfo command"""
-            invokation = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                                          universal_newlines=True)
-            out, err = invokation.communicate()
-            if invokation.returncode is None:
-                invokation.wait()
-            if err:
-                logging.debug("error invoking isoinfo: %s", err)
-            return out
+            """Yields the output lines of an isoinfo command"""
+            return iter_output_lines(cmd, check=False)
 
         def check_mentions(feed):
-            '''Checks if given file mentions dell-recovery'''
-            for line in feed.split('\n'):
+            '''Checks if given lines mention dell-recovery'''
+            for line in feed:
                 if 'dell-recovery' in line:
                     return line.split()[1]
             return ''
@@ -686,7 +1286,7 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
             cmd = ['isoinfo', '-J', '-i', recovery, '-f']
             logging.debug("query_have_dell_recovery: Checking %s", recovery)
             interesting_files = []
-            for fname in run_isoinfo_command(cmd).split('\n'):
+            for fname in run_isoinfo_command(cmd):
                 if 'dell-recovery' in fname and (fname.endswith('.deb') or fname.endswith('.rpm')):
                     logging.debug("query_have_dell_recovery: Found %s", fname)
                     if '_' in fname:
@@ -710,73 +1310,57 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
                             found = version
         #Recovery partition is mount point or directory
         else:
-            #Search for a flat file first (or a manifest for later)
             logging.debug("query_have_dell_recovery: Searching mount point %s", recovery)
-            interesting_files = []
-            for root, dirs, files in os.walk(recovery, topdown=False):  # pylint: disable=unused-variable
-                for fname in files:
-                    if 'dell-recovery' in fname and (fname.endswith('.deb') or fname.endswith('.rpm')):
-                        logging.debug("query_have_dell_recovery: Found in %s", os.path.join(root, fname))
-                        if '_' in fname:
-                            new = fname.split('_')[1]
-                            if new > found:
-                                found = new
-                        if not found:
-                            found = '1'
-                    elif fname.endswith('.manifest'):
-                        interesting_files.append(os.path.join(root, fname))
-                        logging.debug("query_have_dell_recovery: Appending %s to interesting_files", os.path.join(root, fname))
+
+            #Packages indexes, flat files, and manifests for later
+            found, interesting_files = rp_package_version(recovery,
+                                                          'dell-recovery')
 
             if not found:
                 for fname in interesting_files:
+                    if not os.path.isfile(fname):
+                        continue
                     logging.debug("query_have_dell_recovery: Checking %s ", fname)
-                    with open(fname, 'r') as rfd:
-                        output = rfd.read()
-                    version = check_mentions(output)
+                    with open(fname, 'r', errors='replace') as rfd:
+                        version = check_mentions(rfd)
                     if version:
                         logging.debug("query_have_dell_recovery: Found %s in %s", version, fname)
                         if version > found:
                             found = version
         return found
 
+    def _validate_package(self, package):
+        """Validates a Dell driver package, see PackageValidator.  Returns
+           (valid, description, error_warning)"""
+        return self.packages.validate(package)
+
     @dbus.service.method(DBUS_INTERFACE_NAME,
         in_signature = 's', out_signature = '', sender_keyword = 'sender',
         connection_keyword = 'conn')
     def validate_driver_package(self, package, sender=None, conn=None):
         """Validates a Dell driver package"""
-        logging.debug ("Validating driver package %s" % package)
-        valid = 1
-        description = ['']
-        error_warning = ''
-        if not os.path.exists(package) or not package.endswith('fish.tar.gz'):
-            valid = -1
-            error_warning = 'Bad file name'
-        if valid >= 0:
-            rfd = tarfile.open(package)
-            prepackage = False
-            for name in rfd.getnames():
-                if name.endswith('prepackage.dell'):
-                    prepackage = rfd.getmember(name)
-                    break
-            if not prepackage:
-                valid = -1
-                error_warning = 'Missing or invalid XML descriptor (prepackage.dell)'
-        if valid >= 0:
-            tmpdir = tempfile.mkdtemp()
-            atexit.register(walk_cleanup, tmpdir)
-            rfd.extract(prepackage, tmpdir)
-            rfd.close()
-            self.xml_obj.load_bto_xml(os.path.join(tmpdir, 'prepackage.dell'))
-            our_os = lsb_release.get_os_release()['RELEASE']
-            package_os = self.xml_obj.fetch_node_contents('os')
-            if our_os != package_os:
-                valid = 0
-                error_warning = "OS Version of package %s doesn't match local OS version %s" % (package_os, our_os)
-            description = self.xml_obj.fetch_node_contents('driver')
-        logging.debug("Validation complete: valid %s" % valid)
-        self.report_package_info(valid, description, error_warning)
+        self.report_package_info(*self._validate_package(package))
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+        in_signature = 'as', out_signature = '', sender_keyword = 'sender',
+        connection_keyword = 'conn')
+    def validate_driver_packages(self, packages, sender=None, conn=None):
+        """Validates many driver packages at once, BATCH_WORKERS at a time.
+           Returns immediately, each result is sent through
+           report_package_info_item as soon as it is ready"""
+        logging.debug("validate_driver_packages: packages %s" % packages)
+
+        self._reset_timeout()
+        executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+        for package in packages:
+            future = executor.submit(self._validate_package, package)
+            future.add_done_callback(lambda future, package=package:
+                                     self._report_package_info_item(package,
+                                                                    future))
+        executor.shutdown(wait=False)
 
     #The funcution is used to recovery Dell Hybrid Client
+    @_call_scoped
     @dbus.service.method(DBUS_INTERFACE_NAME,
         in_signature = 'b', out_signature = '', sender_keyword = 'sender',
         connection_keyword = 'conn')
@@ -847,26 +1431,32 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
                         path = line.split('=')[1].strip('\n').strip('"')
                         env['PATH'] = path
 
-        ret = subprocess.call(['/usr/sbin/update-grub'], env=env)
+        ret = timed_call(['/usr/sbin/update-grub'], env=env)
         if ret != 0:
             raise RestoreFailed("error updating grub configuration")
 
-        ret = subprocess.call(['/usr/sbin/grub-reboot', entry])
+        ret = timed_call(['/usr/sbin/grub-reboot', entry])
         if ret != 0:
             raise RestoreFailed("error setting one time grub entry")
 
         if reboot:
             logging.debug("Prepare to reboot")
-            ret = subprocess.call(["/sbin/reboot", "--force"])
+            ret = timed_call(["/sbin/reboot", "--force"])
             if ret != 0:
                 raise RestoreFailed("error invoking reboot")
 
 
+    @_call_scoped
+    @_build_recorded
     @dbus.service.method(DBUS_INTERFACE_NAME,
         in_signature = 'ssssb', out_signature = '', sender_keyword = 'sender',
         connection_keyword = 'conn')
-    def create_ubuntu(self, recovery, revision, iso, platform, no_update, sender=None, conn=None):
-        """Creates Ubuntu compatible recovery media"""
+    def create_ubuntu(self, recovery, revision, iso, platform, no_update, sender=None, conn=None,
+                      xml_obj=None, grafts=None, md5sums=None):
+        """Creates Ubuntu compatible recovery media.
+           xml_obj carries BTO XML data already assembled by assemble_image,
+           grafts the files it staged in recovery without copying them and
+           md5sums the md5sums it already knows of them"""
 
         self._reset_timeout()
         self._check_polkit_privilege(sender, conn,
@@ -874,13 +1464,16 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
         logging.debug("create_ubuntu: recovery %s, revision %s, iso %s, platform %s" %
             (recovery, revision, iso, platform))
 
-        #create temporary workspace
-        tmpdir = tempfile.mkdtemp()
-        atexit.register(walk_cleanup, tmpdir)
-
         #mount the recovery partition
         mntdir = self.request_mount(recovery, "r", sender, conn)
 
+        #files staged in an assembly that are read from elsewhere, unless
+        #later FISH put a file in their place
+        iso_grafts = {}
+        for destination, source in (grafts or {}).items():
+            if not os.path.lexists(destination):
+                iso_grafts['/' + os.path.relpath(destination, recovery)] = source
+
         #validate that ubuntu is on the partition
         if not os.path.exists(os.path.join(mntdir, '.disk', 'info')) and \
            not os.path.exists(os.path.join(mntdir, '.disk', 'info.recovery')):
@@ -889,6 +1482,13 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
                 raise CreateFailed("This tool can not create a recovery image from a Windows recovery partition.")
             raise CreateFailed("Recovery partition is missing critical ubuntu files.")
 
+        if xml_obj is None:
+            xml_obj = self._load_build_xml(mntdir)
+
+        #create temporary workspace
+        tmpdir = self._allocate_workspace(
+            self._create_workspace_size(mntdir, iso, sender, conn), 'create')
+
         #test for an updated dell recovery deb to put in
         if not no_update:
             try:
@@ -897,23 +1497,25 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
                 raise CreateFailed("Error injecting updated Dell Recovery into image.")
 
         #check for a nested ISO image
+        check_cancelled()
         if os.path.exists(os.path.join(mntdir, 'ubuntu.iso')):
             pattern = re.compile('^ubuntu.iso|^.disk')
             w_size = black_tree("size", pattern, mntdir)
+            self._build_stage('copy', w_size)
             self.start_sizable_progress_thread(_('Preparing nested image'),
                                            tmpdir,
                                            w_size)
-            black_tree("copy", pattern, mntdir, tmpdir)
+            self.workers.run(black_tree, "copy", pattern, mntdir, tmpdir)
             self.stop_progress_thread()
+            check_cancelled()
             mntdir = self.request_mount(os.path.join(mntdir, 'ubuntu.iso'), "r", sender, conn)
 
         #Generate BTO XML File
-        self.xml_obj.replace_node_contents('date', str(datetime.date.today()))
-        self.xml_obj.replace_node_contents('iso', os.path.basename(iso))
-        self.xml_obj.replace_node_contents('revision', revision)
-        self.xml_obj.replace_node_contents('platform', platform)
-        self.xml_obj.replace_node_contents('generator', check_version())
-        self.xml_obj.write_xml(os.path.join(tmpdir, 'bto.xml'))
+        xml_obj.replace_node_contents('date', str(datetime.date.today()))
+        xml_obj.replace_node_contents('iso', os.path.basename(iso))
+        xml_obj.replace_node_contents('revision', revision)
+        xml_obj.replace_node_contents('platform', platform)
+        xml_obj.replace_node_contents('generator', check_version())
 
         #Arg list
         xorrisoargs = ['xorriso',
@@ -997,13 +1599,16 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
         #Renerate UUID
         os.mkdir(os.path.join(tmpdir, '.disk'))
         os.mkdir(os.path.join(tmpdir, 'casper'))
+        self._build_stage('initrd', initrd_size(mntdir) * INITRD_EXPANSION)
         self.start_pulsable_progress_thread(_('Regenerating UUID / Rebuilding initramfs'))
         (old_initrd,
          old_uuid) = create_new_uuid(os.path.join(mntdir, 'casper'),
                         os.path.join(mntdir, '.disk'),
                         os.path.join(tmpdir, 'casper'),
-                        os.path.join(tmpdir, '.disk'))
+                        os.path.join(tmpdir, '.disk'),
+                        self.workspaces.root)
         self.stop_progress_thread()
+        check_cancelled()
         xorrisoargs.append('-m')
         xorrisoargs.append(os.path.join('.disk', old_uuid))
         xorrisoargs.append('-m')
@@ -1057,14 +1662,14 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
                                 os.path.join(tmpdir, 'boot', 'grub', 'dell'))
             #fonts
             if not os.path.exists(os.path.join(mntdir, 'boot', 'grub', 'dejavu-sans-12.pf2')):
-                ret = subprocess.call(['grub-mkfont', '/usr/share/fonts/truetype/ttf-dejavu/DejaVuSans.ttf',
-                                       '-s=12', '--output=%s' % os.path.join(tmpdir, 'boot', 'grub', 'dejavu-sans-12.pf2')])
+                ret = timed_call(['grub-mkfont', '/usr/share/fonts/truetype/ttf-dejavu/DejaVuSans.ttf',
+                                 '-s=12', '--output=%s' % os.path.join(tmpdir, 'boot', 'grub', 'dejavu-sans-12.pf2')])
                 if ret != 0:
                     raise CreateFailed("Creating GRUB fonts failed.")
 
             if not os.path.exists(os.path.join(mntdir, 'boot', 'grub', 'dejavu-sans-bold-14.pf2')):
-                ret = subprocess.call(['grub-mkfont', '/usr/share/fonts/truetype/ttf-dejavu/DejaVuSans-Bold.ttf',
-                                       '-s=14', '--output=%s' % os.path.join(tmpdir, 'boot', 'grub', 'dejavu-sans-bold-14.pf2')])
+                ret = timed_call(['grub-mkfont', '/usr/share/fonts/truetype/ttf-dejavu/DejaVuSans-Bold.ttf',
+                                 '-s=14', '--output=%s' % os.path.join(tmpdir, 'boot', 'grub', 'dejavu-sans-bold-14.pf2')])
                 if ret != 0:
                     raise CreateFailed("Creating GRUB fonts failed.")
 
@@ -1077,11 +1682,19 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
                     os.makedirs(os.path.join(tmpdir, 'factory'))
                 shutil.copy(os.path.join(mntdir, path + '.old'), os.path.join(tmpdir, path))
 
+        #Write BTO XML File, with the timings of the stages so far
+        self._end_build_stage()
+        self._add_build_timings(xml_obj)
+        xml_obj.write_xml(os.path.join(tmpdir, 'bto.xml'))
+
         #regenerate md5sum file
         if os.path.exists(os.path.join(mntdir, 'md5sum.txt')):
             xorrisoargs.append('-m')
             xorrisoargs.append(os.path.join(mntdir, 'md5sum.txt'))
-            regenerate_md5sum(tmpdir, mntdir)
+            self._build_stage('checksum')
+            self.workers.run(regenerate_md5sum, tmpdir, mntdir, grafts=iso_grafts,
+                             progress=self._worker_progress(_('Generating checksums')),
+                             md5sums=md5sums)
 
         #ignore any failures on disk
         if os.path.exists(os.path.join(mntdir, 'factory', 'grubenv')):
@@ -1089,15 +1702,25 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
             xorrisoargs.append(os.path.join(mntdir, 'factory', 'grubenv'))
 
         #Directories to install
-        xorrisoargs.append(tmpdir + '/')
-        xorrisoargs.append(mntdir + '/')
+        if iso_grafts:
+            xorrisoargs.append('-graft-points')
+            for iso_path, source in sorted(iso_grafts.items()):
+                xorrisoargs.append('%s=%s' % (_graft_escape(iso_path),
+                                              _graft_escape(source)))
+            xorrisoargs.append(_graft_escape(tmpdir + '/'))
+            xorrisoargs.append(_graft_escape(mntdir + '/'))
+        else:
+            xorrisoargs.append(tmpdir + '/')
+            xorrisoargs.append(mntdir + '/')
 
         #ISO Creation
+        check_cancelled()
+        self._build_stage('iso')
         try:
-            seg1 = subprocess.Popen(xorrisoargs,
-                                  stderr=subprocess.PIPE,
-                                  stdout=subprocess.PIPE,
-                                  universal_newlines=True)
+            seg1 = TimedPopen(xorrisoargs,
+                              stderr=subprocess.PIPE,
+                              stdout=subprocess.PIPE,
+                              universal_newlines=True)
             pipe = seg1.stderr
 
             fcntl.fcntl(
@@ -1113,17 +1736,25 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
                 raise e
 
         logging.debug(" create_ubuntu: xorriso debug")
+        output = ''
         while (retval is None):
-            readx = select.select([pipe.fileno()], [], [])[0]
+            try:
+                check_cancelled()
+            except JobCancelled:
+                seg1.kill()
+                seg1.wait()
+                raise
+            readx = select.select([pipe.fileno()], [], [], 1)[0]
             if readx:
                 output = pipe.read()
                 if output.strip():
                     logging.debug(output.strip())
+                    job_output(output.strip())
                     split = output.split()
                     if (len(split) > 4):
                         progress = split[4]
                         if (progress[-1:] == '%'):
-                            self.report_progress(_('Building ISO'), progress[:-1])
+                            self._report_progress(_('Building ISO'), progress[:-1])
             retval = seg1.poll()
         if retval != 0:
             logging.error(" create_ubuntu: xorriso exited with a nonstandard return value.")
@@ -1132,6 +1763,7 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
             logging.error("  error: %s" % output.strip())
             raise CreateFailed("ISO Building exited unexpectedly:\n%s" %
                                output.strip())
+        self._end_build_stage(os.path.getsize(iso))
 
     @dbus.service.signal(DBUS_INTERFACE_NAME)
     def report_iso_info(self, version, distributor, release, arch, output_text, platform):
@@ -1139,17 +1771,40 @@ arch %s, distributor_str %s, bto_platform %s" % (bto_version, distributor, relea
         '''
         return True
 
+    @dbus.service.signal(DBUS_INTERFACE_NAME)
+    def report_iso_info_item(self, iso, version, distributor, release, arch, output_text, platform, error):
+        '''Report ISO information about one image of a batch query to UI.
+        '''
+        return True
+
     @dbus.service.signal(DBUS_INTERFACE_NAME)
     def report_progress(self, this, that=''):
         '''Report progress of something to UI.
         '''
         return True
 
+    @dbus.service.signal(DBUS_INTERFACE_NAME)
+    def report_job_progress(self, job_id, this, that):
+        '''Report progress of a job to UI.
+        '''
+        return True
+
+    @dbus.service.signal(DBUS_INTERFACE_NAME)
+    def report_job_complete(self, job_id, state, error):
+        '''Report that a job finished, failed or was cancelled to UI.
+        '''
+        return True
+
     @dbus.service.signal(DBUS_INTERFACE_NAME)
     def report_package_info(self, valid, description, error_warning):
         '''Reports package into to U/I'''
         return True
 
+    @dbus.service.signal(DBUS_INTERFACE_NAME)
+    def report_package_info_item(self, package, valid, description, error_warning):
+        '''Reports about one package of a batch validation to U/I'''
+        return True
+
     @dbus.service.signal(DBUS_INTERFACE_NAME)
     def report_package_installed(self, exit_status, msg):
         '''Reports that a package is installed to the U/I'''
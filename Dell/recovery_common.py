@@ -23,11 +23,10 @@
 # Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 ##################################################################################
 
-import dbus.mainloop.glib
+#gi, UDisks, GLib and apt are slow to load and only imported by the
+#functions that need them, so command line tools start quickly
+import dbus
 import subprocess
-import gi
-gi.require_version('UDisks', '2.0')
-from gi.repository import GLib, UDisks
 import os
 import shutil
 import re
@@ -37,9 +36,12 @@ import sys
 import datetime
 import logging
 import hashlib
-import io
-import locale
 import uuid
+import json
+
+from Dell.recovery_dpkg import cached_version
+from Dell.recovery_telemetry import TimedPopen
+from Dell.recovery_pipeline import Pipeline
 
 ##                ##
 ##Common Variables##
@@ -77,10 +79,25 @@ USB_BURNERS = { 'usb-creator':['--iso'],
 
 RP_LABELS = [ 'dualrcvy', 'recovery', 'install', 'os' ]
 
+#Content indexes that may be shipped on a recovery partition
+RP_PATH_INDEX = 'md5sum.txt'
+RP_PACKAGES_INDEXES = [ 'dists/*/*/binary-*/Packages*', 'debs/Packages*' ]
+
+#Top level RP directories that never carry debs or manifests
+RP_WALK_PRUNE = [ 'boot', 'efi', 'EFI', 'efi.factory', 'isolinux',
+                  'srv', 'docs', 'factory', 'preseed', 'scripts' ]
+
 ##                ##
 ##Common Functions##
 ##                ##
 
+def _udisks_client():
+    """Connects to UDisks, loading its bindings the first time"""
+    import gi
+    gi.require_version('UDisks', '2.0')
+    from gi.repository import UDisks
+    return UDisks.Client.new_sync(None)
+
 def black_tree(action, blacklist, src, dst='', base=None):
     """Recursively ACTIONs files from src to dest only
        when they don't match the blacklist outlined in blacklist"""
@@ -229,9 +246,9 @@ def check_vendor():
 def check_rebrand():
     """If on a rebrand system, see if it was originally created
        by Dell"""
-    call = subprocess.Popen(['dmidecode', '--type', '11'],
-                              stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE)
+    call = TimedPopen(['dmidecode', '--type', '11'],
+                      stdout=subprocess.PIPE,
+                      stderr=subprocess.PIPE)
     output = call.communicate()[0].decode()
     if call.returncode != 0:
         print("Unable to run dmidecode:", call.returncode)
@@ -249,7 +266,13 @@ def check_rebrand():
     return False
 
 def check_version(package='dell-recovery'):
-    """Queries the package management system for the current tool version"""
+    """Queries the package management system for the current tool version.
+       The dpkg status file is read directly, python-apt is only used if
+       that fails"""
+    try:
+        return cached_version(package)
+    except OSError as msg:
+        logging.debug("check_version: falling back to apt: %s" % msg)
     try:
         import apt.cache
         cache = apt.cache.Cache()
@@ -288,44 +311,58 @@ def process_conf_file(original, new, uuid, number, recovery_text='', recovery_ty
                     line = line.replace("#REC_TYPE#", recovery_type)
                 output.write(line)
 
-def fetch_output(cmd, data='', environment=os.environ):
-    '''Helper function to just read the output from a command'''
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE,
-                                 stdin=subprocess.PIPE,
-                                 env=environment,
-                                 universal_newlines=True)
-    try:
-        (out, err) = proc.communicate(data)
-    except UnicodeDecodeError as error:
-        logging.warning ("unicode decode error: %s" % error)
-        if locale.getpreferredencoding() != "UTF-8":
-            os.environ["LC_ALL"] = "C.UTF-8"
-            locale.setlocale(locale.LC_ALL, '')
-
-        if sys.stdout.encoding != "utf8":
-            sys.stdout = io.open(sys.stdout.fileno(), 'w', encoding='utf8')
-        if sys.stderr.encoding != "utf8":
-            sys.stderr = io.open(sys.stderr.fileno(), 'w', encoding='utf8')
-        if sys.stdin.encoding != "utf8":
-            sys.stdin = io.open(sys.stdin.fileno(), 'r', encoding='utf8')
-
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE,
-                                     stdin=subprocess.PIPE,
-                                     env=environment,
-                                     universal_newlines=True)
-        (out, err) = proc.communicate(data)
-
-    if proc.returncode is None:
-        proc.wait()
+def fetch_output_bytes(cmd, data=b'', environment=os.environ):
+    '''Runs a command once and returns its output as bytes'''
+    proc = TimedPopen(cmd, stdout=subprocess.PIPE,
+                      stderr=subprocess.PIPE,
+                      stdin=subprocess.PIPE,
+                      env=environment)
+    (out, err) = proc.communicate(data)
     if proc.returncode != 0:
-        error = "Command %s failed with stdout/stderr: %s\n%s" % (cmd, out, err)
+        error = "Command %s failed with stdout/stderr: %s\n%s" % (cmd,
+                out.decode('utf-8', 'replace'), err.decode('utf-8', 'replace'))
         import syslog
         syslog.syslog(error)
         raise RuntimeError(error)
     return out
 
+def fetch_output(cmd, data='', environment=os.environ, errors='replace'):
+    '''Helper function to just read the output from a command
+
+    The output is read once and decoded as UTF-8 with newlines translated.
+    Bytes that can't be decoded are handled according to errors, as in
+    bytes.decode.
+    '''
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    out = fetch_output_bytes(cmd, data, environment)
+    return out.decode('utf-8', errors).replace('\r\n', '\n').replace('\r', '\n')
+
+def iter_output_lines(cmd, environment=os.environ, errors='replace', check=True):
+    '''Runs a command and yields its output line by line as it arrives
+
+    Lines are decoded like fetch_output does and yielded without their
+    newline. The command is killed if the caller stops early. With check,
+    RuntimeError is raised after the last line if the command failed.
+    '''
+    with tempfile.TemporaryFile() as stderr:
+        proc = TimedPopen(cmd, stdout=subprocess.PIPE,
+                          stderr=stderr,
+                          stdin=subprocess.DEVNULL,
+                          env=environment)
+        try:
+            for line in proc.stdout:
+                yield line.decode('utf-8', errors).rstrip('\r\n')
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+        if check and proc.returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError("Command %s failed with stderr: %s" % (cmd,
+                               stderr.read().decode('utf-8', 'replace')))
+
 def find_factory_partition_stats():
     """Uses udisks to find the RP of a system and return stats on it
        Only use this method during bootstrap.
@@ -333,7 +370,7 @@ def find_factory_partition_stats():
     recovery = {}
     labels = RP_LABELS
 
-    udisks = UDisks.Client.new_sync(None)
+    udisks = _udisks_client()
     manager = udisks.get_object_manager()
     for label in labels:
         for item in manager.get_objects():
@@ -437,7 +474,7 @@ def find_burners():
         valid_media_types=[ 'optical_dvd_plus_r', 'optical_dvd_plus_r_dl',
                             'optical_dvd_plus_rw', 'optical_dvd_r',
                             'optical_dvd_ram', 'optical_dvd_rw' ]
-        udisks = UDisks.Client.new_sync(None)
+        udisks = _udisks_client()
         manager = udisks.get_object_manager()
         for item in manager.get_objects():
             drive = item.get_drive()
@@ -539,12 +576,123 @@ def walk_cleanup(directory):
                     os.remove(full_name)
         os.rmdir(directory)
 
+def _open_index(fname):
+    """Opens a possibly compressed index file for text reading"""
+    if fname.endswith('.gz'):
+        import gzip
+        return gzip.open(fname, 'rt', errors='replace')
+    if fname.endswith('.xz'):
+        import lzma
+        return lzma.open(fname, 'rt', errors='replace')
+    return open(fname, 'r', errors='replace')
+
+def rp_packages_version(root, package):
+    """Looks up a package in the Packages indexes of a recovery tree.
+       Returns the newest version listed, or '' if it's not listed.
+       Returns None if the tree carries no Packages index at all"""
+    indexes = {}
+    for pattern in RP_PACKAGES_INDEXES:
+        for fname in sorted(glob.glob(os.path.join(root, pattern))):
+            base, ext = os.path.splitext(fname)
+            if ext not in ('', '.gz', '.xz'):
+                continue
+            if not ext:
+                base = fname
+            #prefer the uncompressed copy of each index
+            if base not in indexes or not ext:
+                indexes[base] = fname
+    if not indexes:
+        return None
+
+    found = ''
+    for fname in indexes.values():
+        logging.debug("rp_packages_version: reading %s", fname)
+        with _open_index(fname) as rfd:
+            current = ''
+            for line in rfd:
+                if line.startswith('Package:'):
+                    current = line.split(':', 1)[1].strip()
+                elif line.startswith('Version:') and current == package:
+                    version = line.split(':', 1)[1].strip()
+                    if version > found:
+                        found = version
+    return found
+
+def rp_index_paths(root):
+    """Iterates the relative paths listed in a recovery tree's md5sum.txt.
+       Returns None if the tree isn't indexed"""
+    index = os.path.join(root, RP_PATH_INDEX)
+    if not os.path.isfile(index):
+        return None
+
+    def _paths():
+        with open(index, 'r', errors='replace') as rfd:
+            for line in rfd:
+                #'<md5>  ./relative/path'
+                split = line.rstrip('\n').split('  ./', 1)
+                if len(split) == 2:
+                    yield split[1]
+    return _paths()
+
+def rp_walk_paths(root):
+    """Walks a recovery tree one directory at a time, skipping directories
+       that never carry packages.  Yields a list of relative file paths per
+       directory"""
+    for parent, dirs, files in os.walk(root, topdown=True):
+        if parent == root:
+            dirs[:] = [item for item in dirs if item not in RP_WALK_PRUNE]
+        relative = os.path.relpath(parent, root)
+        if relative == '.':
+            yield files
+        else:
+            yield [os.path.join(relative, fname) for fname in files]
+
+def rp_package_version(root, package):
+    """Looks for package in a recovery tree: in its Packages indexes, among
+       the files listed in md5sum.txt (or found walking the tree) and in
+       debs/, where updated packages are injected.  Returns the highest
+       version found ('1' for a package file without one, '' if there is
+       none) and the .manifest files seen, as full paths"""
+    found = rp_packages_version(root, package) or ''
+    if found:
+        logging.debug("rp_package_version: Found %s in Packages index", found)
+
+    batches = rp_index_paths(root)
+    if batches is None:
+        batches = rp_walk_paths(root)
+    else:
+        logging.debug("rp_package_version: Using path index")
+        #debs/ may have been filled in after md5sum.txt was written
+        debs = os.path.join(root, 'debs')
+        batches = [batches]
+        if os.path.isdir(debs):
+            batches.append([os.path.join('debs', fname)
+                            for fname in os.listdir(debs)])
+    manifests = []
+    for batch in batches:
+        for fname in batch:
+            name = os.path.basename(fname)
+            if package in name and (name.endswith('.deb') or name.endswith('.rpm')):
+                logging.debug("rp_package_version: Found in %s", fname)
+                if '_' in name:
+                    new = name.split('_')[1]
+                    if new > found:
+                        found = new
+                if not found:
+                    found = '1'
+            elif name.endswith('.manifest'):
+                path = os.path.join(root, fname)
+                if path not in manifests:
+                    manifests.append(path)
+    return found, manifests
+
 def create_new_uuid(old_initrd_directory, old_casper_directory,
-                    new_initrd_directory, new_casper_directory):
+                    new_initrd_directory, new_casper_directory, workdir=None):
     """ Regenerates the UUID contained in a casper initramfs
         Returns full path of the old initrd and casper files (for blacklisting)
+        The initramfs is unpacked below workdir (default: the temp dir)
     """
-    tmpdir = tempfile.mkdtemp()
+    tmpdir = tempfile.mkdtemp(dir=workdir)
 
     #Detect the old initramfs stuff
     try:
@@ -565,8 +713,8 @@ def create_new_uuid(old_initrd_directory, old_casper_directory,
                  (old_initrd_file, old_uuid_file))
 
     #Extract old initramfs with the new format
-    chain0 = subprocess.Popen(["/usr/bin/unmkinitramfs", old_initrd_file, "."],
-                            stdout=subprocess.PIPE, cwd=tmpdir)
+    chain0 = TimedPopen(["/usr/bin/unmkinitramfs", old_initrd_file, "."],
+                        stdout=subprocess.PIPE, cwd=tmpdir)
     chain0.communicate()
 
     #Generate new UUID
@@ -583,7 +731,7 @@ def create_new_uuid(old_initrd_directory, old_casper_directory,
             uuid_fd.write("%s\n" % new_uuid)
 
     #Add bootstrap to initrd
-    chain0 = subprocess.Popen(['/usr/share/dell/casper/hooks/dell-bootstrap'], env={'DESTDIR': initramfs_root, 'INJECT': '1'})
+    chain0 = TimedPopen(['/usr/share/dell/casper/hooks/dell-bootstrap'], env={'DESTDIR': initramfs_root, 'INJECT': '1'})
     chain0.communicate()
 
     #Detect compression
@@ -616,19 +764,12 @@ def create_new_uuid(old_initrd_directory, old_casper_directory,
         root = os.path.join(tmpdir, component)
         if not os.path.exists (root):
             continue
-        chain0 = subprocess.Popen(['find'], cwd=root,
-                                stdout=subprocess.PIPE)
-        chain1 = subprocess.Popen(['cpio', '--quiet', '-o', '-H', 'newc'],
-                                cwd=root, stdin=chain0.stdout,
-                                stdout=subprocess.PIPE)
+        commands = [['find'], ['cpio', '--quiet', '-o', '-H', 'newc']]
+        if component == 'main':
+            commands.append(compress_command)
+        #stream the archive straight into the initrd
         with open(new_initrd_file, 'ab') as initrd_fd:
-            if component == 'main':
-                chain2 = subprocess.Popen(compress_command,
-                                        stdin=chain1.stdout,
-                                        stdout=subprocess.PIPE)
-                initrd_fd.write(chain2.communicate()[0])
-            else:
-                initrd_fd.write(chain1.communicate()[0])
+            Pipeline(commands, cwd=root).run(initrd_fd)
 
     walk_cleanup(tmpdir)
 
@@ -761,6 +902,7 @@ def dbus_sync_call_signal_wrapper(dbus_iface, func, handler_map, *args, **kwargs
         _h_exception_exc = exception
         loop.quit()
 
+    from gi.repository import GLib
     loop = GLib.MainLoop()
     global _h_reply_result, _h_exception_exc
     _h_reply_result = None
@@ -776,11 +918,99 @@ def dbus_sync_call_signal_wrapper(dbus_iface, func, handler_map, *args, **kwargs
         raise _h_exception_exc
     return _h_reply_result
 
+def dbus_job_wrapper(dbus_iface, func, progress_handler, *args):
+    '''Start a backend job and wait for it while receiving its progress.
+
+    func is one of the backend's start_* methods. progress_handler is
+    called with (message, percent) for every report_job_progress of this
+    job. The job is cancelled if the wait is interrupted, and CreateFailed
+    is raised unless it finished.
+    '''
+    from gi.repository import GLib
+    loop = GLib.MainLoop()
+    result = {'id': None, 'state': '', 'error': ''}
+
+    def _h_progress(job_id, this, that):
+        """protected method to forward progress of our job"""
+        if job_id == result['id']:
+            progress_handler(this, that)
+
+    def _h_complete(job_id, state, error):
+        """protected method to catch the end of our job"""
+        if job_id == result['id']:
+            result['state'] = state
+            result['error'] = error
+            loop.quit()
+
+    dbus_iface.connect_to_signal('report_job_progress', _h_progress)
+    dbus_iface.connect_to_signal('report_job_complete', _h_complete)
+    result['id'] = dbus_iface.get_dbus_method(func)(*args)
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        dbus_iface.cancel_job(result['id'])
+        raise
+    if result['state'] != 'finished':
+        raise CreateFailed("Job %s %s: %s" % (result['id'], result['state'],
+                                              result['error']))
+    return result['id']
+
+def dbus_job_stream_wrapper(dbus_iface, func, progress_handler, log_handler,
+                            *args, eta_handler=None):
+    '''Start a backend job that reports over a private pipe and follow it.
+
+    func is one of the backend's start_*_stream methods. Instead of
+    listening to signals, JSON records the backend writes to the pipe are
+    read: progress_handler is called with (message, percent) for every
+    progress update and log_handler, if given, with (level, message) for
+    every log record. eta_handler, if given, is called with the seconds
+    the job has left before every progress update that comes with an
+    estimate. The job is cancelled if reading is interrupted, and
+    CreateFailed is raised unless it finished.
+    '''
+    rfd, wfd = os.pipe()
+    try:
+        job_id = dbus_iface.get_dbus_method(func)(*(args +
+                                                    (dbus.types.UnixFd(wfd),)))
+    finally:
+        os.close(wfd)
+    record = {'state': '', 'error': 'stream closed before the job completed'}
+    try:
+        with os.fdopen(rfd) as stream:
+            for line in stream:
+                record = json.loads(line)
+                if record['type'] == 'progress':
+                    if eta_handler and record.get('eta'):
+                        eta_handler(int(record['eta']))
+                    progress_handler(record['message'], record['percent'])
+                elif record['type'] == 'log' and log_handler:
+                    log_handler(record['level'], record['message'])
+                elif record['type'] == 'complete':
+                    break
+    except KeyboardInterrupt:
+        dbus_iface.cancel_job(job_id)
+        raise
+    if record.get('state') != 'finished':
+        raise CreateFailed("Job %s %s: %s" % (job_id, record.get('state'),
+                                              record.get('error')))
+    return job_id
+
+
+def md5sum_file(path):
+    '''Returns the md5 hex digest of a file, read in chunks.'''
+    digest = hashlib.md5()
+    with open(path, 'rb') as rfd:
+        for chunk in iter(lambda: rfd.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-def regenerate_md5sum(root_dir,sec_dir=None):
+def regenerate_md5sum(root_dir,sec_dir=None,progress=None,grafts=None,md5sums=None):
     '''generate the md5sum.txt when building the ISO image.
 
     No matter whether the md5sum.txt exits or not, we will walk through the files and then build a new file.
+    If given, progress is called with the percentage of files summed so far.
+    grafts maps paths on the medium to files outside of both directories,
+    md5sums the files whose md5sum is already known to it.
     '''
     #check and delete the previsous md5sum.txt if the root dir exists md5sum.txt file
     if os.path.exists(os.path.join(root_dir, 'md5sum.txt')):
@@ -796,27 +1026,40 @@ def regenerate_md5sum(root_dir,sec_dir=None):
         for f in files:
             if f not in uncheck_list:
                 root_list.append(os.path.join(root,f))
+    #check the secondary dir or not for building ISO image by dell recovery
+    sec_list = []
+    if sec_dir:
+        root_set = set(root_list)
+        for root,dirs,files in os.walk(sec_dir):
+            for f in files:
+                if f not in uncheck_list:
+                    full_path = os.path.join(root,f)
+                    if root_dir + full_path.split(sec_dir)[1] not in root_set:
+                        sec_list.append(full_path)
+    graft_list = sorted((grafts or {}).items())
+    total = len(root_list) + len(sec_list) + len(graft_list)
     #sum md5 then write into file function
-    def md5sum(fd,path,root):
-        file_path = '.' + path.split(root)[1]
-        md5 = hashlib.md5(open(path,'rb').read()).hexdigest()
+    def md5sum(fd,path,file_path,known=None):
+        md5 = known or md5sum_file(path)
         content = md5+"  "+file_path+"\n"
         fd.write(content)
 
     with open(os.path.join(root_dir, 'md5sum.txt'),'w') as wfd:
         wfd.write(head_info)
         try:
-            #write the md5 of root file list
-            for full_path in root_list:
-                md5sum(wfd,full_path,root_dir)
-            #check the secondary dir or not for building ISO image by dell recovery
-            if sec_dir:
-                for root,dirs,files in os.walk(sec_dir):
-                    for f in files:
-                        if f not in uncheck_list:
-                            full_path = os.path.join(root,f)
-                            if root_dir + full_path.split(sec_dir)[1] not in root_list:
-                                md5sum(wfd,full_path,sec_dir)
+            #write the md5 of root file list, then the secondary dir
+            done = 0
+            #grafted files may have been hashed before
+            known = md5sums or {}
+            for full_path, file_path, md5 in \
+                    [(path, '.' + path.split(root_dir)[1], None) for path in root_list] + \
+                    [(path, '.' + path.split(sec_dir)[1], None) for path in sec_list] + \
+                    [(source, '.' + iso_path, known.get(source))
+                     for iso_path, source in graft_list]:
+                md5sum(wfd,full_path,file_path,md5)
+                done += 1
+                if progress:
+                    progress(done * 100 // total)
         except Exception as err:
             import syslog
             syslog.syslog("rewrite the md5sum.txt file failed with : %s" %(err))
@@ -825,7 +1068,7 @@ def transfer_dmraid_path(source_path):
     """two direction change the dmraid path representive
        sample : /dev/dm-X --> /dev/mapper/isw*
     """
-    udisks = UDisks.Client.new_sync(None)
+    udisks = _udisks_client()
     manager = udisks.get_object_manager()
     for item in manager.get_objects():
         block = item.get_block()
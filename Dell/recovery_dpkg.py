@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# «recovery_dpkg» - Installed package information without apt
+#
+# Copyright (C) 2020, Dell Inc.
+#
+# This is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this application; if not, write to the Free Software Foundation, Inc., 51
+# Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+
+import glob
+import gzip
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from Dell.recovery_telemetry import TimedPopen
+
+DPKG_STATUS = '/var/lib/dpkg/status'
+
+REPACK_CACHE = '/var/cache/dell-recovery/repack'
+
+def read_status(package, status=DPKG_STATUS):
+    """Returns the fields of package in the dpkg status file, None if it
+       is not there.  Only the stanza of package is parsed"""
+    fields = None
+    key = None
+    with open(status, encoding='utf-8', errors='replace') as rfd:
+        for line in rfd:
+            if fields is None:
+                if line.startswith('Package: ') and \
+                   line[len('Package: '):].strip() == package:
+                    fields = {'Package': package}
+                continue
+            if not line.strip():
+                break
+            if line[0] in ' \t' and key is not None:
+                fields[key] += '\n' + line.rstrip('\n')
+            elif ':' in line:
+                key, value = line.split(':', 1)
+                fields[key] = value.strip()
+    return fields
+
+#(package, status file): ((status mtime, size), version) of the lookups
+_VERSIONS = {}
+_VERSIONS_LOCK = threading.Lock()
+
+def cached_version(package, status=DPKG_STATUS):
+    """Returns the version of package if it is installed, otherwise None.
+       The status file is only read again once it changed.  Raises OSError
+       if it can't be read"""
+    stat = os.stat(status)
+    changed = (stat.st_mtime_ns, stat.st_size)
+    with _VERSIONS_LOCK:
+        cached = _VERSIONS.get((package, status))
+    if cached is not None and cached[0] == changed:
+        return cached[1]
+    fields = read_status(package, status)
+    version = None
+    if fields and fields.get('Status', '').endswith(' installed'):
+        version = fields.get('Version')
+    with _VERSIONS_LOCK:
+        _VERSIONS[(package, status)] = (changed, version)
+    return version
+
+def installed_version(package, status=DPKG_STATUS):
+    """Returns the version of package if it is installed, otherwise None"""
+    try:
+        return cached_version(package, status)
+    except OSError as msg:
+        logging.warning('installed_version: %s', msg)
+        return None
+
+def changelog_distribution(package, doc='/usr/share/doc'):
+    """Returns the distribution of the latest changelog entry of package"""
+    with gzip.open(os.path.join(doc, package, 'changelog.gz'), 'rt',
+                   encoding='utf-8', errors='replace') as rfd:
+        return rfd.readline().split()[2].strip(';')
+
+class RepackCache:
+    """Debian packages rebuilt from installed packages by dpkg-repack,
+       kept until the package version or the dpkg status changes"""
+    command = ['dpkg-repack']
+
+    def __init__(self, path=REPACK_CACHE, status=DPKG_STATUS):
+        self.path = path
+        self.status = status
+        self._lock = threading.Lock()
+
+    def _key(self, package):
+        """Names the entry of the installed package, None if it is not"""
+        version = installed_version(package, self.status)
+        if version is None:
+            return None
+        return '%s_%s_%d' % (package, version.replace(':', '%3a'),
+                             os.stat(self.status).st_mtime_ns)
+
+    def fetch(self, package='dell-recovery'):
+        """Returns the path of a repacked package, running dpkg-repack
+           only if the cache has none for the installed version"""
+        with self._lock:
+            key = self._key(package)
+            if key is None:
+                logging.warning('RepackCache: %s is not installed', package)
+                return None
+            entry = os.path.join(self.path, key)
+            debs = glob.glob(os.path.join(entry, '*.deb'))
+            if debs:
+                logging.debug('RepackCache: reusing %s', debs[0])
+                return debs[0]
+
+            os.makedirs(self.path, exist_ok=True)
+            staging = tempfile.mkdtemp(prefix='.new-', dir=self.path)
+            try:
+                call = TimedPopen(self.command + [package], cwd=staging,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE,
+                                  universal_newlines=True)
+                (out, err) = call.communicate()
+                debs = glob.glob(os.path.join(staging, '*.deb'))
+                if call.returncode != 0 or not debs:
+                    logging.warning('RepackCache: %s failed: %s',
+                                    ' '.join(self.command), err.strip())
+                    return None
+                #only the entry for the installed version is kept
+                for old in glob.glob(os.path.join(self.path, package + '_*')):
+                    shutil.rmtree(old, ignore_errors=True)
+                os.rename(staging, entry)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+            logging.debug('RepackCache: repacked %s', package)
+            return os.path.join(entry, os.path.basename(debs[0]))
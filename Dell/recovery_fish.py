@@ -0,0 +1,519 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# «recovery_fish» - Single pass processing of FISH archives
+#
+# Copyright (C) 2020, Dell Inc.
+#
+# This is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this application; if not, write to the Free Software Foundation, Inc., 51
+# Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+
+from Dell.recovery_xml import BTOxml
+
+CHUNK_SIZE = 1024 * 1024
+
+FISH_CACHE = '/var/cache/dell-recovery/fish'
+
+#Bytes of extracted FISH kept, the least recently used go first
+FISH_CACHE_LIMIT = 4 * 1024 * 1024 * 1024
+
+DIGEST_CACHE = '/var/cache/dell-recovery/digests.json'
+
+#How many files DigestCache remembers
+DIGEST_CACHE_LIMIT = 2000
+
+#How many driver package validations PackageValidator remembers
+PACKAGE_CACHE_LIMIT = 256
+
+#ioctl cloning a file on copy on write file systems (linux/fs.h)
+FICLONE = 0x40049409
+
+class HashingReader:
+    """A read only file object hashing everything read through it"""
+    def __init__(self, fileobj, algorithm='md5'):
+        self.fileobj = fileobj
+        self.digest = hashlib.new(algorithm)
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.digest.update(data)
+        return data
+
+    def drain(self):
+        """Hashes the rest of the file and returns the hex digest"""
+        while self.read(CHUNK_SIZE):
+            pass
+        return self.digest.hexdigest()
+
+def dangerous_member(member):
+    """Whether extracting a tar member could write outside of the
+       destination"""
+    name = member.name
+    if name.startswith('/') or name.startswith('..'):
+        return True
+    return os.path.normpath(name).split(os.sep)[0] == '..'
+
+def _extract_options():
+    """Extraction filter keeping the historical tar semantics where the
+       tarfile module supports filters"""
+    if hasattr(tarfile, 'tar_filter'):
+        return {'filter': 'tar'}
+    return {}
+
+def extract_fish_archive(filename, destination, cache=None):
+    """Reads a FISH file once: hashes it and, if it is a tarball, checks
+       and extracts its members into destination as they are decompressed.
+       With a FishCache, a package extracted before is linked from it
+       instead.
+
+       Returns a dictionary with the md5sum of the file, whether it was a
+       tarball, whether it was rejected for a dangerous member name and the
+       first .html member, which marks a nested FISH package"""
+    if cache is not None:
+        result = cache.materialize(filename, destination)
+        if result is not None:
+            return result
+    result = {'md5': None, 'tar': False, 'dangerous': False, 'nested': None}
+    with open(filename, 'rb') as rfd:
+        reader = HashingReader(rfd)
+        try:
+            archive = tarfile.open(fileobj=reader, mode='r|*')
+        except tarfile.TarError:
+            archive = None
+        if archive is not None:
+            result['tar'] = True
+            options = _extract_options()
+            try:
+                for member in archive:
+                    if dangerous_member(member):
+                        logging.warning('extract_fish_archive: %s has the '
+                                        'dangerous member %s, not extracting',
+                                        filename, member.name)
+                        result['dangerous'] = True
+                        break
+                    if result['nested'] is None and member.name.endswith('.html'):
+                        result['nested'] = member.name
+                    archive.extract(member, destination, **options)
+            finally:
+                archive.close()
+        result['md5'] = reader.drain()
+    if result['dangerous']:
+        shutil.rmtree(destination, ignore_errors=True)
+    logging.debug('extract_fish_archive: %s to %s: %s', filename,
+                  destination, result)
+    if cache is not None and result['tar'] and not result['dangerous']:
+        cache.store(filename, destination, result)
+    return result
+
+def _replace(source, path):
+    """Renames source to path, whatever path was before"""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+    os.rename(source, path)
+
+def merge_tree(source, destination):
+    """Moves everything in source into destination, replacing the files
+       that are already there, and removes source.  Both must be on the
+       same file system"""
+    for root, dirs, files in os.walk(source):
+        target = os.path.join(destination, os.path.relpath(root, source))
+        for name in list(dirs):
+            path = os.path.join(target, name)
+            if os.path.isdir(path) and not os.path.islink(path) and \
+               not os.path.islink(os.path.join(root, name)):
+                continue
+            #directories that are not there yet move in one rename
+            dirs.remove(name)
+            _replace(os.path.join(root, name), path)
+        for name in files:
+            _replace(os.path.join(root, name), os.path.join(target, name))
+    shutil.rmtree(source)
+
+def stage_file(source, destination, grafts=None, digest=None):
+    """Puts source at destination without copying the data where
+       possible: by a hardlink, or a clone on copy on write file systems.
+       Otherwise, if grafts is a dictionary, destination is mapped to source
+       in it for the ISO to be built from, else source is copied, updating
+       digest (a hashlib object) with the data on its way.  Returns
+       'link', 'reflink', 'graft' or 'copy'"""
+    #never write through a link into whatever destination was
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+        return 'link'
+    except OSError:
+        pass
+    with open(source, 'rb') as rfd, open(destination, 'wb') as wfd:
+        try:
+            fcntl.ioctl(wfd.fileno(), FICLONE, rfd.fileno())
+            method = 'reflink'
+        except OSError:
+            method = 'graft' if grafts is not None else 'copy'
+            if method == 'copy':
+                for chunk in iter(lambda: rfd.read(CHUNK_SIZE), b''):
+                    if digest is not None:
+                        digest.update(chunk)
+                    wfd.write(chunk)
+    if method == 'graft':
+        os.remove(destination)
+        grafts[destination] = os.path.abspath(source)
+    else:
+        shutil.copystat(source, destination)
+    return method
+
+def _signature(filename):
+    """Identifies a file by name, inode, size and modification time"""
+    stat = os.stat(filename)
+    return hashlib.sha1(('%s:%d:%d:%d:%d' % (os.path.abspath(filename),
+                                             stat.st_dev, stat.st_ino,
+                                             stat.st_size,
+                                             stat.st_mtime_ns)).encode('utf-8',
+                                             'surrogateescape')).hexdigest()
+
+def _file_md5(path):
+    """Returns the md5sum of the file at path"""
+    with open(path, 'rb') as rfd:
+        return HashingReader(rfd).drain()
+
+def _file_state(path):
+    """Describes a regular file: its size, modification time, mode and
+       owner, and last the md5sum of its contents"""
+    stat = os.lstat(path)
+    return ['file', stat.st_size, stat.st_mtime_ns, stat.st_mode,
+            stat.st_uid, stat.st_gid, _file_md5(path)]
+
+def _manifest(tree):
+    """Describes every entry of tree so a later change can be noticed"""
+    files = {}
+    for root, dirs, names in os.walk(tree):
+        for name in dirs + names:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, tree)
+            if os.path.islink(path):
+                files[relative] = ['link', os.readlink(path)]
+            elif os.path.isdir(path):
+                files[relative] = ['dir']
+            else:
+                files[relative] = _file_state(path)
+    return files
+
+class FishCache:
+    """Extracted driver FISH packages keyed by the md5sum of the package,
+       reused by later builds through hardlinks.
+
+       Each entry is a directory named after the md5sum holding the
+       extracted tree and a manifest, whose modification time is its last
+       use.  Packages are found again without reading them by a signature
+       of their path, inode, size and modification time.  As the cached
+       files share their inodes with earlier assemblies, their contents,
+       mode and owner are checked against the manifest before every reuse."""
+    def __init__(self, path=FISH_CACHE, limit=FISH_CACHE_LIMIT):
+        self.path = path
+        self.limit = limit
+
+    def _entry(self, md5):
+        """Returns the directory of the entry for md5"""
+        return os.path.join(self.path, md5)
+
+    def _lookup(self, filename):
+        """Returns the md5sum of a package seen before, or None"""
+        try:
+            with open(os.path.join(self.path, 'signatures',
+                                   _signature(filename))) as rfd:
+                return rfd.readline().strip()
+        except OSError:
+            return None
+
+    def _load(self, md5):
+        """Returns the manifest of an entry if its tree is unchanged,
+           otherwise drops the entry"""
+        entry = self._entry(md5)
+        try:
+            with open(os.path.join(entry, 'manifest.json')) as rfd:
+                manifest = json.load(rfd)
+            tree = os.path.join(entry, 'tree')
+            for relative, expected in manifest['files'].items():
+                path = os.path.join(tree, relative)
+                stat = os.lstat(path)
+                if expected[0] == 'file' and \
+                   [stat.st_size, stat.st_mtime_ns, stat.st_mode, stat.st_uid,
+                    stat.st_gid] != expected[1:6]:
+                    raise ValueError('%s changed' % relative)
+                if expected[0] == 'link' and os.readlink(path) != expected[1]:
+                    raise ValueError('%s changed' % relative)
+            #contents last, only once nothing cheaper gave a change away
+            for relative, expected in manifest['files'].items():
+                if expected[0] == 'file' and \
+                   _file_md5(os.path.join(tree, relative)) != expected[6]:
+                    raise ValueError('%s changed' % relative)
+            return manifest
+        except (OSError, ValueError, KeyError) as msg:
+            if os.path.exists(entry):
+                logging.warning('FishCache: dropping %s: %s', md5, msg)
+                shutil.rmtree(entry, ignore_errors=True)
+            return None
+
+    def materialize(self, filename, destination):
+        """Links the cached tree of filename into destination and returns
+           its extraction result, or None if it is not cached"""
+        md5 = self._lookup(filename)
+        if md5 is None:
+            return None
+        manifest = self._load(md5)
+        if manifest is None:
+            return None
+        tree = os.path.join(self._entry(md5), 'tree')
+        try:
+            os.makedirs(destination, exist_ok=True)
+            for relative, kind in sorted(manifest['files'].items()):
+                path = os.path.join(destination, relative)
+                if kind[0] == 'dir':
+                    os.makedirs(path, exist_ok=True)
+                elif kind[0] == 'link':
+                    os.symlink(kind[1], path)
+                else:
+                    stage_file(os.path.join(tree, relative), path)
+            os.utime(os.path.join(self._entry(md5), 'manifest.json'))
+        except OSError as msg:
+            #evicted meanwhile, extract it again
+            logging.debug('FishCache: could not reuse %s: %s', md5, msg)
+            shutil.rmtree(destination, ignore_errors=True)
+            return None
+        logging.debug('FishCache: reused %s for %s', md5, filename)
+        return manifest['result']
+
+    def store(self, filename, tree, result):
+        """Adds the extracted tree of filename, then trims the cache"""
+        md5 = result['md5']
+        try:
+            os.makedirs(os.path.join(self.path, 'signatures'), exist_ok=True)
+            if self._load(md5) is None:
+                staging = tempfile.mkdtemp(prefix='.new-', dir=self.path)
+                try:
+                    copy = os.path.join(staging, 'tree')
+                    shutil.copytree(tree, copy, symlinks=True,
+                                    copy_function=stage_file)
+                    files = _manifest(copy)
+                    size = sum(kind[1] for kind in files.values()
+                               if kind[0] == 'file')
+                    with open(os.path.join(staging, 'manifest.json'), 'w') as wfd:
+                        json.dump({'result': result, 'bytes': size,
+                                   'files': files}, wfd)
+                    os.rename(staging, self._entry(md5))
+                except OSError:
+                    shutil.rmtree(staging, ignore_errors=True)
+                    if not os.path.isdir(self._entry(md5)):
+                        raise
+            signature = os.path.join(self.path, 'signatures',
+                                     _signature(filename))
+            with open(signature + '.new', 'w') as wfd:
+                wfd.write('%s\n%s\n' % (md5, os.path.abspath(filename)))
+            os.replace(signature + '.new', signature)
+            self.trim()
+        except OSError as msg:
+            logging.warning('FishCache: could not store %s: %s', filename, msg)
+
+    def entries(self):
+        """Returns (last use, bytes, md5) of every entry, oldest first"""
+        entries = []
+        for name in os.listdir(self.path):
+            manifest = os.path.join(self.path, name, 'manifest.json')
+            try:
+                with open(manifest) as rfd:
+                    size = json.load(rfd)['bytes']
+                entries.append((os.stat(manifest).st_mtime, size, name))
+            except (OSError, ValueError, KeyError):
+                continue
+        return sorted(entries)
+
+    def trim(self):
+        """Drops the least recently used entries above the size limit, the
+           signatures of dropped entries and those of packages that are gone
+           or changed, like nested FISH from a deleted staging directory"""
+        with open(os.path.join(self.path, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self.entries()
+            total = sum(size for used, size, md5 in entries)
+            for used, size, md5 in entries:
+                if total <= self.limit:
+                    break
+                logging.debug('FishCache: evicting %s, unused since %s', md5,
+                              time.ctime(used))
+                shutil.rmtree(self._entry(md5), ignore_errors=True)
+                total -= size
+            signatures = os.path.join(self.path, 'signatures')
+            for name in os.listdir(signatures):
+                if name.endswith('.new'):
+                    continue
+                path = os.path.join(signatures, name)
+                try:
+                    with open(path) as rfd:
+                        md5 = rfd.readline().strip()
+                        source = rfd.readline().rstrip('\n')
+                except OSError:
+                    continue
+                try:
+                    stale = not os.path.isdir(self._entry(md5)) or \
+                            (source and _signature(source) != name)
+                except OSError:
+                    stale = True
+                if stale:
+                    os.remove(path)
+
+class DigestCache:
+    """md5sums of FISH files kept across builds, so unchanged files are
+       not read again just to be hashed.  Files are identified like by
+       FishCache; the least recently used are forgotten first"""
+    def __init__(self, path=DIGEST_CACHE, limit=DIGEST_CACHE_LIMIT):
+        self.path = path
+        self.limit = limit
+        self._digests = None
+        self._changed = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Reads the digests the first time they are needed"""
+        if self._digests is not None:
+            return
+        try:
+            with open(self.path) as rfd:
+                self._digests = json.load(rfd)
+        except (OSError, ValueError):
+            self._digests = {}
+
+    def get(self, filename):
+        """Returns the md5sum of filename if it did not change since put"""
+        try:
+            signature = _signature(filename)
+        except OSError:
+            return None
+        with self._lock:
+            self._load()
+            md5 = self._digests.pop(signature, None)
+            if md5 is not None:
+                self._digests[signature] = md5
+            return md5
+
+    def put(self, filename, md5):
+        """Remembers the md5sum of filename"""
+        signature = _signature(filename)
+        with self._lock:
+            self._load()
+            self._digests.pop(signature, None)
+            self._digests[signature] = md5
+            for stale in list(self._digests)[:-self.limit]:
+                del self._digests[stale]
+            self._changed = True
+
+    def save(self):
+        """Writes the digests out if they changed"""
+        with self._lock:
+            if not self._changed:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path + '.new', 'w') as wfd:
+                    json.dump(self._digests, wfd)
+                os.replace(self.path + '.new', self.path)
+                self._changed = False
+            except OSError as msg:
+                logging.warning('DigestCache: could not save %s: %s',
+                                self.path, msg)
+
+class PackageValidator:
+    """Validates Dell driver packages, decompressing them only as far as
+       their prepackage.dell.  Results are kept until the inode, size or
+       modification time of a package changes; the least recently used are
+       forgotten first"""
+    def __init__(self, release=None, limit=PACKAGE_CACHE_LIMIT):
+        self.release = release
+        self.limit = limit
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def _our_release(self):
+        """Returns the release of the running OS"""
+        if self.release is None:
+            import lsb_release
+            self.release = lsb_release.get_os_release()['RELEASE']
+        return self.release
+
+    def validate(self, package):
+        """Returns (valid, description, error_warning) of package, valid
+           being 1, 0 for a package of another OS release or -1"""
+        try:
+            stat = os.stat(package)
+            key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            key = None
+        with self._lock:
+            cached = self._results.pop(package, None)
+            if cached is not None:
+                self._results[package] = cached
+        if key is not None and cached is not None and cached[0] == key:
+            logging.debug("Validation of %s is cached" % package)
+            return cached[1]
+
+        logging.debug("Validating driver package %s" % package)
+        valid = 1
+        description = ['']
+        error_warning = ''
+        if key is None or not package.endswith('fish.tar.gz'):
+            valid = -1
+            error_warning = 'Bad file name'
+        if valid >= 0:
+            prepackage = None
+            with tarfile.open(package, 'r|*') as rfd:
+                for member in rfd:
+                    if member.name.endswith('prepackage.dell'):
+                        member_fd = rfd.extractfile(member)
+                        if member_fd is not None:
+                            prepackage = member_fd.read()
+                        break
+            if not prepackage:
+                valid = -1
+                error_warning = 'Missing or invalid XML descriptor (prepackage.dell)'
+        if valid >= 0:
+            xml_obj = BTOxml()
+            xml_obj.load_bto_xml(prepackage)
+            our_os = self._our_release()
+            package_os = xml_obj.fetch_node_contents('os')
+            if our_os != package_os:
+                valid = 0
+                error_warning = "OS Version of package %s doesn't match local OS version %s" % (package_os, our_os)
+            description = xml_obj.fetch_node_contents('driver')
+        logging.debug("Validation complete: valid %s" % valid)
+        result = (valid, description, error_warning)
+        if key is not None:
+            with self._lock:
+                self._results.pop(package, None)
+                self._results[package] = (key, result)
+                for stale in list(self._results)[:-self.limit]:
+                    del self._results[stale]
+        return result
@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# «recovery_history» - Timings of previous builds on this host
+#
+# Copyright (C) 2020, Dell Inc.
+#
+# This is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this application; if not, write to the Free Software Foundation, Inc., 51
+# Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+HISTORY_FILE = '/var/lib/dell-recovery/build-history.jsonl'
+
+#How many builds are remembered
+HISTORY_LIMIT = 200
+
+#Build stages in the order they run
+STAGES = ['copy', 'fish', 'initrd', 'checksum', 'iso']
+
+#Below this fraction of a stage, its estimate is trusted more than an
+#extrapolation of the time spent so far
+EXTRAPOLATE_AFTER = 0.05
+
+def _median(values):
+    """Returns the median of a non empty list"""
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+class BuildRecord:
+    """Times the stages of one build.  A stage ends when the next one
+       starts; stages run more than once are added up in stages but kept
+       apart in spans"""
+    def __init__(self, kind, clock=time.monotonic):
+        self.kind = kind
+        self.started = time.time()
+        self.stages = {}
+        self.spans = []
+        self._clock = clock
+        self._start = clock()
+        self._current = None
+        self._stage_start = None
+        self._stage_bytes = None
+
+    def stage(self, name, size=None):
+        """Starts stage name, expected to process size bytes"""
+        self.end_stage()
+        self._current = name
+        self._stage_start = self._clock()
+        self._stage_bytes = size
+
+    def end_stage(self, size=None):
+        """Ends the running stage, size overrides the expected bytes"""
+        if self._current is None:
+            return
+        if size is not None:
+            self._stage_bytes = size
+        now = self._clock()
+        entry = self.stages.setdefault(self._current, {'seconds': 0.0,
+                                                       'bytes': 0})
+        entry['seconds'] += now - self._stage_start
+        entry['bytes'] += self._stage_bytes or 0
+        self.spans.append({'stage': self._current,
+                           'start': self.wall_time(self._stage_start),
+                           'end': self.wall_time(now),
+                           'bytes': self._stage_bytes})
+        self._current = None
+
+    def wall_time(self, stamp):
+        """Converts a reading of the clock to seconds since the epoch"""
+        return self.started + stamp - self._start
+
+    def current(self):
+        """Returns the running stage, the seconds spent in it and its
+           expected bytes.  The stage is None between stages"""
+        if self._current is None:
+            return None, 0, None
+        return (self._current, self._clock() - self._stage_start,
+                self._stage_bytes)
+
+    def finish(self, state):
+        """Ends the build and returns it as a dictionary for BuildHistory"""
+        self.end_stage()
+        return {'kind': self.kind,
+                'state': state,
+                'started': self.started,
+                'seconds': self._clock() - self._start,
+                'stages': self.stages}
+
+class BuildHistory:
+    """The last HISTORY_LIMIT builds, stored as JSON lines.
+
+       Stage throughput and durations of finished builds drive build
+       plans and live ETAs."""
+    def __init__(self, path=HISTORY_FILE, limit=HISTORY_LIMIT):
+        self.path = path
+        self.limit = limit
+        self._records = None
+        self._medians = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Reads the store once, skipping lines that can't be parsed.
+           Called with the lock held"""
+        if self._records is not None:
+            return self._records
+        records = []
+        try:
+            with open(self.path) as rfd:
+                for line in rfd:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except (IOError, OSError):
+            pass
+        self._records = records[-self.limit:]
+        return self._records
+
+    def records(self):
+        """Returns the remembered builds, oldest first"""
+        with self._lock:
+            return list(self._load())
+
+    def append(self, record):
+        """Remembers a build, forgetting the oldest beyond the limit"""
+        with self._lock:
+            records = self._load() + [record]
+            self._records = records[-self.limit:]
+            self._medians = None
+            try:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                if len(records) > self.limit:
+                    tmp = self.path + '.new'
+                    with open(tmp, 'w') as wfd:
+                        for item in self._records:
+                            wfd.write(json.dumps(item) + '\n')
+                    os.rename(tmp, self.path)
+                else:
+                    with open(self.path, 'a') as wfd:
+                        wfd.write(json.dumps(record) + '\n')
+            except (IOError, OSError) as msg:
+                logging.warning("BuildHistory: unable to store build: %s", msg)
+
+    def _stage_medians(self):
+        """Returns the median seconds, bytes and bytes per second of every
+           stage of the finished builds"""
+        with self._lock:
+            if self._medians is not None:
+                return self._medians
+        samples = {}
+        for record in self.records():
+            if record.get('state') != 'finished':
+                continue
+            for stage, entry in record.get('stages', {}).items():
+                samples.setdefault(stage, []).append(entry)
+        medians = {}
+        for stage, entries in samples.items():
+            rates = [entry['bytes'] / entry['seconds'] for entry in entries
+                     if entry['bytes'] and entry['seconds'] > 0]
+            medians[stage] = {'samples': len(entries),
+                              'seconds': _median([entry['seconds']
+                                                  for entry in entries]),
+                              'bytes': _median([entry['bytes']
+                                                for entry in entries]),
+                              'rate': _median(rates) if rates else 0}
+        with self._lock:
+            self._medians = medians
+        return medians
+
+    def throughput(self):
+        """Returns the median bytes per second of each stage that has
+           been measured, see recovery_plan.build_plan"""
+        return dict((stage, int(medians['rate']))
+                    for stage, medians in self._stage_medians().items()
+                    if medians['rate'])
+
+    def eta(self, record, percent):
+        """Estimates the seconds left in the build of record, given the
+           percentage done of its running stage.  Returns None without
+           history for that stage"""
+        stage, elapsed, size = record.current()
+        medians = self._stage_medians()
+        if stage not in medians:
+            return None
+        if size and medians[stage]['rate']:
+            estimate = size / medians[stage]['rate']
+        else:
+            estimate = medians[stage]['seconds']
+        try:
+            fraction = float(percent) / 100
+        except (TypeError, ValueError):
+            fraction = -1
+        if EXTRAPOLATE_AFTER < fraction <= 1:
+            remaining = elapsed / fraction - elapsed
+        elif 0 <= fraction <= 1:
+            remaining = estimate * (1 - fraction)
+        else:
+            remaining = max(0, estimate - elapsed)
+        if stage in STAGES:
+            for later in STAGES[STAGES.index(stage) + 1:]:
+                if later in medians:
+                    remaining += medians[later]['seconds']
+        return int(remaining)
+
+    def stats(self):
+        """Describes the remembered builds and every stage as string
+           dictionaries"""
+        records = self.records()
+        finished = [record for record in records
+                    if record.get('state') == 'finished']
+        states = collections.Counter(record.get('state') for record in records)
+        summary = {'path': self.path,
+                   'builds': str(len(records)),
+                   'finished': str(len(finished)),
+                   'failed': str(states['failed']),
+                   'cancelled': str(states['cancelled']),
+                   'median_seconds': str(int(_median(
+                       [record['seconds'] for record in finished]))
+                                         if finished else ''),
+                   'last': str(records[-1]['started'] if records else '')}
+        medians = self._stage_medians()
+        details = [{'stage': stage,
+                    'samples': str(medians[stage]['samples']),
+                    'median_seconds': str(int(medians[stage]['seconds'])),
+                    'median_bytes': str(int(medians[stage]['bytes'])),
+                    'bytes_per_second': str(int(medians[stage]['rate']))}
+                   for stage in STAGES if stage in medians]
+        return summary, details
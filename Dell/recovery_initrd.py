@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# «recovery_initrd» - Streaming inspection of initramfs images
+#
+# Copyright (C) 2020, Dell Inc.
+#
+# This is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this application; if not, write to the Free Software Foundation, Inc., 51
+# Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+
+import bz2
+import logging
+import lzma
+import subprocess
+import threading
+import zlib
+
+from Dell.recovery_telemetry import TimedPopen
+
+CHUNK_SIZE = 65536
+
+CPIO_MAGICS = (b'070701', b'070702')
+CPIO_HEADER_SIZE = 110
+CPIO_TRAILER = 'TRAILER!!!'
+
+#Magic numbers of the compressors initramfs-tools can use
+COMPRESSION_MAGICS = [ (b'\x1f\x8b', 'gzip'),
+                       (b'\xfd7zXZ\x00', 'xz'),
+                       (b'\x5d\x00\x00', 'lzma'),
+                       (b'BZh', 'bzip2'),
+                       (b'\x28\xb5\x2f\xfd', 'zstd'),
+                       (b'\x02\x21\x4c\x18', 'lz4'),
+                       (b'\x04\x22\x4d\x18', 'lz4'),
+                       (b'\x89LZO', 'lzop') ]
+
+#Compressors without a decoder in the standard library
+EXTERNAL_DECOMPRESSORS = { 'zstd': ['zstd', '-dcq'],
+                           'lz4': ['lz4', '-dcq'],
+                           'lzop': ['lzop', '-dcq'] }
+
+def detect_compression(data):
+    """Returns the compression used by a segment starting with data,
+       'cpio' for an uncompressed archive or '' if it's unknown"""
+    if data[:6] in CPIO_MAGICS:
+        return 'cpio'
+    for magic, kind in COMPRESSION_MAGICS:
+        if data.startswith(magic):
+            return kind
+    return ''
+
+class _Source:
+    """A byte stream that can look ahead and push data back"""
+    def __init__(self, read):
+        self._read = read
+        self._buffer = b''
+
+    def peek(self, size):
+        """Returns up to size bytes without consuming them"""
+        while len(self._buffer) < size:
+            chunk = self._read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self._buffer += chunk
+        return self._buffer[:size]
+
+    def read(self, size):
+        """Consumes up to size bytes"""
+        data = self.peek(size)
+        self._buffer = self._buffer[len(data):]
+        return data
+
+    def skip(self, size):
+        """Discards size bytes, returns False if the stream ended early"""
+        while size > 0:
+            if not self._buffer:
+                self._buffer = self._read(min(size, CHUNK_SIZE))
+                if not self._buffer:
+                    return False
+            step = min(size, len(self._buffer))
+            self._buffer = self._buffer[step:]
+            size -= step
+        return True
+
+    def unread(self, data):
+        """Pushes data back to the front of the stream"""
+        self._buffer = data + self._buffer
+
+    def skip_padding(self):
+        """Drops the zero padding between segments.
+           Returns False once the stream is exhausted"""
+        while True:
+            data = self.read(CHUNK_SIZE)
+            if not data:
+                return False
+            data = data.lstrip(b'\x00')
+            if data:
+                self.unread(data)
+                return True
+
+    def close(self):
+        """Releases anything backing the stream"""
+        pass
+
+class _Decompressed(_Source):
+    """Decompresses one segment using an in-process decoder.  Anything
+       following the compressed stream is handed back to the parent"""
+    def __init__(self, parent, decoder):
+        _Source.__init__(self, self._decompress)
+        self._parent = parent
+        self._decoder = decoder
+        self._finished = False
+
+    def _decompress(self, size):
+        output = b''
+        while not output and not self._finished:
+            chunk = self._parent.read(CHUNK_SIZE)
+            if not chunk:
+                self._finished = True
+                break
+            output = self._decoder.decompress(chunk)
+            if self._decoder.eof:
+                self._parent.unread(self._decoder.unused_data)
+                self._finished = True
+        return output
+
+class _ExternalDecompressed(_Source):
+    """Decompresses the rest of the stream through an external tool"""
+    def __init__(self, parent, command):
+        self._process = TimedPopen(command, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL)
+        _Source.__init__(self, self._process.stdout.read)
+        self._feeder = threading.Thread(target=self._feed, args=(parent,))
+        self._feeder.daemon = True
+        self._feeder.start()
+
+    def _feed(self, parent):
+        """Copies the compressed data into the decompressor"""
+        try:
+            while True:
+                chunk = parent.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self._process.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def close(self):
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.stdout.close()
+        self._process.wait()
+        self._feeder.join()
+
+def _open_segment(source, kind):
+    """Returns a stream decompressing the segment at the front of source"""
+    if kind == 'gzip':
+        return _Decompressed(source, zlib.decompressobj(wbits=31))
+    if kind in ('xz', 'lzma'):
+        return _Decompressed(source, lzma.LZMADecompressor())
+    if kind == 'bzip2':
+        return _Decompressed(source, bz2.BZ2Decompressor())
+    return _ExternalDecompressed(source, EXTERNAL_DECOMPRESSORS[kind])
+
+def _pad4(size):
+    """Bytes of padding needed to align size to 4"""
+    return (4 - size % 4) % 4
+
+def _scan_cpio(source, wanted):
+    """Walks the headers of a newc cpio archive without buffering members.
+       Returns the matching member name, or '' at the end of the archive"""
+    while True:
+        header = source.read(CPIO_HEADER_SIZE)
+        if len(header) < CPIO_HEADER_SIZE or header[:6] not in CPIO_MAGICS:
+            return ''
+        try:
+            filesize = int(header[54:62], 16)
+            namesize = int(header[94:102], 16)
+        except ValueError:
+            #a corrupt header ends the archive like a short read
+            return ''
+        name = source.read(namesize).rstrip(b'\x00').decode('utf-8', 'replace')
+        source.skip(_pad4(CPIO_HEADER_SIZE + namesize))
+        if name == CPIO_TRAILER:
+            return ''
+        if wanted in name:
+            return name
+        if not source.skip(filesize + _pad4(filesize)):
+            return ''
+
+def find_in_initrd(fileobj, wanted):
+    """Streams an initramfs image from fileobj looking for a member whose
+       path contains wanted.  Every concatenated segment is decompressed
+       according to its own magic and the scan stops at the first match.
+       Returns the member name or ''"""
+    source = _Source(fileobj.read)
+    while source.skip_padding():
+        kind = detect_compression(source.peek(6))
+        if kind == 'cpio':
+            found = _scan_cpio(source, wanted)
+            if found:
+                return found
+            continue
+        if not kind:
+            logging.debug("find_in_initrd: unknown segment format %s",
+                          source.peek(6))
+            return ''
+        logging.debug("find_in_initrd: %s compressed segment", kind)
+        try:
+            segment = _open_segment(source, kind)
+        except OSError as msg:
+            logging.warning("find_in_initrd: unable to decompress %s: %s", kind, msg)
+            return ''
+        try:
+            while segment.skip_padding():
+                if detect_compression(segment.peek(6)) != 'cpio':
+                    break
+                found = _scan_cpio(segment, wanted)
+                if found:
+                    return found
+            #drain anything left so the next segment lines up
+            while segment.read(CHUNK_SIZE):
+                pass
+        except (OSError, EOFError, ValueError, zlib.error, lzma.LZMAError) as msg:
+            logging.warning("find_in_initrd: corrupt %s segment: %s", kind, msg)
+            return ''
+        finally:
+            segment.close()
+    return ''
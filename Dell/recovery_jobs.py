@@ -0,0 +1,305 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# «recovery_jobs» - Long running backend operations run as jobs
+#
+# Copyright (C) 2020, Dell Inc.
+#
+# This is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this application; if not, write to the Free Software Foundation, Inc., 51
+# Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from Dell.recovery_telemetry import collect_commands
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+#How many completed jobs are remembered for query_job
+JOB_HISTORY = 32
+
+#Records a job stream holds for a slow reader before dropping log output
+STREAM_BACKLOG = 4096
+#Seconds a finished job waits for its stream reader
+STREAM_CLOSE_TIMEOUT = 10
+
+_CURRENT = threading.local()
+
+class JobCancelled(Exception):
+    """Raised inside a job once it has been asked to stop"""
+
+def current_job():
+    """Returns the job running in this thread, or None"""
+    return getattr(_CURRENT, 'job', None)
+
+def check_cancelled():
+    """Raises JobCancelled if the job running in this thread was cancelled.
+       Does nothing outside of a job"""
+    job = current_job()
+    if job is not None:
+        job.check_cancelled()
+
+def job_output(message):
+    """Sends raw tool output to the stream of the job running in this
+       thread, if it has one.  Unlike logging it isn't filtered by level"""
+    job = current_job()
+    if job is not None and job.stream is not None:
+        job.stream.write('log', level='OUTPUT', message=message)
+
+class JobStream:
+    """Writes newline delimited JSON records about a job to a file
+       descriptor handed over by the client.
+
+       Records are written by a thread of their own so a slow reader
+       never blocks the job.  Once STREAM_BACKLOG records are waiting,
+       progress and log records are dropped; the final record is not"""
+    def __init__(self, fd, job_id):
+        self.job_id = job_id
+        self.dropped = 0
+        self._file = os.fdopen(fd, 'w')
+        self._queue = queue.Queue(STREAM_BACKLOG)
+        self._thread = threading.Thread(target=self._write_records,
+                                        name='stream-%s' % job_id)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, kind, **fields):
+        """Queues a record of type kind"""
+        fields.update({'type': kind, 'job': self.job_id, 'time': time.time()})
+        try:
+            self._queue.put_nowait(fields)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, kind, **fields):
+        """Queues a final record of type kind and waits for it to be
+           written, at most STREAM_CLOSE_TIMEOUT seconds"""
+        fields.update({'type': kind, 'job': self.job_id, 'time': time.time(),
+                       'dropped': self.dropped})
+        try:
+            self._queue.put(fields, timeout=STREAM_CLOSE_TIMEOUT)
+            self._queue.put(None, timeout=STREAM_CLOSE_TIMEOUT)
+        except queue.Full:
+            logging.warning("JobStream: reader of job %s is stuck", self.job_id)
+            return
+        self._thread.join(STREAM_CLOSE_TIMEOUT)
+
+    def _write_records(self):
+        """Body of the writer thread"""
+        broken = False
+        try:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    break
+                if broken:
+                    continue
+                try:
+                    self._file.write(json.dumps(record) + '\n')
+                    self._file.flush()
+                except OSError as msg:
+                    logging.debug("JobStream: job %s reader went away: %s",
+                                  self.job_id, msg)
+                    broken = True
+        finally:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+
+class _JobLogHandler(logging.Handler):
+    """Copies log records emitted by a job's thread to its stream.
+       Debug records stay in the backend's own log"""
+    def __init__(self, job):
+        logging.Handler.__init__(self, logging.INFO)
+        self.job = job
+
+    def emit(self, record):
+        if current_job() is self.job:
+            self.job.stream.write('log', level=record.levelname,
+                                  message=self.format(record))
+
+class Job:
+    """State of one long running backend operation"""
+    def __init__(self, kind, owner):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner = owner
+        self.state = JOB_QUEUED
+        self.message = ''
+        self.percent = ''
+        self.eta = ''
+        self.error = ''
+        self.started = None
+        self.finished = None
+        self.stream = None
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Asks the job to stop at its next checkpoint"""
+        self._cancel.set()
+
+    def cancelled(self):
+        """Whether the job was asked to stop"""
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """Raises JobCancelled if the job was asked to stop"""
+        if self._cancel.is_set():
+            raise JobCancelled("Job %s was cancelled" % self.job_id)
+
+    def done(self):
+        """Whether the job reached a final state"""
+        return self.state in (JOB_FINISHED, JOB_FAILED, JOB_CANCELLED)
+
+    def summary(self):
+        """Describes the job as a string dictionary for D-Bus"""
+        return {'id': self.job_id,
+                'kind': self.kind,
+                'owner': self.owner or '',
+                'state': self.state,
+                'message': self.message,
+                'percent': str(self.percent),
+                'eta': str(self.eta),
+                'error': self.error,
+                'started': str(self.started or ''),
+                'finished': str(self.finished or '')}
+
+class JobManager:
+    """Runs jobs in their own threads and tracks their state.
+
+       on_progress(job, message, percent) and on_complete(job) are intended
+       to be overridden and are called from the job's thread"""
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def on_progress(self, job, message, percent):
+        """Function intended to be overridden to the correct external function
+        """
+        pass
+
+    def on_complete(self, job):
+        """Function intended to be overridden to the correct external function
+        """
+        pass
+
+    def start(self, kind, owner, target, *args, stream=None, **kwargs):
+        """Runs target(*args, **kwargs) in a new job, returns the job ID.
+           stream is a file descriptor the job then owns and describes
+           itself on (see JobStream)"""
+        job = Job(kind, owner)
+        if stream is not None:
+            job.stream = JobStream(stream, job.job_id)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune()
+        thread = threading.Thread(target=self._run, name='job-%s' % job.job_id,
+                                  args=(job, target, args, kwargs))
+        thread.daemon = True
+        thread.start()
+        logging.debug("JobManager: started %s job %s for %s", kind, job.job_id, owner)
+        return job.job_id
+
+    def _run(self, job, target, args, kwargs):
+        """Body of a job thread"""
+        _CURRENT.job = job
+        job.state = JOB_RUNNING
+        job.started = time.time()
+        handler = None
+        if job.stream is not None:
+            handler = _JobLogHandler(job)
+            logging.getLogger().addHandler(handler)
+        commands = None
+        try:
+            job.check_cancelled()
+            with collect_commands() as commands:
+                target(*args, **kwargs)
+            job.state = JOB_FINISHED
+        except Exception as msg:
+            if job.cancelled():
+                job.state = JOB_CANCELLED
+            else:
+                logging.exception("JobManager: job %s failed", job.job_id)
+                job.state = JOB_FAILED
+                job.error = str(msg)
+        finally:
+            job.finished = time.time()
+            logging.debug("JobManager: job %s %s", job.job_id, job.state)
+            if commands is not None and commands.commands():
+                logging.debug("JobManager: commands run by job %s:\n%s",
+                              job.job_id, commands.report())
+            if handler is not None:
+                logging.getLogger().removeHandler(handler)
+                job.stream.close('complete', state=job.state, error=job.error)
+            _CURRENT.job = None
+            self.on_complete(job)
+
+    def _prune(self):
+        """Forgets the oldest completed jobs beyond JOB_HISTORY"""
+        done = sorted((job for job in self._jobs.values() if job.done()),
+                      key=lambda job: job.finished)
+        for job in done[:max(0, len(done) - JOB_HISTORY)]:
+            del self._jobs[job.job_id]
+
+    def progress(self, message, percent, job=None, eta=None):
+        """Records progress of job, by default the one running in this
+           thread, and the seconds it has left if known.  Returns False
+           if there is none"""
+        if job is None:
+            job = current_job()
+        if job is None:
+            return False
+        job.message = message
+        job.percent = percent
+        job.eta = '' if eta is None else eta
+        if job.stream is not None:
+            job.stream.write('progress', message=message, percent=str(percent),
+                             eta=str(job.eta))
+        self.on_progress(job, message, percent)
+        return True
+
+    def cancel(self, job_id):
+        """Asks a job to stop, returns False if it isn't running"""
+        job = self.get(job_id)
+        if job is None or job.done():
+            return False
+        job.cancel()
+        return True
+
+    def get(self, job_id):
+        """Returns the job with job_id, or None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """Returns every known job, oldest first"""
+        with self._lock:
+            return sorted(self._jobs.values(),
+                          key=lambda job: job.started or time.time())
+
+    def running(self):
+        """Whether any job hasn't finished yet"""
+        with self._lock:
+            return any(not job.done() for job in self._jobs.values())
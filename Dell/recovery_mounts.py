@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# «recovery_mounts» - Reference counted mounts for the backend
+#
+# Copyright (C) 2020, Dell Inc.
+#
+# This is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this application; if not, write to the Free Software Foundation, Inc., 51
+# Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+
+import collections
+import logging
+import os
+import re
+import select
+import subprocess
+import tempfile
+import threading
+
+from Dell.recovery_telemetry import TimedPopen, timed_call
+
+MOUNTINFO = '/proc/self/mountinfo'
+SYSFS = '/sys'
+
+MountEntry = collections.namedtuple('MountEntry',
+                                    ['source', 'mountpoint', 'fstype', 'backing'])
+
+def _unescape(field):
+    """Decodes the octal escapes (\\040 for a space...) used in mountinfo"""
+    return re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)),
+                  field)
+
+def loop_backing_file(device, sysfs=SYSFS):
+    """Returns the file behind a loop device, or ''"""
+    if not device.startswith('/dev/loop'):
+        return ''
+    path = os.path.join(sysfs, 'block', os.path.basename(device),
+                        'loop', 'backing_file')
+    try:
+        with open(path) as rfd:
+            return rfd.read().strip()
+    except (IOError, OSError):
+        return ''
+
+def parse_mountinfo(text, sysfs=SYSFS):
+    """Parses the contents of a mountinfo file into MountEntry tuples"""
+    entries = []
+    for line in text.splitlines():
+        fields = line.split()
+        try:
+            separator = fields.index('-', 6)
+            mountpoint = _unescape(fields[4])
+            fstype = fields[separator + 1]
+            source = _unescape(fields[separator + 2])
+        except (ValueError, IndexError):
+            continue
+        entries.append(MountEntry(source, mountpoint, fstype,
+                                  loop_backing_file(source, sysfs)))
+    return entries
+
+class MountRegistry:
+    """Tracks the mount table and the mounts the backend made.
+
+       /proc/self/mountinfo is parsed once and then only again when the
+       kernel flags it as changed.  Every mount the registry makes is
+       reference counted per owner (a job or a single method call) and
+       unmounted as soon as its last owner releases it.  Mounts that
+       already existed are shared but never unmounted."""
+    def __init__(self, mountinfo=MOUNTINFO, sysfs=SYSFS):
+        self.mountinfo = mountinfo
+        self.sysfs = sysfs
+        self._entries = []
+        self._stale = True
+        self._watcher = None
+        self._lock = threading.RLock()
+        #mountpoint -> {owner: count} for mounts made here
+        self._owned = {}
+
+    def _watch(self):
+        """Marks the table stale whenever the kernel reports a change"""
+        with open(self.mountinfo) as rfd:
+            poller = select.poll()
+            poller.register(rfd, select.POLLPRI | select.POLLERR)
+            while True:
+                poller.poll()
+                rfd.seek(0)
+                rfd.read()
+                self._stale = True
+
+    def _start_watcher(self):
+        """Starts watching mountinfo for changes"""
+        self._watcher = threading.Thread(target=self._watch,
+                                         name='mountinfo-watch')
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def entries(self):
+        """Returns the current mount table"""
+        with self._lock:
+            if self._watcher is None:
+                self._start_watcher()
+            if self._stale:
+                self.refresh()
+            return list(self._entries)
+
+    def refresh(self):
+        """Reads the mount table again"""
+        with self._lock:
+            self._stale = False
+            with open(self.mountinfo) as rfd:
+                self._entries = parse_mountinfo(rfd.read(), self.sysfs)
+
+    def find(self, source):
+        """Returns where source (a device or an image file) is mounted,
+           or ''"""
+        source = os.path.realpath(source)
+        for entry in self.entries():
+            if source in (entry.source, entry.backing):
+                return entry.mountpoint
+        return ''
+
+    def _mount(self, source, mntdir, options):
+        """Runs mount, returns its return code and stderr"""
+        command = TimedPopen(['mount'] + options + [source, mntdir],
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE,
+                             universal_newlines=True)
+        output = command.communicate()
+        return command.returncode, output[1]
+
+    def _umount(self, mntdir):
+        """Runs umount, returns its return code"""
+        return timed_call(['umount', mntdir])
+
+    def acquire(self, source, owner, options):
+        """Mounts source (if it isn't already) for owner and returns the
+           mount point, or '' if it can't be mounted"""
+        with self._lock:
+            mntdir = self.find(source)
+            if not mntdir:
+                mntdir = tempfile.mkdtemp()
+                ret, error = self._mount(source, mntdir, options)
+                self.refresh()
+                if ret != 0:
+                    os.rmdir(mntdir)
+                    #32 is also used when somebody else just mounted it
+                    mntdir = self.find(source) if ret == 32 else ''
+                    if not mntdir:
+                        logging.warning("MountRegistry: unable to mount %s: %s",
+                                        source, error.strip())
+                    return mntdir
+                self._owned[mntdir] = {}
+            if mntdir in self._owned:
+                owners = self._owned[mntdir]
+                owners[owner] = owners.get(owner, 0) + 1
+            return mntdir
+
+    def release(self, owner):
+        """Drops every reference owner holds, unmounting what nobody
+           uses any more"""
+        with self._lock:
+            #newest first, an image may be mounted from inside another one
+            for mntdir in reversed(list(self._owned)):
+                owners = self._owned[mntdir]
+                owners.pop(owner, None)
+                if not owners:
+                    self._unmount(mntdir)
+
+    def release_all(self):
+        """Unmounts everything the registry mounted"""
+        with self._lock:
+            for mntdir in reversed(list(self._owned)):
+                self._unmount(mntdir)
+
+    def _unmount(self, mntdir):
+        """Unmounts a mount made by the registry and removes its directory.
+           A mount that can't be unmounted is kept to be tried again"""
+        logging.debug("MountRegistry: unmounting %s", mntdir)
+        if self._umount(mntdir) != 0:
+            logging.warning("MountRegistry: error unmounting %s", mntdir)
+            return
+        del self._owned[mntdir]
+        self._stale = True
+        try:
+            os.rmdir(mntdir)
+        except OSError as msg:
+            logging.warning("MountRegistry: error cleaning up: %s", msg)
+
+    def mounted(self):
+        """Returns the mount points the registry made and their owners"""
+        with self._lock:
+            return dict((mntdir, dict(owners))
+                        for mntdir, owners in self._owned.items())
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# «recovery_pipeline» - Chains of external commands connected by pipes
+#
+# Copyright (C) 2020, Dell Inc.
+#
+# This is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this application; if not, write to the Free Software Foundation, Inc., 51
+# Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+
+import collections
+import logging
+import signal
+import subprocess
+import tempfile
+import threading
+
+from Dell.recovery_telemetry import TimedPopen
+
+CHUNK_SIZE = 1024 * 1024
+
+StageResult = collections.namedtuple('StageResult',
+                                     ['args', 'returncode', 'wall', 'cpu',
+                                      'stderr'])
+
+class PipelineFailed(RuntimeError):
+    """Raised when a stage of a pipeline failed"""
+    def __init__(self, results):
+        self.results = results
+        RuntimeError.__init__(self, '; '.join(
+            "%s exited with %s: %s" % (' '.join(result.args),
+                                       result.returncode,
+                                       result.stderr.strip())
+            for result in results if result.returncode != 0))
+
+class Pipeline:
+    """Runs commands with the output of each going into the next, like
+       a shell pipeline.
+
+       The output of the last command goes to a file descriptor or file
+       object, to a callback, or is read from stdout.  Every stage is
+       reaped and its exit status, wall and CPU time and stderr reported
+       by wait()"""
+    def __init__(self, commands, cwd=None, env=None):
+        self.commands = [list(command) for command in commands]
+        self.cwd = cwd
+        self.env = env
+        self.stdout = None
+        self._processes = []
+        self._stderr = []
+        self._waiters = []
+
+    def start(self, stdin=None, stdout=subprocess.PIPE):
+        """Starts every stage.  The output of the last one goes to stdout,
+           or can be read from the stdout attribute if that is PIPE"""
+        source = stdin
+        for index, command in enumerate(self.commands):
+            last = index == len(self.commands) - 1
+            stderr = tempfile.TemporaryFile()
+            self._stderr.append(stderr)
+            try:
+                process = TimedPopen(command, stdin=source,
+                                     stdout=stdout if last else subprocess.PIPE,
+                                     stderr=stderr, cwd=self.cwd, env=self.env)
+            except OSError:
+                if self._processes:
+                    self._processes[-1].stdout.close()
+                self.kill()
+                for waiter in self._waiters:
+                    waiter.join()
+                for handle in self._stderr:
+                    handle.close()
+                raise
+            #the next stage holds the only copy, so SIGPIPE works
+            if self._processes:
+                self._processes[-1].stdout.close()
+            self._processes.append(process)
+            #reap every stage as soon as it exits so its time is exact
+            waiter = threading.Thread(target=process.wait,
+                                      name='pipeline-%s' % command[0])
+            waiter.daemon = True
+            waiter.start()
+            self._waiters.append(waiter)
+            source = process.stdout
+        self.stdout = self._processes[-1].stdout
+        return self
+
+    def kill(self):
+        """Stops every stage that is still running"""
+        for process in self._processes:
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except OSError:
+                    pass
+
+    def wait(self, check=True):
+        """Waits for every stage and returns their StageResults.  With
+           check, PipelineFailed is raised if one failed.  Earlier stages
+           killed by SIGPIPE only fail the pipeline if the last one did"""
+        if self.stdout is not None:
+            self.stdout.close()
+        for waiter in self._waiters:
+            waiter.join()
+        results = []
+        for process, stderr in zip(self._processes, self._stderr):
+            stderr.seek(0)
+            results.append(StageResult(process.args, process.returncode,
+                                       process.wall, process.cpu,
+                                       stderr.read().decode('utf-8', 'replace')))
+            stderr.close()
+        for result in results:
+            logging.debug("Pipeline: %s exited with %s: %.3f s wall, %.3f s cpu",
+                          ' '.join(result.args), result.returncode,
+                          result.wall or 0, result.cpu or 0)
+        if check:
+            last = results[-1]
+            if any(result.returncode != 0 and
+                   (result is last or result.returncode != -signal.SIGPIPE or
+                    last.returncode != 0) for result in results):
+                raise PipelineFailed(results)
+        return results
+
+    def run(self, output=None, callback=None, stdin=None, check=True):
+        """Runs the pipeline to the end.  The final output is written to
+           output (a file descriptor or file object) or passed in chunks
+           to callback, and discarded if neither is given"""
+        if output is None and callback is None:
+            output = subprocess.DEVNULL
+        self.start(stdin, output if output is not None else subprocess.PIPE)
+        try:
+            if callback is not None:
+                for chunk in iter(lambda: self.stdout.read(CHUNK_SIZE), b''):
+                    callback(chunk)
+        except BaseException:
+            self.kill()
+            raise
+        return self.wait(check)
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# «recovery_plan» - Space and time estimates for image builds
+#
+# Copyright (C) 2020, Dell Inc.
+#
+# This is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this application; if not, write to the Free Software Foundation, Inc., 51
+# Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+
+import glob
+import os
+import tarfile
+
+MIB = 1024 * 1024
+
+#Conservative throughput of each build stage in bytes per second
+STAGE_THROUGHPUT = {'copy': 80 * MIB,
+                    'fish': 40 * MIB,
+                    'initrd': 20 * MIB,
+                    'checksum': 150 * MIB,
+                    'iso': 60 * MIB}
+
+#An unpacked initramfs takes about this many times its packed size
+INITRD_EXPANSION = 4
+
+#Slack for the files create_ubuntu writes besides the initrd
+#(bto.xml, grub theme and fonts, EFI binaries...)
+CREATE_OVERHEAD = 64 * MIB
+
+def fish_size(path):
+    """Returns the bytes a FISH package adds to an image: the members of
+       an archive or the file itself"""
+    if not os.path.isfile(path):
+        return 0
+    if not path.endswith('.deb') and tarfile.is_tarfile(path):
+        with tarfile.open(path) as rfd:
+            return sum(member.size for member in rfd.getmembers()
+                       if member.isfile())
+    return os.path.getsize(path)
+
+def initrd_size(root):
+    """Returns the size of the casper initrd below root, 0 if missing"""
+    for path in glob.glob(os.path.join(root, 'casper', 'initrd*')):
+        return os.path.getsize(path)
+    return 0
+
+def volume_free(path):
+    """Returns the bytes available for path, a file that may not exist
+       yet, and the device of the volume it would be written to"""
+    directory = os.path.dirname(os.path.abspath(path))
+    while not os.path.isdir(directory):
+        directory = os.path.dirname(directory)
+    statvfs = os.statvfs(directory)
+    available = statvfs.f_frsize * statvfs.f_bavail
+    #an existing file is replaced
+    if os.path.isfile(path):
+        available += os.path.getsize(path)
+    return available, os.stat(directory).st_dev
+
+def build_plan(base_bytes, driver_bytes, application_bytes, initrd_bytes,
+               checksums, workspace_free, output_free, staged_bytes=0,
+               shared_volume=False, throughput=None):
+    """Estimates the space and time a build needs.
+
+       base_bytes: size of the base image or recovery partition
+       driver_bytes, application_bytes: what the FISH packages add
+       initrd_bytes: size of the initrd that gets rebuilt
+       checksums: whether md5sum.txt is regenerated
+       workspace_free, output_free: bytes available for staging and the ISO
+       staged_bytes: how much of the base is copied to staging first
+       shared_volume: whether staging and the ISO are on the same volume
+       throughput: bytes per second of each stage, see STAGE_THROUGHPUT
+
+       Returns a dictionary of integers; *_fits are 1 or 0"""
+    rates = dict(STAGE_THROUGHPUT)
+    rates.update(throughput or {})
+    initrd_rebuild = initrd_bytes * INITRD_EXPANSION
+    staging = staged_bytes + driver_bytes + application_bytes + \
+              initrd_rebuild + initrd_bytes + CREATE_OVERHEAD
+    output = base_bytes + driver_bytes + application_bytes
+    if shared_volume:
+        #staging is only deleted once the ISO is written
+        output_free = min(output_free, workspace_free - staging)
+
+    stages = {'copy': staged_bytes,
+              'fish': driver_bytes + application_bytes,
+              'initrd': initrd_rebuild,
+              'checksum': output if checksums else 0,
+              'iso': output}
+    seconds = {stage: size // max(1, rates[stage])
+               for stage, size in stages.items()}
+
+    plan = {'base_bytes': base_bytes,
+            'driver_fish_bytes': driver_bytes,
+            'application_fish_bytes': application_bytes,
+            'initrd_bytes': initrd_bytes,
+            'initrd_rebuild_bytes': initrd_rebuild,
+            'staging_bytes': staging,
+            'output_bytes': output,
+            'workspace_free_bytes': workspace_free,
+            'output_free_bytes': output_free,
+            'staging_fits': int(staging <= workspace_free),
+            'output_fits': int(output <= output_free),
+            'estimated_seconds': sum(seconds.values())}
+    for stage, value in seconds.items():
+        plan['%s_seconds' % stage] = value
+    return plan
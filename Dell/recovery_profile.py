@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# «recovery_profile» - Profiling of backend method calls
+#
+# Copyright (C) 2020, Dell Inc.
+#
+# This is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this application; if not, write to the Free Software Foundation, Inc., 51
+# Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+
+import cProfile
+import functools
+import itertools
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+#Environment variables enabling profiling without command line options
+PROFILE_ENV = 'DELL_RECOVERY_PROFILE'
+PROFILE_MEMORY_ENV = 'DELL_RECOVERY_PROFILE_MEMORY'
+
+#Allocation sites listed in a memory report
+MEMORY_TOP = 50
+
+class Profiler:
+    """Profiles calls into one pstats file per call, named after the
+       method and when it was called.
+
+       With memory set, tracemalloc runs too and the allocations that
+       grew during each call are written next to it.  Calls made while
+       another one is profiled in the same thread are part of that one"""
+    def __init__(self, directory, memory=False):
+        self.directory = directory
+        self.memory = memory
+        self._calls = itertools.count()
+        self._local = threading.local()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _path(self, name):
+        """Returns the path of the files for a call of name, without an
+           extension"""
+        return os.path.join(self.directory, '%s-%s-%d' %
+                            (name, time.strftime('%Y%m%d-%H%M%S'),
+                             next(self._calls)))
+
+    def run(self, name, function, *args, **kwargs):
+        """Calls function, profiling it as name"""
+        if getattr(self._local, 'active', False):
+            return function(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as msg:
+            #only one profiler can be active at once on newer pythons
+            logging.warning("Profiler: not profiling %s: %s", name, msg)
+            return function(*args, **kwargs)
+        self._local.active = True
+        before = tracemalloc.take_snapshot() if self.memory else None
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+            self._local.active = False
+            path = self._path(name)
+            try:
+                profile.dump_stats(path + '.pstats')
+                if before is not None:
+                    self._write_memory(path + '.malloc', before,
+                                       tracemalloc.take_snapshot())
+            except (IOError, OSError) as msg:
+                logging.warning("Profiler: unable to write %s: %s", path, msg)
+
+    def _write_memory(self, path, before, after):
+        """Writes the allocation sites that grew the most between two
+           snapshots"""
+        with open(path, 'w') as wfd:
+            for stat in after.compare_to(before, 'lineno')[:MEMORY_TOP]:
+                wfd.write('%s\n' % stat)
+
+def profiled(function, profiler):
+    """Returns function wrapped to be profiled by profiler"""
+    @functools.wraps(function)
+    def _profiled(*args, **kwargs):
+        """Calls function under the profiler"""
+        return profiler.run(function.__name__, function, *args, **kwargs)
+    return _profiled
+
+def profile_class(cls, profiler):
+    """Returns a subclass of a dbus.service.Object class with every
+       exported D-Bus method profiled by profiler"""
+    namespace = {}
+    for name in dir(cls):
+        attribute = getattr(cls, name)
+        if getattr(attribute, '_dbus_is_method', False):
+            namespace[name] = profiled(attribute, profiler)
+    #a name of its own keeps the D-Bus introspection data of cls intact
+    return type(cls)('Profiled' + cls.__name__, (cls,), namespace)
+
+def profiler_from_environment():
+    """Returns a Profiler if PROFILE_ENV names a directory, else None"""
+    directory = os.environ.get(PROFILE_ENV)
+    if not directory:
+        return None
+    return Profiler(directory, bool(os.environ.get(PROFILE_MEMORY_ENV)))
@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# «recovery_telemetry» - Timing of the external commands we run
+#
+# Copyright (C) 2020, Dell Inc.
+#
+# This is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this application; if not, write to the Free Software Foundation, Inc., 51
+# Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+
+import contextlib
+import os
+import subprocess
+import threading
+import time
+
+#Upper bounds in seconds of the wall time histogram buckets, the last
+#bucket takes everything slower
+HISTOGRAM_BUCKETS = (0.01, 0.1, 1, 10, 60, 600)
+
+def _command_name(args):
+    """Returns the name commands are aggregated by"""
+    if isinstance(args, (str, bytes)):
+        args = args.split()
+    if not args:
+        return ''
+    name = args[0]
+    if isinstance(name, bytes):
+        name = name.decode('utf-8', 'replace')
+    return os.path.basename(str(name))
+
+def _bucket(seconds):
+    """Returns the histogram bucket of a wall time"""
+    for index, bound in enumerate(HISTOGRAM_BUCKETS):
+        if seconds <= bound:
+            return index
+    return len(HISTOGRAM_BUCKETS)
+
+class CommandStats:
+    """Aggregates the runs of external commands by command name"""
+    def __init__(self):
+        self._commands = {}
+        self._lock = threading.Lock()
+
+    def record(self, args, wall, cpu, returncode, out_bytes=None,
+               err_bytes=None):
+        """Adds one run of the command args"""
+        name = _command_name(args)
+        with self._lock:
+            entry = self._commands.setdefault(name, {
+                'runs': 0, 'failures': 0, 'wall': 0.0, 'max_wall': 0.0,
+                'cpu': 0.0, 'stdout_bytes': 0, 'stderr_bytes': 0,
+                'histogram': [0] * (len(HISTOGRAM_BUCKETS) + 1)})
+            entry['runs'] += 1
+            if returncode != 0:
+                entry['failures'] += 1
+            entry['wall'] += wall
+            entry['max_wall'] = max(entry['max_wall'], wall)
+            entry['cpu'] += cpu or 0
+            entry['stdout_bytes'] += out_bytes or 0
+            entry['stderr_bytes'] += err_bytes or 0
+            entry['histogram'][_bucket(wall)] += 1
+
+    def commands(self):
+        """Describes every command as a string dictionary, those that
+           took the most time first.  histogram counts the runs per
+           HISTOGRAM_BUCKETS bucket, separated by spaces"""
+        with self._lock:
+            items = sorted(self._commands.items(),
+                           key=lambda item: item[1]['wall'], reverse=True)
+            return [{'command': name,
+                     'runs': str(entry['runs']),
+                     'failures': str(entry['failures']),
+                     'wall': '%.3f' % entry['wall'],
+                     'max_wall': '%.3f' % entry['max_wall'],
+                     'cpu': '%.3f' % entry['cpu'],
+                     'stdout_bytes': str(entry['stdout_bytes']),
+                     'stderr_bytes': str(entry['stderr_bytes']),
+                     'histogram': ' '.join(str(count)
+                                           for count in entry['histogram'])}
+                    for name, entry in items]
+
+    def report(self):
+        """Returns the aggregates as a text table for the log"""
+        lines = ['%-20s %5s %5s %10s %10s %10s  %s' %
+                 ('command', 'runs', 'fail', 'wall', 'max', 'cpu',
+                  'histogram (<=%s s, more)' %
+                  '/'.join(str(bound) for bound in HISTOGRAM_BUCKETS))]
+        for entry in self.commands():
+            lines.append('%-20s %5s %5s %10s %10s %10s  %s' %
+                         (entry['command'], entry['runs'], entry['failures'],
+                          entry['wall'], entry['max_wall'], entry['cpu'],
+                          entry['histogram']))
+        return '\n'.join(lines)
+
+#Every command run by this process
+COMMAND_STATS = CommandStats()
+
+_LOCAL = threading.local()
+
+@contextlib.contextmanager
+def collect_commands():
+    """Also aggregates the commands started by this thread inside the
+       block in the CommandStats it yields"""
+    stats = CommandStats()
+    previous = getattr(_LOCAL, 'stats', None)
+    _LOCAL.stats = stats
+    try:
+        yield stats
+    finally:
+        _LOCAL.stats = previous
+
+class TimedPopen(subprocess.Popen):
+    """A subprocess.Popen recording the wall and CPU time, exit code
+       and, when read through communicate(), output sizes of the command
+       in COMMAND_STATS once it has been reaped.  The times are also kept
+       in wall and cpu"""
+    def __init__(self, args, *popenargs, **kwargs):
+        self._started = time.monotonic()
+        self.wall = None
+        self.cpu = None
+        self._rusage = None
+        self._recorded = False
+        self._communicating = False
+        self._reap_lock = threading.Lock()
+        self._collector = getattr(_LOCAL, 'stats', None)
+        super().__init__(args, *popenargs, **kwargs)
+
+    def _reap(self, blocking):
+        """Reaps the command with os.wait4 to keep its resource usage.
+           Returns False while it is still running"""
+        if self.returncode is not None:
+            return True
+        if not self._reap_lock.acquire(blocking):
+            #another thread is waiting for it
+            return False
+        try:
+            if self.returncode is not None:
+                return True
+            try:
+                pid, status, rusage = os.wait4(self.pid,
+                                               0 if blocking else os.WNOHANG)
+            except ChildProcessError:
+                #somebody else reaped it, the exit code is lost
+                self.returncode = 0
+                return True
+            if pid != self.pid:
+                return False
+            self._rusage = rusage
+            if os.WIFSIGNALED(status):
+                self.returncode = -os.WTERMSIG(status)
+            else:
+                self.returncode = os.WEXITSTATUS(status)
+            return True
+        finally:
+            self._reap_lock.release()
+
+    def _finish(self, out=None, err=None):
+        """Records the command once it exited"""
+        if self.returncode is None or self._recorded or self._communicating:
+            return
+        self._recorded = True
+        self.wall = wall = time.monotonic() - self._started
+        cpu = None
+        if self._rusage is not None:
+            self.cpu = cpu = self._rusage.ru_utime + self._rusage.ru_stime
+        sizes = [len(out) if out is not None else None,
+                 len(err) if err is not None else None]
+        for stats in (COMMAND_STATS, self._collector):
+            if stats is not None:
+                stats.record(self.args, wall, cpu, self.returncode, *sizes)
+
+    def poll(self):
+        self._reap(False)
+        self._finish()
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if timeout is None:
+            self._reap(True)
+        else:
+            endtime = time.monotonic() + timeout
+            delay = 0.0005
+            while not self._reap(False):
+                remaining = endtime - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(self.args, timeout)
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.05)
+        self._finish()
+        return self.returncode
+
+    def communicate(self, input=None, timeout=None):
+        self._communicating = True
+        try:
+            out, err = super().communicate(input, timeout)
+        finally:
+            self._communicating = False
+        self._finish(out, err)
+        return out, err
+
+def timed_call(*popenargs, **kwargs):
+    """subprocess.call recording the command in COMMAND_STATS"""
+    with TimedPopen(*popenargs, **kwargs) as proc:
+        return proc.wait()
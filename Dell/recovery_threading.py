@@ -23,10 +23,14 @@
 # with this application; if not, write to the Free Software Foundation, Inc., 51
 # Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 ##################################################################################
-from threading import Thread, Event
+from threading import Thread, Event, Lock, Timer
 import logging
 import os
 import sys
+import time
+
+#Shortest time between two progress signals for the same job
+PROGRESS_INTERVAL = 0.5
 
 if sys.version >= '3':
     def callable(obj):
@@ -119,3 +123,85 @@ class ProgressByPulse(Thread):
         Thread.join(self, timeout)
 
 #--------------------------------------------------------------------#
+def _timer(delay, function):
+    """Default scheduler for ProgressPublisher: calls function once,
+       delay seconds from now, on its own thread"""
+    timer = Timer(delay, function)
+    timer.daemon = True
+    timer.start()
+
+def _is_pulse(percent):
+    """Negative percentages ask the UI to pulse, so repeating one isn't
+       redundant"""
+    try:
+        return float(percent) < 0
+    except (TypeError, ValueError):
+        return False
+
+class ProgressPublisher:
+    """Coalesces progress updates so clients see at most one every
+       interval seconds for each key (usually a job).
+
+       Updates identical to what was last sent are dropped, except pulses.  Updates that
+       arrive too soon replace each other and only the latest is sent once
+       the interval has passed.  finish() always sends the final state.
+       emit(key, message, percent) sends an update; schedule(delay, function)
+       arranges for function to be called later"""
+    def __init__(self, emit, interval=PROGRESS_INTERVAL, clock=time.monotonic,
+                 schedule=_timer):
+        self.emit = emit
+        self.interval = interval
+        self.clock = clock
+        self.schedule = schedule
+        self._lock = Lock()
+        self._sent = {}
+        self._last = {}
+        self._pending = {}
+
+    def publish(self, key, message, percent):
+        """Sends an update now, later or not at all"""
+        update = (message, percent)
+        with self._lock:
+            if key in self._pending:
+                self._pending[key] = update
+                return
+            if self._sent.get(key) == update and not _is_pulse(percent):
+                return
+            wait = self._last.get(key, -self.interval) + self.interval - self.clock()
+            if wait <= 0:
+                self._send(key, update)
+                return
+            self._pending[key] = update
+        self.schedule(wait, lambda: self.flush(key))
+
+    def flush(self, key):
+        """Sends the update held back for key, if it differs from the
+           last one sent"""
+        with self._lock:
+            update = self._pending.pop(key, None)
+            if update is not None and (self._sent.get(key) != update or
+                                       _is_pulse(update[1])):
+                self._send(key, update)
+
+    def finish(self, key, message=None, percent=None):
+        """Sends the final state of key and forgets about it.  Without
+           a message, the latest update seen is the final state"""
+        with self._lock:
+            update = self._pending.pop(key, None)
+            if message is not None:
+                update = (message, percent)
+            if update is not None:
+                self._send(key, update)
+            self._sent.pop(key, None)
+            self._last.pop(key, None)
+
+    def _send(self, key, update):
+        """Emits an update, called with the lock held"""
+        self._sent[key] = update
+        self._last[key] = self.clock()
+        try:
+            self.emit(key, *update)
+        except Exception:
+            logging.exception('Could not update progress:')
+
+#--------------------------------------------------------------------#
@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# «recovery_workers» - Worker processes for heavy backend tasks
+#
+# Copyright (C) 2020, Dell Inc.
+#
+# This is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this application; if not, write to the Free Software Foundation, Inc., 51
+# Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+
+WORKER_PROCESSES = min(4, os.cpu_count() or 1)
+
+#Modules every worker needs, loaded once by the fork server
+WORKER_PRELOAD = ['Dell.recovery_common', 'Dell.recovery_fish']
+
+#In a worker: the pipe carrying progress back to the backend
+_PROGRESS = None
+
+def _init_worker(progress):
+    """Runs once in every new worker process"""
+    global _PROGRESS
+    _PROGRESS = progress
+
+def _call(task_id, func, args, kwargs, with_progress):
+    """Runs a task inside a worker, handing it a progress callback
+       that reports back over the pipe if the caller asked for one"""
+    if not with_progress:
+        return func(*args, **kwargs)
+
+    def progress(*report):
+        """Sends a progress report for this task to the backend"""
+        _PROGRESS.put((task_id,) + report)
+    kwargs['progress'] = progress
+    try:
+        return func(*args, **kwargs)
+    finally:
+        #a bare task ID tells the listener this task won't report again
+        _PROGRESS.put((task_id,))
+
+class WorkerPool:
+    """Runs heavy functions (hashing, extraction, tree copies) in worker
+       processes so they don't hold the backend's GIL.
+
+       Workers come from a forkserver rather than a fork of the threaded
+       backend and are only started the first time a task is submitted.
+       Functions and their arguments must be picklable."""
+    def __init__(self, processes=WORKER_PROCESSES):
+        self.processes = processes
+        self._pool = None
+        self._pipe = None
+        self._listener = None
+        self._handlers = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """Starts the worker processes and the progress listener"""
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(WORKER_PRELOAD)
+        self._pipe = context.SimpleQueue()
+        self._pool = context.Pool(self.processes, initializer=_init_worker,
+                                  initargs=(self._pipe,))
+        self._listener = threading.Thread(target=self._listen,
+                                          name='worker-progress')
+        self._listener.daemon = True
+        self._listener.start()
+        logging.debug("WorkerPool: started %d workers", self.processes)
+
+    def _listen(self):
+        """Dispatches progress reports from the workers to their handlers"""
+        while True:
+            report = self._pipe.get()
+            if report is None:
+                break
+            if len(report) == 1:
+                self._handlers.pop(report[0], None)
+                continue
+            handler = self._handlers.get(report[0])
+            if handler is None:
+                continue
+            try:
+                handler(*report[1:])
+            except Exception:
+                logging.exception('Could not update progress:')
+
+    def submit(self, func, *args, progress=None, **kwargs):
+        """Queues func(*args, **kwargs) on a worker, returns its AsyncResult.
+           If progress is given, func is called with a progress keyword
+           whose calls are forwarded to progress in this process"""
+        with self._lock:
+            if self._pool is None:
+                self._start()
+            task_id = next(self._ids)
+            if progress is not None:
+                self._handlers[task_id] = progress
+            return self._pool.apply_async(_call, (task_id, func, args, kwargs,
+                                                  progress is not None))
+
+    def run(self, func, *args, progress=None, **kwargs):
+        """Runs func on a worker and waits for its result.  Exceptions
+           raised by func are raised again here"""
+        return self.submit(func, *args, progress=progress, **kwargs).get()
+
+    def close(self):
+        """Waits for queued tasks and stops the workers"""
+        with self._lock:
+            if self._pool is None:
+                return
+            self._pool.close()
+            self._pool.join()
+            self._pipe.put(None)
+            self._listener.join()
+            self._pool = None
@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# «recovery_workspace» - Scratch space for backend builds
+#
+# Copyright (C) 2020, Dell Inc.
+#
+# This is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this application; if not, write to the Free Software Foundation, Inc., 51
+# Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+
+#Space always left free on the workspace volume, in bytes
+WORKSPACE_RESERVE = 256 * 1024 * 1024
+
+class InsufficientSpace(Exception):
+    """Raised if a workspace doesn't fit on the workspace volume"""
+
+class Workspace:
+    """A scratch directory and the space set aside for it"""
+    def __init__(self, path, owner, needed):
+        self.path = path
+        self.owner = owner
+        self.needed = needed
+
+class WorkspaceManager:
+    """Hands out scratch directories on one volume.
+
+       Before a workspace is created the volume must have room for it,
+       for what other live workspaces said they need, and for
+       WORKSPACE_RESERVE.  What live workspaces need is charged against
+       the free space the volume had when the first of them was made, so
+       their trees never have to be measured.  Workspaces belong to an
+       owner (a job or a single method call) and are deleted in the
+       background as soon as it releases them."""
+    def __init__(self, root=None, reserve=WORKSPACE_RESERVE):
+        self.root = root or tempfile.gettempdir()
+        self.reserve = reserve
+        self._workspaces = []
+        #free bytes on the volume before the live workspaces were made
+        self._baseline = None
+        self._lock = threading.Lock()
+        self._deletions = queue.Queue()
+        self._deleting = set()
+        self._deleter = None
+
+    def free(self):
+        """Bytes available on the workspace volume"""
+        statvfs = os.statvfs(self.root)
+        return statvfs.f_frsize * statvfs.f_bavail
+
+    def available(self):
+        """Bytes a new workspace may still use"""
+        with self._lock:
+            return self._available()
+
+    def _available(self):
+        """available() for callers holding the lock"""
+        free = self.free()
+        if self._baseline is None:
+            return free - self.reserve
+        reserved = sum(workspace.needed for workspace in self._workspaces)
+        #what the workspaces wrote since is already missing from free
+        return min(free, self._baseline - reserved) - self.reserve
+
+    def allocate(self, owner, needed=0, prefix='tmp'):
+        """Creates a workspace for owner expected to hold needed bytes.
+           Raises InsufficientSpace if that doesn't fit"""
+        with self._lock:
+            if not os.path.isdir(self.root):
+                os.makedirs(self.root)
+            if not self._workspaces:
+                self._baseline = self.free()
+            available = self._available()
+            if needed > available:
+                raise InsufficientSpace("%s needs %d MiB more space than is "
+                                        "available in %s" % (prefix,
+                                        (needed - available) // 1048576 + 1,
+                                        self.root))
+            path = tempfile.mkdtemp(prefix=prefix + '-', dir=self.root)
+            self._workspaces.append(Workspace(path, owner, needed))
+        logging.debug("WorkspaceManager: %s for %s, %d bytes", path, owner, needed)
+        return path
+
+    def release(self, owner):
+        """Deletes the workspaces of owner in the background"""
+        with self._lock:
+            released = [workspace for workspace in self._workspaces
+                        if workspace.owner == owner]
+            for workspace in released:
+                self._workspaces.remove(workspace)
+                self._deleting.add(workspace.path)
+                self._deletions.put(workspace.path)
+            if not self._workspaces:
+                self._baseline = None
+            if released and self._deleter is None:
+                self._deleter = threading.Thread(target=self._delete,
+                                                 name='workspace-deleter')
+                self._deleter.daemon = True
+                self._deleter.start()
+
+    def release_all(self):
+        """Deletes every workspace right away"""
+        with self._lock:
+            paths = [workspace.path for workspace in self._workspaces]
+            paths += list(self._deleting)
+            self._workspaces = []
+            self._baseline = None
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def wait(self):
+        """Waits until background deletions are done"""
+        self._deletions.join()
+
+    def _delete(self):
+        """Body of the deletion thread"""
+        while True:
+            path = self._deletions.get()
+            try:
+                shutil.rmtree(path, ignore_errors=True)
+            finally:
+                with self._lock:
+                    self._deleting.discard(path)
+                self._deletions.task_done()
+
+    def usage(self):
+        """Describes the volume and every workspace as string dictionaries.
+           used is what the volume lost since the first live workspace was
+           made, reserved what live workspaces said they need"""
+        with self._lock:
+            workspaces = list(self._workspaces)
+            deleting = len(self._deleting)
+            baseline = self._baseline
+        free = self.free()
+        details = [{'path': workspace.path,
+                    'owner': str(workspace.owner or ''),
+                    'needed': str(workspace.needed)} for workspace in workspaces]
+        summary = {'root': self.root,
+                   'free': str(free),
+                   'reserve': str(self.reserve),
+                   'workspaces': str(len(workspaces)),
+                   'reserved': str(sum(workspace.needed
+                                       for workspace in workspaces)),
+                   'used': str(max(0, baseline - free)
+                               if baseline is not None else 0),
+                   'deleting': str(deleting)}
+        return summary, details
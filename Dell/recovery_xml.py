@@ -25,6 +25,7 @@
 
 import xml.dom.minidom
 import codecs
+import datetime
 import os
 
 def utf8str(old):
@@ -57,6 +58,34 @@ class BTOxml:
         new_element.appendChild(new_node)
         elements[0].appendChild(new_element)
 
+    def add_timing(self, timing_type, phase, start, end, size=None):
+        """Appends how long a phase took (start and end in seconds since
+           the epoch) and how many bytes it moved"""
+        elements = self.dom.getElementsByTagName('timings')
+        new_element = self.dom.createElement(timing_type)
+        new_element.setAttribute('phase', phase)
+        for name, stamp in (('start', start), ('end', end)):
+            new_element.setAttribute(name, datetime.datetime.fromtimestamp(
+                                     stamp, datetime.timezone.utc).isoformat())
+        new_element.setAttribute('seconds', '%.3f' % (end - start))
+        if size is not None:
+            new_element.setAttribute('bytes', str(size))
+        elements[0].appendChild(new_element)
+
+    def clear_timings(self, timing_type):
+        """Removes the timings of one type"""
+        for element in self.dom.getElementsByTagName(timing_type):
+            if element.parentNode.localName == 'timings':
+                element.parentNode.removeChild(element)
+
+    def fetch_timings(self, timing_type):
+        """Fetches the timings of one type as dictionaries"""
+        timings = []
+        for element in self.dom.getElementsByTagName(timing_type):
+            if element.parentNode.localName == 'timings':
+                timings.append(dict(element.attributes.items()))
+        return timings
+
     def fetch_node_contents(self, tag):
         """Fetches all children of a tag"""
         elements = self.dom.getElementsByTagName(tag)
@@ -126,7 +155,7 @@ class BTOxml:
             bto = self.dom.getElementsByTagName('bto')[0]
 
         #create all our second and third level tags that are supported
-        for tag in ['date', 'versions', 'base', 'fid', 'fish', 'logs']:
+        for tag in ['date', 'versions', 'base', 'fid', 'fish', 'logs', 'timings']:
             element = create_tag(self.dom, tag, bto)
             subtags = []
             if tag == 'versions':
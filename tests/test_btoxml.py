@@ -96,6 +96,22 @@ class ReadWriteNewBTOxmlTestCase(BTOxmlTestCase):
         self._save()
         self.assertEqual('2011-11-22', self._read_node('date'))
 
+    def test_timings(self):
+        self.xmlobj.add_timing('build', 'copy', 0, 1.5, 1024)
+        self.xmlobj.add_timing('rp', 'grub', 60, 70)
+        self._save()
+        self.newxmlobj = recovery_xml.BTOxml()
+        self.newxmlobj.load_bto_xml(self.xmlpath)
+        build = self.newxmlobj.fetch_timings('build')
+        self.assertEqual([{'phase': 'copy', 'start': '1970-01-01T00:00:00+00:00',
+                           'end': '1970-01-01T00:00:01.500000+00:00',
+                           'seconds': '1.500', 'bytes': '1024'}], build)
+        self.assertEqual('10.000',
+                         self.newxmlobj.fetch_timings('rp')[0]['seconds'])
+        self.newxmlobj.clear_timings('build')
+        self.assertEqual([], self.newxmlobj.fetch_timings('build'))
+        self.assertEqual(1, len(self.newxmlobj.fetch_timings('rp')))
+
 class ReadWriteExistedBTOxmlTestCase(ReadWriteNewBTOxmlTestCase):
 
     def setUp(self):
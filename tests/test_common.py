@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- encoding:utf-8 -*-
+#
+# This is a free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this software; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA 02111-1307 USA
+import gzip
+import lzma
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from Dell import recovery_common
+except ImportError:
+    #needs the dbus bindings
+    recovery_common = None
+
+@unittest.skipUnless(recovery_common, 'dbus bindings are not installed')
+class FetchOutputTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.runs = os.path.join(self.tmp, 'runs')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def command(self, output):
+        """A shell command printing output and counting its runs"""
+        return ['sh', '-c', 'echo x >> %s; printf "%s"' % (self.runs, output)]
+
+    def test_undecodable_output_runs_once(self):
+        cmd = self.command(r'ok\377\r\nnext')
+        self.assertEqual('ok�\nnext', recovery_common.fetch_output(cmd))
+        self.assertEqual('ok\nnext', recovery_common.fetch_output(cmd,
+                                                                 errors='ignore'))
+        self.assertEqual(b'ok\xff\r\nnext',
+                         recovery_common.fetch_output_bytes(cmd))
+        with open(self.runs) as rfd:
+            self.assertEqual(3, len(rfd.readlines()))
+
+    def test_failure(self):
+        self.assertRaises(RuntimeError, recovery_common.fetch_output, ['false'])
+
+    def test_iter_output_lines(self):
+        lines = recovery_common.iter_output_lines(self.command(r'a\nb\377\nc\n'))
+        self.assertEqual(['a', 'b�', 'c'], list(lines))
+
+    def test_iter_stops_early(self):
+        lines = recovery_common.iter_output_lines(['yes'])
+        self.assertEqual('y', next(lines))
+        lines.close()
+
+    def test_iter_check(self):
+        lines = recovery_common.iter_output_lines(['sh', '-c', 'echo a; exit 3'])
+        self.assertEqual('a', next(lines))
+        self.assertRaises(RuntimeError, next, lines)
+        lines = recovery_common.iter_output_lines(['sh', '-c', 'exit 3'],
+                                                  check=False)
+        self.assertEqual([], list(lines))
+
+@unittest.skipUnless(recovery_common, 'dbus bindings are not installed')
+class RecoveryTreeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, content=b'', opener=open):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with opener(path, 'wb') as wfd:
+            wfd.write(content)
+        return path
+
+    def stanza(self, package, version):
+        return ('Package: %s\nVersion: %s\n\n' % (package, version)).encode()
+
+    def test_packages_indexes(self):
+        self.assertEqual(None, recovery_common.rp_packages_version(
+            self.root, 'dell-recovery'))
+        binary = 'dists/focal/main/binary-amd64/'
+        self.write(binary + 'Packages.gz', self.stanza('dell-recovery', '1.40'),
+                   gzip.open)
+        self.write('dists/focal/restricted/binary-amd64/Packages.xz',
+                   self.stanza('dell-recovery', '1.45') +
+                   self.stanza('other', '9.0'), lzma.open)
+        self.assertEqual('1.45', recovery_common.rp_packages_version(
+            self.root, 'dell-recovery'))
+        #the plain copy of an index wins over its compressed one
+        self.write(binary + 'Packages', self.stanza('dell-recovery', '1.50'))
+        self.assertEqual('1.50', recovery_common.rp_packages_version(
+            self.root, 'dell-recovery'))
+        self.assertEqual('', recovery_common.rp_packages_version(
+            self.root, 'missing'))
+
+    def test_index_paths(self):
+        self.assertEqual(None, recovery_common.rp_index_paths(self.root))
+        self.write('md5sum.txt', b'This file contains the list of md5 '
+                   b'checksums\n\n'
+                   b'0123  ./pool/main/d/dell-recovery_1.50_all.deb\n'
+                   b'4567  ./casper/my file.manifest\n')
+        self.assertEqual(['pool/main/d/dell-recovery_1.50_all.deb',
+                          'casper/my file.manifest'],
+                         list(recovery_common.rp_index_paths(self.root)))
+
+    def test_walk_prunes(self):
+        self.write('boot/dell-recovery_9.0_all.deb')
+        self.write('srv/dell-recovery_9.0_all.deb')
+        self.write('pool/main/dell-recovery_1.50_all.deb')
+        self.write('bto.xml')
+        paths = [path for batch in recovery_common.rp_walk_paths(self.root)
+                 for path in batch]
+        self.assertEqual(sorted(['bto.xml',
+                                 'pool/main/dell-recovery_1.50_all.deb']),
+                         sorted(paths))
+
+    def test_debs_newer_than_pool(self):
+        self.write('dists/focal/main/binary-amd64/Packages',
+                   self.stanza('dell-recovery', '1.50'))
+        self.write('pool/main/d/dell-recovery_1.50_all.deb')
+        self.write('debs/dell-recovery_1.60_all.deb')
+        self.write('casper/filesystem.manifest')
+        found, manifests = recovery_common.rp_package_version(self.root,
+                                                              'dell-recovery')
+        self.assertEqual('1.60', found)
+        self.assertEqual([os.path.join(self.root, 'casper',
+                                       'filesystem.manifest')], manifests)
+        #also when md5sum.txt was written before debs/ was filled
+        self.write('md5sum.txt',
+                   b'0123  ./pool/main/d/dell-recovery_1.50_all.deb\n')
+        self.assertEqual('1.60', recovery_common.rp_package_version(
+            self.root, 'dell-recovery')[0])
+
+if __name__ == '__main__':
+    unittest.main()
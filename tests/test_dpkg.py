@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- encoding:utf-8 -*-
+#
+# This is a free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this software; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA 02111-1307 USA
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from Dell import recovery_dpkg
+
+STATUS = """Package: dell-recovery-extra
+Status: install ok installed
+Version: 9.9
+
+Package: dell-recovery
+Status: install ok installed
+Priority: optional
+Version: 1:2.0ubuntu1
+Description: Dell Recovery Media
+ A tool to create recovery media.
+
+Package: removed
+Status: deinstall ok config-files
+Version: 1.0
+"""
+
+class DpkgTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.status = os.path.join(self.tmp, 'status')
+        with open(self.status, 'w') as wfd:
+            wfd.write(STATUS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_read_status(self):
+        fields = recovery_dpkg.read_status('dell-recovery', self.status)
+        self.assertEqual('1:2.0ubuntu1', fields['Version'])
+        self.assertEqual('Dell Recovery Media\n A tool to create recovery media.',
+                         fields['Description'])
+        self.assertEqual(None, recovery_dpkg.read_status('missing', self.status))
+
+    def test_installed_version(self):
+        self.assertEqual('1:2.0ubuntu1',
+                         recovery_dpkg.installed_version('dell-recovery',
+                                                         self.status))
+        self.assertEqual(None, recovery_dpkg.installed_version('removed',
+                                                               self.status))
+
+    def test_cached_version(self):
+        self.assertEqual('1:2.0ubuntu1',
+                         recovery_dpkg.cached_version('dell-recovery', self.status))
+        stat = os.stat(self.status)
+        with open(self.status, 'w') as wfd:
+            wfd.write(STATUS.replace('1:2.0ubuntu1', '1:2.1ubuntu1'))
+        #not read again while the file looks the same
+        os.utime(self.status, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual('1:2.0ubuntu1',
+                         recovery_dpkg.cached_version('dell-recovery', self.status))
+        os.utime(self.status, ns=(0, 0))
+        self.assertEqual('1:2.1ubuntu1',
+                         recovery_dpkg.cached_version('dell-recovery', self.status))
+        os.remove(self.status)
+        self.assertRaises(OSError, recovery_dpkg.cached_version,
+                          'dell-recovery', self.status)
+        self.assertEqual(None, recovery_dpkg.installed_version('dell-recovery',
+                                                               self.status))
+
+    def test_changelog_distribution(self):
+        os.makedirs(os.path.join(self.tmp, 'dell-recovery'))
+        with gzip.open(os.path.join(self.tmp, 'dell-recovery', 'changelog.gz'),
+                       'wt') as wfd:
+            wfd.write('dell-recovery (2.0ubuntu1) focal; urgency=medium\n\n')
+        self.assertEqual('focal', recovery_dpkg.changelog_distribution(
+            'dell-recovery', self.tmp))
+
+    def test_repack_cache(self):
+        cache = recovery_dpkg.RepackCache(os.path.join(self.tmp, 'repack'),
+                                          self.status)
+        runs = os.path.join(self.tmp, 'runs')
+        cache.command = ['sh', '-c', 'echo x >> %s; touch "$0"_all.deb' % runs]
+        deb = cache.fetch('dell-recovery')
+        self.assertEqual('dell-recovery_all.deb', os.path.basename(deb))
+        self.assertEqual(deb, cache.fetch('dell-recovery'))
+        with open(runs) as rfd:
+            self.assertEqual(1, len(rfd.readlines()))
+        #a change of the dpkg database repacks
+        os.utime(self.status, ns=(0, 0))
+        self.assertNotEqual(deb, cache.fetch('dell-recovery'))
+        self.assertFalse(os.path.exists(deb))
+        self.assertEqual(1, len(os.listdir(cache.path)))
+        self.assertEqual(None, cache.fetch('removed'))
+
+if __name__ == '__main__':
+    unittest.main()
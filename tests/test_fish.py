@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- encoding:utf-8 -*-
+#
+# This is a free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this software; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA 02111-1307 USA
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from unittest import mock
+
+from Dell import recovery_fish
+
+class FishBase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def archive(self, name, members, mode='w:gz'):
+        """Writes a tarball with members, a dictionary of names to contents"""
+        path = os.path.join(self.tmp, name)
+        with tarfile.open(path, mode) as wfd:
+            for member, content in sorted(members.items()):
+                info = tarfile.TarInfo(member)
+                info.size = len(content)
+                wfd.addfile(info, io.BytesIO(content))
+        return path
+
+    def md5(self, path):
+        with open(path, 'rb') as rfd:
+            return hashlib.md5(rfd.read()).hexdigest()
+
+class FishTestCase(FishBase):
+
+    def test_extract(self):
+        path = self.archive('fish.tgz', {'debs/a.deb': b'a' * 4096,
+                                         'scripts/b.sh': b'b'})
+        dest = os.path.join(self.tmp, 'dest')
+        result = recovery_fish.extract_fish_archive(path, dest)
+        self.assertEqual(self.md5(path), result['md5'])
+        self.assertTrue(result['tar'])
+        self.assertFalse(result['dangerous'])
+        self.assertEqual(None, result['nested'])
+        with open(os.path.join(dest, 'debs', 'a.deb'), 'rb') as rfd:
+            self.assertEqual(b'a' * 4096, rfd.read())
+
+    def test_nested(self):
+        path = self.archive('nested.tar', {'index.html': b'', 'inner.tgz': b'x'},
+                            mode='w')
+        result = recovery_fish.extract_fish_archive(path,
+                                                    os.path.join(self.tmp, 'dest'))
+        self.assertEqual('index.html', result['nested'])
+        self.assertEqual(self.md5(path), result['md5'])
+
+    def test_dangerous(self):
+        path = self.archive('bad.tgz', {'ok': b'', 'a/../../escape': b''})
+        dest = os.path.join(self.tmp, 'dest')
+        result = recovery_fish.extract_fish_archive(path, dest)
+        self.assertTrue(result['dangerous'])
+        self.assertFalse(os.path.exists(dest))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'escape')))
+        self.assertEqual(self.md5(path), result['md5'])
+
+    def test_not_a_tarball(self):
+        path = os.path.join(self.tmp, 'readme')
+        with open(path, 'wb') as wfd:
+            wfd.write(b'not a tarball' * 100)
+        result = recovery_fish.extract_fish_archive(path,
+                                                    os.path.join(self.tmp, 'dest'))
+        self.assertFalse(result['tar'])
+        self.assertEqual(self.md5(path), result['md5'])
+
+    def test_merge_tree(self):
+        source = os.path.join(self.tmp, 'source')
+        dest = os.path.join(self.tmp, 'dest')
+        for root, name, content in [(dest, 'debs/old.deb', 'old'),
+                                    (dest, 'debs/same.deb', 'old'),
+                                    (source, 'debs/same.deb', 'new'),
+                                    (source, 'docs/new.pdf', 'new')]:
+            path = os.path.join(root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as wfd:
+                wfd.write(content)
+        recovery_fish.merge_tree(source, dest)
+        self.assertFalse(os.path.exists(source))
+        for name, content in [('debs/old.deb', 'old'), ('debs/same.deb', 'new'),
+                              ('docs/new.pdf', 'new')]:
+            with open(os.path.join(dest, name)) as rfd:
+                self.assertEqual(content, rfd.read())
+
+class FishCacheTestCase(FishBase):
+
+    def setUp(self):
+        FishBase.setUp(self)
+        self.cache = recovery_fish.FishCache(os.path.join(self.tmp, 'cache'))
+        self.path = self.archive('fish.tgz', {'debs/a.deb': b'a' * 4096,
+                                              'docs/b.pdf': b'b'})
+
+    def extract(self, name):
+        dest = os.path.join(self.tmp, name)
+        return dest, recovery_fish.extract_fish_archive(self.path, dest,
+                                                         self.cache)
+
+    def test_reuse(self):
+        first, result = self.extract('first')
+        self.assertEqual(self.md5(self.path), result['md5'])
+        second, cached = self.extract('second')
+        self.assertEqual(result, cached)
+        stat = os.stat(os.path.join(second, 'debs', 'a.deb'))
+        with open(os.path.join(second, 'docs', 'b.pdf'), 'rb') as rfd:
+            self.assertEqual(b'b', rfd.read())
+        #linked from the cache rather than extracted again
+        self.assertGreater(stat.st_nlink, 1)
+        self.assertEqual(1, len(self.cache.entries()))
+
+    def test_changed_entry(self):
+        first, result = self.extract('first')
+        with open(os.path.join(first, 'debs', 'a.deb'), 'ab') as wfd:
+            wfd.write(b'changed')
+        second, cached = self.extract('second')
+        self.assertEqual(result, cached)
+        with open(os.path.join(second, 'debs', 'a.deb'), 'rb') as rfd:
+            self.assertEqual(b'a' * 4096, rfd.read())
+
+    def test_changed_entry_restored_times(self):
+        first, result = self.extract('first')
+        path = os.path.join(first, 'debs', 'a.deb')
+        stat = os.stat(path)
+        with open(path, 'r+b') as wfd:
+            wfd.write(b'b')
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        second, cached = self.extract('second')
+        self.assertEqual(result, cached)
+        with open(os.path.join(second, 'debs', 'a.deb'), 'rb') as rfd:
+            self.assertEqual(b'a' * 4096, rfd.read())
+
+    def test_changed_mode(self):
+        first, result = self.extract('first')
+        os.chmod(os.path.join(first, 'docs', 'b.pdf'), 0o4777)
+        second, cached = self.extract('second')
+        self.assertEqual(result, cached)
+        self.assertNotEqual(0o4777, os.stat(os.path.join(second, 'docs',
+                                                         'b.pdf')).st_mode & 0o7777)
+
+    def test_trim(self):
+        self.extract('first')
+        self.path = self.archive('other.tgz', {'debs/c.deb': b'c' * 8192})
+        self.cache.limit = 10000
+        self.extract('second')
+        entries = self.cache.entries()
+        self.assertEqual([8192], [size for used, size, md5 in entries])
+        self.assertEqual(1, len(os.listdir(os.path.join(self.cache.path,
+                                                        'signatures'))))
+
+    def test_signatures_of_removed_packages(self):
+        #nested FISH comes from a staging directory deleted after each build
+        staging = os.path.join(self.tmp, '.fish-staging')
+        package = self.path
+        signatures = os.path.join(self.cache.path, 'signatures')
+        for name in ['first', 'second']:
+            os.makedirs(staging)
+            self.path = shutil.copy(package, staging)
+            self.extract(name)
+            shutil.rmtree(staging)
+            self.assertEqual(1, len(os.listdir(signatures)))
+        self.cache.trim()
+        self.assertEqual([], os.listdir(signatures))
+        self.assertEqual(1, len(self.cache.entries()))
+
+class StageFileTestCase(FishBase):
+
+    def setUp(self):
+        FishBase.setUp(self)
+        self.source = self.archive('srv.tgz', {'big': b'x' * 4096})
+        self.target = os.path.join(self.tmp, 'staged')
+
+    def test_link(self):
+        with open(self.target, 'w') as wfd:
+            wfd.write('old')
+        self.assertIn(recovery_fish.stage_file(self.source, self.target, {}),
+                      ['link', 'reflink'])
+        self.assertEqual(self.md5(self.source), self.md5(self.target))
+
+    @mock.patch('fcntl.ioctl', side_effect=OSError('not supported'))
+    @mock.patch('os.link', side_effect=OSError('cross device'))
+    def test_graft(self, link, ioctl):
+        grafts = {}
+        self.assertEqual('graft', recovery_fish.stage_file(self.source,
+                                                           self.target, grafts))
+        self.assertFalse(os.path.exists(self.target))
+        self.assertEqual({self.target: self.source}, grafts)
+        digest = hashlib.md5()
+        self.assertEqual('copy', recovery_fish.stage_file(self.source,
+                                                          self.target,
+                                                          digest=digest))
+        self.assertEqual(self.md5(self.source), self.md5(self.target))
+        self.assertEqual(self.md5(self.source), digest.hexdigest())
+
+class DigestCacheTestCase(FishBase):
+
+    def test_digests(self):
+        path = os.path.join(self.tmp, 'digests.json')
+        fishie = self.archive('a.tgz', {'a': b'a'})
+        other = self.archive('b.tgz', {'b': b'b'})
+        digests = recovery_fish.DigestCache(path, limit=1)
+        self.assertEqual(None, digests.get(fishie))
+        digests.put(fishie, 'abc')
+        self.assertEqual('abc', digests.get(fishie))
+        digests.save()
+        self.assertEqual('abc', recovery_fish.DigestCache(path).get(fishie))
+        #only the most recent file is kept
+        digests.put(other, 'def')
+        self.assertEqual(None, digests.get(fishie))
+        #a changed file is not trusted
+        os.utime(other, ns=(0, 0))
+        self.assertEqual(None, digests.get(other))
+
+PREPACKAGE = b"""<?xml version="1.0" encoding="utf-8"?>
+<bto><os>%s</os><driver>wifi</driver></bto>
+"""
+
+class PackageValidatorTestCase(FishBase):
+
+    def setUp(self):
+        FishBase.setUp(self)
+        self.validator = recovery_fish.PackageValidator('20.04')
+
+    def package(self, name='driver-fish.tar.gz', release=b'20.04'):
+        return self.archive(name, {'debs/a.deb': b'a',
+                                   'prepackage.dell': PREPACKAGE % release})
+
+    def test_valid(self):
+        self.assertEqual((1, 'wifi', ''), self.validator.validate(self.package()))
+
+    def test_other_release(self):
+        valid, description, error = self.validator.validate(
+            self.package(release=b'18.04'))
+        self.assertEqual((0, 'wifi'), (valid, description))
+        self.assertIn('18.04', error)
+
+    def test_missing_descriptor(self):
+        path = self.archive('driver-fish.tar.gz', {'debs/a.deb': b'a'})
+        self.assertEqual((-1, [''], 'Missing or invalid XML descriptor '
+                          '(prepackage.dell)'), self.validator.validate(path))
+
+    def test_bad_name(self):
+        self.assertEqual(-1, self.validator.validate(
+            self.package('driver.tgz'))[0])
+        self.assertEqual(-1, self.validator.validate(
+            os.path.join(self.tmp, 'missing-fish.tar.gz'))[0])
+
+    def test_cache(self):
+        path = self.package()
+        self.assertEqual(1, self.validator.validate(path)[0])
+        stat = os.stat(path)
+        #not read again while the package looks the same
+        with mock.patch('tarfile.open', side_effect=AssertionError('read')):
+            self.assertEqual(1, self.validator.validate(path)[0])
+        self.package(release=b'18.04')
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertEqual(0, self.validator.validate(path)[0])
+
+    def test_cache_limit(self):
+        self.validator.limit = 2
+        paths = [self.package('%d-fish.tar.gz' % index) for index in range(3)]
+        for path in paths:
+            self.validator.validate(path)
+        self.assertEqual(sorted(paths[1:]), sorted(self.validator._results))
+
+if __name__ == '__main__':
+    unittest.main()
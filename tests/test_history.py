@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- encoding:utf-8 -*-
+#
+# This is a free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this software; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA 02111-1307 USA
+import os
+import shutil
+import tempfile
+import unittest
+
+from Dell import recovery_history
+
+class FakeClock:
+    """A clock advanced by hand"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class BuildHistoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'lib', 'build-history.jsonl')
+        self.history = recovery_history.BuildHistory(self.path, limit=3)
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build(self, state='finished', copy_seconds=10, iso_seconds=20):
+        """Records a build copying 1000 bytes and writing a 2000 byte ISO"""
+        record = recovery_history.BuildRecord('assemble_image', self.clock)
+        record.stage('copy', 1000)
+        self.clock.now += copy_seconds
+        record.stage('iso')
+        self.clock.now += iso_seconds
+        record.end_stage(2000)
+        return record.finish(state)
+
+    def test_record(self):
+        record = self.build()
+        self.assertEqual(30, record['seconds'])
+        self.assertEqual({'seconds': 10, 'bytes': 1000}, record['stages']['copy'])
+        self.assertEqual({'seconds': 20, 'bytes': 2000}, record['stages']['iso'])
+
+    def test_spans(self):
+        record = recovery_history.BuildRecord('create_ubuntu', self.clock)
+        for size in (100, 200):
+            record.stage('copy', size)
+            self.clock.now += 5
+        record.end_stage()
+        self.assertEqual({'seconds': 10, 'bytes': 300}, record.stages['copy'])
+        self.assertEqual([(0, 5, 100), (5, 10, 200)],
+                         [(span['start'] - record.started,
+                           span['end'] - record.started, span['bytes'])
+                          for span in record.spans])
+
+    def test_store_and_limit(self):
+        for copy_seconds in (1, 2, 3, 4):
+            self.history.append(self.build(copy_seconds=copy_seconds))
+        with open(self.path) as rfd:
+            self.assertEqual(3, len(rfd.readlines()))
+        reloaded = recovery_history.BuildHistory(self.path, limit=3)
+        self.assertEqual([2, 3, 4], [record['stages']['copy']['seconds']
+                                     for record in reloaded.records()])
+
+    def test_throughput(self):
+        self.assertEqual({}, self.history.throughput())
+        self.history.append(self.build(copy_seconds=10))
+        self.history.append(self.build(copy_seconds=1000, state='failed'))
+        self.assertEqual({'copy': 100, 'iso': 100}, self.history.throughput())
+
+    def test_eta(self):
+        self.history.append(self.build())
+        record = recovery_history.BuildRecord('assemble_image', self.clock)
+        self.assertEqual(None, self.history.eta(record, 0))
+        record.stage('copy', 500)
+        #half the bytes of the last build, then the ISO stage
+        self.assertEqual(5 + 20, self.history.eta(record, 0))
+        self.clock.now += 4
+        self.assertEqual(1 + 20, self.history.eta(record, -1))
+        #extrapolated from the time spent so far
+        self.assertEqual(4 + 20, self.history.eta(record, 50))
+
+    def test_stats(self):
+        self.history.append(self.build())
+        self.history.append(self.build(state='cancelled'))
+        self.history.append(self.build(state='failed'))
+        summary, stages = self.history.stats()
+        self.assertEqual('3', summary['builds'])
+        self.assertEqual('1', summary['finished'])
+        self.assertEqual('1', summary['failed'])
+        self.assertEqual('1', summary['cancelled'])
+        self.assertEqual('30', summary['median_seconds'])
+        self.assertEqual(['copy', 'iso'], [stage['stage'] for stage in stages])
+        self.assertEqual('100', stages[0]['bytes_per_second'])
+
+if __name__ == '__main__':
+    unittest.main()
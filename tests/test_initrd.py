@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- encoding:utf-8 -*-
+#
+# This is a free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this software; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA 02111-1307 USA
+import gzip
+import io
+import lzma
+import shutil
+import subprocess
+import unittest
+
+from Dell import recovery_initrd
+
+BOOTSTRAP = 'scripts/casper-bottom/99dell_bootstrap'
+
+def cpio(members):
+    """Builds a newc cpio archive out of (name, data) pairs"""
+    out = b''
+    for name, data in list(members) + [('TRAILER!!!', b'')]:
+        encoded = name.encode() + b'\x00'
+        fields = [1, 0o100644, 0, 0, 1, 0, len(data), 0, 0, 0, 0,
+                  len(encoded), 0]
+        header = b'070701' + b''.join(b'%08X' % field for field in fields)
+        out += header + encoded
+        out += b'\x00' * ((4 - len(out) % 4) % 4)
+        out += data
+        out += b'\x00' * ((4 - len(out) % 4) % 4)
+    return out
+
+MAIN = cpio([('conf/uuid.conf', b'1234\n'),
+             ('bin/busybox', b'\x7fELF' * 2000),
+             (BOOTSTRAP, b'#!/bin/sh\n')])
+NO_BOOTSTRAP = cpio([('conf/uuid.conf', b'1234\n'),
+                     ('bin/busybox', b'\x7fELF' * 2000)])
+EARLY = cpio([('kernel/x86/microcode/GenuineIntel.bin', b'\x01' * 999)])
+
+class FindInInitrdTestCase(unittest.TestCase):
+
+    def _find(self, data):
+        return recovery_initrd.find_in_initrd(io.BytesIO(data), BOOTSTRAP)
+
+    def test_plain_cpio(self):
+        self.assertEqual(BOOTSTRAP, self._find(MAIN))
+
+    def test_missing(self):
+        self.assertEqual('', self._find(gzip.compress(NO_BOOTSTRAP)))
+
+    def test_gzip(self):
+        self.assertEqual(BOOTSTRAP, self._find(gzip.compress(MAIN)))
+
+    def test_legacy_lzma(self):
+        self.assertEqual(BOOTSTRAP,
+                         self._find(lzma.compress(MAIN, format=lzma.FORMAT_ALONE)))
+
+    def test_multi_segment(self):
+        data = EARLY + b'\x00' * 512 + lzma.compress(MAIN)
+        self.assertEqual(BOOTSTRAP, self._find(data))
+
+    def test_bootstrap_in_later_compressed_segment(self):
+        data = EARLY + gzip.compress(NO_BOOTSTRAP) + lzma.compress(MAIN)
+        self.assertEqual(BOOTSTRAP, self._find(data))
+
+    def test_unknown_segment(self):
+        self.assertEqual('', self._find(EARLY + b'garbage' + MAIN))
+
+    def test_corrupt_segment(self):
+        compressed = gzip.compress(MAIN)
+        self.assertEqual('', self._find(EARLY + compressed[:40]))
+        self.assertEqual('', self._find(compressed[:10] + b'garbage' * 100))
+        self.assertEqual('', self._find(lzma.compress(MAIN)[:60]))
+
+    def test_malformed_header(self):
+        #the sizes of the first member are not hexadecimal
+        for start in (54, 94):
+            data = MAIN[:start] + b'ZZZZZZZZ' + MAIN[start + 8:]
+            self.assertEqual('', self._find(data))
+            self.assertEqual('', self._find(gzip.compress(data)))
+
+    @unittest.skipUnless(shutil.which('zstd'), 'zstd is not installed')
+    def test_zstd(self):
+        compressed = subprocess.run(['zstd', '-q', '-c'], input=MAIN,
+                                    stdout=subprocess.PIPE, check=True).stdout
+        self.assertEqual(BOOTSTRAP, self._find(EARLY + compressed))
+
+    def test_detect_compression(self):
+        self.assertEqual('cpio', recovery_initrd.detect_compression(MAIN))
+        self.assertEqual('gzip', recovery_initrd.detect_compression(gzip.compress(b'')))
+        self.assertEqual('xz', recovery_initrd.detect_compression(lzma.compress(b'')))
+        self.assertEqual('zstd', recovery_initrd.detect_compression(b'\x28\xb5\x2f\xfd'))
+        self.assertEqual('', recovery_initrd.detect_compression(b'garbage'))
+
+if __name__ == '__main__':
+    unittest.main()
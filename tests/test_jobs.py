@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- encoding:utf-8 -*-
+#
+# This is a free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this software; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA 02111-1307 USA
+import json
+import logging
+import os
+import threading
+import unittest
+
+from Dell import recovery_jobs
+
+class JobManagerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = recovery_jobs.JobManager()
+        self.completed = {}
+        self.progress = []
+        self.manager.on_progress = lambda job, message, percent: \
+            self.progress.append((job.job_id, message, percent))
+        self.manager.on_complete = self._complete
+
+    def _complete(self, job):
+        self.completed[job.job_id] = job.state
+
+    def _wait(self, job_id):
+        for thread in threading.enumerate():
+            if thread.name == 'job-%s' % job_id:
+                thread.join(5)
+        return self.manager.get(job_id)
+
+    def test_finished(self):
+        def build():
+            self.manager.progress('Building', 50)
+        job_id = self.manager.start('build', ':1.1', build)
+        job = self._wait(job_id)
+        self.assertEqual(recovery_jobs.JOB_FINISHED, job.state)
+        self.assertEqual(recovery_jobs.JOB_FINISHED, self.completed[job_id])
+        self.assertEqual([(job_id, 'Building', 50)], self.progress)
+        self.assertEqual('50', job.summary()['percent'])
+        self.assertFalse(self.manager.running())
+
+    def test_failed(self):
+        def build():
+            raise RuntimeError('no space left')
+        job = self._wait(self.manager.start('build', None, build))
+        self.assertEqual(recovery_jobs.JOB_FAILED, job.state)
+        self.assertEqual('no space left', job.error)
+
+    def test_cancel(self):
+        started = threading.Event()
+        release = threading.Event()
+        def build():
+            started.set()
+            release.wait(5)
+            recovery_jobs.check_cancelled()
+        job_id = self.manager.start('build', None, build)
+        started.wait(5)
+        self.assertTrue(self.manager.running())
+        self.assertTrue(self.manager.cancel(job_id))
+        release.set()
+        job = self._wait(job_id)
+        self.assertEqual(recovery_jobs.JOB_CANCELLED, job.state)
+        self.assertFalse(self.manager.cancel(job_id))
+
+    def test_concurrent_jobs(self):
+        barrier = threading.Barrier(2, timeout=5)
+        job_ids = [self.manager.start('build', None, barrier.wait)
+                   for _ in range(2)]
+        for job_id in job_ids:
+            self.assertEqual(recovery_jobs.JOB_FINISHED, self._wait(job_id).state)
+        self.assertEqual(2, len(self.manager.jobs()))
+
+    def test_stream(self):
+        rfd, wfd = os.pipe()
+        def build():
+            self.manager.progress('Building ISO', 50)
+            recovery_jobs.job_output('xorriso : UPDATE : 50% done')
+            logging.warning('low on space')
+            logging.debug('not streamed')
+        job_id = self.manager.start('build', None, build, stream=wfd)
+        with os.fdopen(rfd) as stream:
+            records = [json.loads(line) for line in stream]
+        self.assertEqual(['progress', 'log', 'log', 'complete'],
+                         [record['type'] for record in records])
+        self.assertEqual('50', records[0]['percent'])
+        self.assertEqual('OUTPUT', records[1]['level'])
+        self.assertEqual('low on space', records[2]['message'])
+        self.assertEqual(recovery_jobs.JOB_FINISHED, records[3]['state'])
+        self.assertTrue(all(record['job'] == job_id for record in records))
+
+    def test_stream_reader_gone(self):
+        rfd, wfd = os.pipe()
+        os.close(rfd)
+        job = self._wait(self.manager.start('build', None, lambda:
+                         self.manager.progress('Building ISO', 1), stream=wfd))
+        self.assertEqual(recovery_jobs.JOB_FINISHED, job.state)
+
+    def test_outside_of_job(self):
+        self.assertFalse(self.manager.progress('Building', 10))
+        recovery_jobs.check_cancelled()
+        self.assertIsNone(self.manager.get('unknown'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- encoding:utf-8 -*-
+#
+# This is a free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this software; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA 02111-1307 USA
+import os
+import shutil
+import tempfile
+import unittest
+
+from Dell import recovery_mounts
+
+ROOT = '22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw\n'
+LOOP = '%d 22 7:0 / %s ro,relatime shared:%d - iso9660 /dev/loop0 ro\n'
+FILE = '%d 22 7:1 / %s ro,relatime shared:%d - iso9660 %s ro\n'
+
+class FakeRegistry(recovery_mounts.MountRegistry):
+    """Mounts by editing a fake mountinfo file"""
+
+    def _start_watcher(self):
+        self._watcher = True
+
+    def _mount(self, source, mntdir, options):
+        with open(self.mountinfo, 'a') as wfd:
+            wfd.write(LOOP % (len(self.mounted()) + 100, mntdir, 2))
+        return 0, ''
+
+    def _umount(self, mntdir):
+        with open(self.mountinfo) as rfd:
+            lines = [line for line in rfd if (' %s ' % mntdir) not in line]
+        with open(self.mountinfo, 'w') as wfd:
+            wfd.writelines(lines)
+        return 0
+
+class NestedRegistry(FakeRegistry):
+    """Mounts images by path, a mount is busy while an image inside it
+       is mounted"""
+
+    def _mount(self, source, mntdir, options):
+        with open(self.mountinfo, 'a') as wfd:
+            wfd.write(FILE % (len(self.mounted()) + 100, mntdir, 2,
+                              os.path.realpath(source).replace(' ', '\\040')))
+        return 0, ''
+
+    def _umount(self, mntdir):
+        for entry in self.entries():
+            if entry.source.startswith(mntdir + os.sep):
+                return 32
+        return FakeRegistry._umount(self, mntdir)
+
+class MountinfoTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        loop = os.path.join(self.tmp, 'block', 'loop0', 'loop')
+        os.makedirs(loop)
+        self.iso = os.path.join(self.tmp, 'base image.iso')
+        with open(self.iso, 'w'):
+            pass
+        with open(os.path.join(loop, 'backing_file'), 'w') as wfd:
+            wfd.write(self.iso + '\n')
+        self.mountinfo = os.path.join(self.tmp, 'mountinfo')
+        with open(self.mountinfo, 'w') as wfd:
+            wfd.write(ROOT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_parse(self):
+        text = ROOT + LOOP % (40, '/media/my\\040disk', 3)
+        entries = recovery_mounts.parse_mountinfo(text, self.tmp)
+        self.assertEqual(2, len(entries))
+        self.assertEqual(('/dev/sda1', '/', 'ext4', ''), entries[0])
+        self.assertEqual('/media/my disk', entries[1].mountpoint)
+        self.assertEqual(self.iso, entries[1].backing)
+
+    def test_optional_fields(self):
+        text = '40 22 7:0 / /mnt rw master:1 shared:2 - vfat /dev/sdb1 rw\n'
+        entry = recovery_mounts.parse_mountinfo(text, self.tmp)[0]
+        self.assertEqual(('/dev/sdb1', '/mnt', 'vfat'), entry[:3])
+
+    def test_refcount(self):
+        registry = FakeRegistry(self.mountinfo, self.tmp)
+        first = registry.acquire(self.iso, 'job1', ['-r'])
+        self.assertTrue(os.path.isdir(first))
+        self.assertEqual(first, registry.acquire(self.iso, 'job2', ['-r']))
+        self.assertEqual(first, registry.find(self.iso))
+
+        registry.release('job1')
+        self.assertTrue(os.path.isdir(first))
+        self.assertEqual(first, registry.find(self.iso))
+
+        registry.release('job2')
+        self.assertFalse(os.path.exists(first))
+        self.assertEqual('', registry.find(self.iso))
+        self.assertEqual({}, registry.mounted())
+
+    def test_existing_mount_is_kept(self):
+        with open(self.mountinfo, 'a') as wfd:
+            wfd.write(LOOP % (40, '/media/base', 3))
+        registry = FakeRegistry(self.mountinfo, self.tmp)
+        self.assertEqual('/media/base', registry.acquire(self.iso, 'job', ['-r']))
+        registry.release('job')
+        registry.release_all()
+        self.assertEqual('/media/base', registry.find(self.iso))
+
+    def test_nested(self):
+        registry = NestedRegistry(self.mountinfo, self.tmp)
+        outer = registry.acquire(self.iso, 'job', ['-r'])
+        inner = registry.acquire(os.path.join(outer, 'ubuntu.iso'), 'job', ['-r'])
+        registry.release('job')
+        self.assertEqual({}, registry.mounted())
+        self.assertFalse(os.path.exists(outer))
+        self.assertFalse(os.path.exists(inner))
+
+    def test_busy_mount_is_retried(self):
+        registry = NestedRegistry(self.mountinfo, self.tmp)
+        outer = registry.acquire(self.iso, 'job1', ['-r'])
+        nested = os.path.join(outer, 'ubuntu.iso')
+        inner = registry.acquire(nested, 'job2', ['-r'])
+        #still busy with the image inside it
+        registry.release('job1')
+        self.assertEqual({outer: {}, inner: {'job2': 1}}, registry.mounted())
+        self.assertEqual(outer, registry.find(self.iso))
+        registry.release_all()
+        self.assertEqual({}, registry.mounted())
+        self.assertEqual('', registry.find(self.iso))
+        self.assertEqual('', registry.find(nested))
+        self.assertFalse(os.path.exists(outer))
+
+if __name__ == '__main__':
+    unittest.main()
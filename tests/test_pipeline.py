@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- encoding:utf-8 -*-
+#
+# This is a free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this software; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA 02111-1307 USA
+import tempfile
+import unittest
+
+from Dell import recovery_pipeline
+
+class PipelineTestCase(unittest.TestCase):
+
+    def test_to_file(self):
+        pipeline = recovery_pipeline.Pipeline([['printf', 'b\\na\\nc\\n'],
+                                               ['sort'],
+                                               ['gzip', '-c']])
+        with tempfile.TemporaryFile() as output:
+            results = pipeline.run(output)
+            output.seek(0)
+            gunzip = recovery_pipeline.Pipeline([['gunzip', '-c']])
+            chunks = []
+            gunzip.run(callback=chunks.append, stdin=output)
+        self.assertEqual(b'a\nb\nc\n', b''.join(chunks))
+        self.assertEqual([0, 0, 0], [result.returncode for result in results])
+        self.assertEqual(['printf', 'sort', 'gzip'],
+                         [result.args[0] for result in results])
+        for result in results:
+            self.assertGreaterEqual(result.wall, 0)
+            self.assertIsNotNone(result.cpu)
+
+    def test_failure(self):
+        pipeline = recovery_pipeline.Pipeline([['sh', '-c', 'echo oops >&2; exit 2'],
+                                               ['cat']])
+        with self.assertRaises(recovery_pipeline.PipelineFailed) as context:
+            pipeline.run()
+        self.assertEqual([2, 0], [result.returncode
+                                  for result in context.exception.results])
+        self.assertIn('oops', str(context.exception))
+        results = recovery_pipeline.Pipeline([['false'], ['cat']]).run(check=False)
+        self.assertEqual(1, results[0].returncode)
+
+    def test_early_exit(self):
+        #yes is killed by SIGPIPE once head is done, which is not an error
+        chunks = []
+        results = recovery_pipeline.Pipeline([['yes'], ['head', '-n', '2']]).run(
+            callback=chunks.append)
+        self.assertEqual(b'y\ny\n', b''.join(chunks))
+        self.assertEqual(0, results[1].returncode)
+
+    def test_missing_command(self):
+        pipeline = recovery_pipeline.Pipeline([['yes'], ['/nonexistent/command']])
+        self.assertRaises(OSError, pipeline.run)
+        self.assertIsNotNone(pipeline._processes[0].returncode)
+
+if __name__ == '__main__':
+    unittest.main()
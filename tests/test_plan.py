@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- encoding:utf-8 -*-
+#
+# This is a free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this software; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA 02111-1307 USA
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from Dell import recovery_plan
+
+MIB = recovery_plan.MIB
+RATES = {'copy': MIB, 'fish': MIB, 'initrd': MIB, 'checksum': MIB, 'iso': MIB}
+
+class PlanTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_fish_size(self):
+        archive = os.path.join(self.tmp, 'driver.tgz')
+        with tarfile.open(archive, 'w:gz') as wfd:
+            for name, size in (('debs/a.deb', 300), ('debs/b.deb', 200)):
+                info = tarfile.TarInfo(name)
+                info.size = size
+                wfd.addfile(info, io.BytesIO(b'\0' * size))
+        self.assertEqual(500, recovery_plan.fish_size(archive))
+        script = os.path.join(self.tmp, 'fix.sh')
+        with open(script, 'w') as wfd:
+            wfd.write('#!/bin/sh\n')
+        self.assertEqual(10, recovery_plan.fish_size(script))
+        self.assertEqual(0, recovery_plan.fish_size(os.path.join(self.tmp, 'gone')))
+
+    def test_initrd_size(self):
+        self.assertEqual(0, recovery_plan.initrd_size(self.tmp))
+        os.makedirs(os.path.join(self.tmp, 'casper'))
+        with open(os.path.join(self.tmp, 'casper', 'initrd'), 'w') as wfd:
+            wfd.write('x' * 42)
+        self.assertEqual(42, recovery_plan.initrd_size(self.tmp))
+
+    def test_build_plan(self):
+        plan = recovery_plan.build_plan(100 * MIB, 10 * MIB, 5 * MIB, MIB,
+                                        True, 1000 * MIB, 1000 * MIB,
+                                        staged_bytes=100 * MIB, throughput=RATES)
+        expansion = recovery_plan.INITRD_EXPANSION
+        self.assertEqual(115 * MIB, plan['output_bytes'])
+        self.assertEqual((115 + expansion + 1) * MIB +
+                         recovery_plan.CREATE_OVERHEAD, plan['staging_bytes'])
+        self.assertEqual(100 + 15 + expansion + 115 + 115,
+                         plan['estimated_seconds'])
+        self.assertEqual(1, plan['staging_fits'])
+        self.assertEqual(1, plan['output_fits'])
+
+    def test_shared_volume(self):
+        args = (100 * MIB, 0, 0, 0, False, 250 * MIB, 250 * MIB)
+        self.assertEqual(1, recovery_plan.build_plan(*args)['output_fits'])
+        plan = recovery_plan.build_plan(*args, staged_bytes=100 * MIB,
+                                        shared_volume=True)
+        self.assertEqual(1, plan['staging_fits'])
+        self.assertEqual(0, plan['output_fits'])
+
+    def test_volume_free(self):
+        target = os.path.join(self.tmp, 'new', 'dir', 'image.iso')
+        available, device = recovery_plan.volume_free(target)
+        self.assertGreater(available, 0)
+        self.assertEqual(os.stat(self.tmp).st_dev, device)
+
+if __name__ == '__main__':
+    unittest.main()
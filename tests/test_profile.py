@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- encoding:utf-8 -*-
+#
+# This is a free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this software; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA 02111-1307 USA
+import os
+import pstats
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+
+from Dell import recovery_profile
+
+def exported(function):
+    """Marks a method the way @dbus.service.method does"""
+    function._dbus_is_method = True
+    return function
+
+class Service:
+    """Stands in for a dbus.service.Object"""
+
+    @exported
+    def build(self, size):
+        return self.helper(size)
+
+    @exported
+    def helper(self, size):
+        return len(bytearray(size))
+
+    def internal(self):
+        return 'internal'
+
+class ProfilerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_profile_class(self):
+        profiler = recovery_profile.Profiler(os.path.join(self.tmp, 'profile'))
+        service = recovery_profile.profile_class(Service, profiler)()
+        self.assertEqual('ProfiledService', type(service).__name__)
+        self.assertEqual(10, service.build(10))
+        self.assertEqual('internal', service.internal())
+        #the nested helper call is part of the profile of build
+        files = os.listdir(profiler.directory)
+        self.assertEqual(1, len(files))
+        self.assertTrue(files[0].startswith('build-'))
+        self.assertTrue(files[0].endswith('.pstats'))
+        stats = pstats.Stats(os.path.join(profiler.directory, files[0]))
+        self.assertTrue(any(function[2] == 'helper' for function in stats.stats))
+
+    def test_memory(self):
+        tracing = tracemalloc.is_tracing()
+        profiler = recovery_profile.Profiler(self.tmp, memory=True)
+        try:
+            recovery_profile.profiled(Service().helper, profiler)(1024 * 1024)
+        finally:
+            if not tracing:
+                tracemalloc.stop()
+        self.assertEqual(['.malloc', '.pstats'],
+                         sorted(os.path.splitext(name)[1]
+                                for name in os.listdir(self.tmp)))
+
+    def test_environment(self):
+        os.environ.pop(recovery_profile.PROFILE_ENV, None)
+        self.assertEqual(None, recovery_profile.profiler_from_environment())
+        os.environ[recovery_profile.PROFILE_ENV] = self.tmp
+        try:
+            profiler = recovery_profile.profiler_from_environment()
+        finally:
+            del os.environ[recovery_profile.PROFILE_ENV]
+        self.assertEqual(self.tmp, profiler.directory)
+        self.assertFalse(profiler.memory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- encoding:utf-8 -*-
+#
+# This is a free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this software; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA 02111-1307 USA
+import subprocess
+import unittest
+
+from Dell import recovery_telemetry
+
+class TelemetryTestCase(unittest.TestCase):
+
+    def test_communicate(self):
+        with recovery_telemetry.collect_commands() as stats:
+            proc = recovery_telemetry.TimedPopen(['echo', 'hello'],
+                                                 stdout=subprocess.PIPE,
+                                                 stderr=subprocess.PIPE)
+            self.assertEqual((b'hello\n', b''), proc.communicate())
+        entry = stats.commands()[0]
+        self.assertEqual('echo', entry['command'])
+        self.assertEqual('1', entry['runs'])
+        self.assertEqual('0', entry['failures'])
+        self.assertEqual('6', entry['stdout_bytes'])
+        self.assertEqual(1, sum(int(count) for count in
+                                entry['histogram'].split()))
+
+    def test_call_and_poll(self):
+        with recovery_telemetry.collect_commands() as stats:
+            self.assertEqual(1, recovery_telemetry.timed_call(['false']))
+            proc = recovery_telemetry.TimedPopen(['sh', '-c', 'exit 0'])
+            while proc.poll() is None:
+                proc.wait()
+            proc.wait()
+        commands = dict((entry['command'], entry) for entry in stats.commands())
+        self.assertEqual('1', commands['false']['failures'])
+        self.assertEqual('1', commands['sh']['runs'])
+        self.assertIn('false', stats.report())
+
+    def test_wait(self):
+        proc = recovery_telemetry.TimedPopen(['sleep', '5'])
+        self.assertRaises(subprocess.TimeoutExpired, proc.wait, 0.05)
+        self.assertEqual(None, proc.poll())
+        proc.kill()
+        self.assertEqual(-9, proc.wait(5))
+        self.assertGreaterEqual(proc.wall, 0)
+        self.assertIsNotNone(proc.cpu)
+        proc = recovery_telemetry.TimedPopen(['sh', '-c', 'exit 3'])
+        self.assertEqual(3, proc.wait())
+        self.assertIsNotNone(proc.cpu)
+
+    def test_outside_of_collection(self):
+        with recovery_telemetry.collect_commands() as stats:
+            pass
+        recovery_telemetry.timed_call(['true'])
+        self.assertEqual([], stats.commands())
+        self.assertIn('true', [entry['command'] for entry in
+                               recovery_telemetry.COMMAND_STATS.commands()])
+
+    def test_buckets(self):
+        stats = recovery_telemetry.CommandStats()
+        stats.record('/usr/bin/xorriso -as mkisofs', 0.5, 0.25, 0, 10, 5)
+        stats.record(['xorriso'], 1000, None, 0)
+        entry = stats.commands()[0]
+        self.assertEqual('xorriso', entry['command'])
+        self.assertEqual('0 0 1 0 0 0 1', entry['histogram'])
+        self.assertEqual('1000.000', entry['max_wall'])
+        self.assertEqual('0.250', entry['cpu'])
+
+if __name__ == '__main__':
+    unittest.main()
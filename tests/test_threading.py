@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- encoding:utf-8 -*-
+#
+# This is a free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this software; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA 02111-1307 USA
+import unittest
+
+from Dell.recovery_threading import ProgressPublisher
+
+class ProgressPublisherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.sent = []
+        self.scheduled = []
+        self.publisher = ProgressPublisher(
+            lambda *update: self.sent.append(update), interval=1,
+            clock=lambda: self.now,
+            schedule=lambda delay, function: self.scheduled.append((delay, function)))
+
+    def _run_scheduled(self):
+        scheduled, self.scheduled = self.scheduled, []
+        for delay, function in scheduled:
+            self.now += delay
+            function()
+
+    def test_first_update_is_sent(self):
+        self.publisher.publish('job', 'Building ISO', '10')
+        self.assertEqual([('job', 'Building ISO', '10')], self.sent)
+
+    def test_identical_updates_are_dropped(self):
+        for _ in range(3):
+            self.now += 5
+            self.publisher.publish('job', 'Building ISO', '10')
+        self.assertEqual(1, len(self.sent))
+        self.assertEqual([], self.scheduled)
+
+    def test_pulses_are_repeated(self):
+        self.publisher.publish('job', 'Regenerating UUID', '-1')
+        self.now += 1
+        self.publisher.publish('job', 'Regenerating UUID', '-1')
+        self.assertEqual(2, len(self.sent))
+
+    def test_burst_is_coalesced(self):
+        for percent in range(10):
+            self.publisher.publish('job', 'Building ISO', str(percent))
+        self.assertEqual([('job', 'Building ISO', '0')], self.sent)
+        self.assertEqual(1, len(self.scheduled))
+        self.assertEqual(1, self.scheduled[0][0])
+        self._run_scheduled()
+        self.assertEqual(('job', 'Building ISO', '9'), self.sent[-1])
+        self.assertEqual(2, len(self.sent))
+
+    def test_keys_are_independent(self):
+        self.publisher.publish('first', 'Building ISO', '1')
+        self.publisher.publish('second', 'Building ISO', '1')
+        self.assertEqual(2, len(self.sent))
+
+    def test_finish_sends_pending_state(self):
+        self.publisher.publish('job', 'Building ISO', '98')
+        self.publisher.publish('job', 'Building ISO', '100')
+        self.publisher.finish('job')
+        self.assertEqual(('job', 'Building ISO', '100'), self.sent[-1])
+        self._run_scheduled()
+        self.assertEqual(2, len(self.sent))
+
+    def test_finish_with_state_always_sends(self):
+        self.publisher.publish('job', 'Done', '100')
+        self.publisher.finish('job', 'Done', '100')
+        self.assertEqual(2, len(self.sent))
+        self.publisher.publish('job', 'Done', '100')
+        self.assertEqual(3, len(self.sent))
+
+    def test_synchronous_builds_are_finished(self):
+        #builds outside of a job share the None key
+        self.publisher.publish(None, 'Building ISO', '100')
+        self.publisher.finish(None)
+        self.now += 60
+        self.publisher.publish(None, 'Building ISO', '100')
+        self.assertEqual(2, len(self.sent))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- encoding:utf-8 -*-
+#
+# This is a free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this software; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA 02111-1307 USA
+import os
+import threading
+import unittest
+
+from Dell import recovery_workers
+
+def count(steps, progress):
+    """Reports every step, returns the worker's PID"""
+    for step in range(steps):
+        progress('Counting', step)
+    return os.getpid()
+
+def fail():
+    """Raises inside a worker"""
+    raise ValueError('broken archive')
+
+class WorkerPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        #keep the fork server from importing anything the tests don't need
+        self.preload = recovery_workers.WORKER_PRELOAD
+        recovery_workers.WORKER_PRELOAD = []
+        self.pool = recovery_workers.WorkerPool(processes=2)
+
+    def tearDown(self):
+        self.pool.close()
+        recovery_workers.WORKER_PRELOAD = self.preload
+
+    def test_runs_in_another_process(self):
+        self.assertNotEqual(os.getpid(), self.pool.run(os.getpid))
+
+    def test_progress(self):
+        reports = []
+        done = threading.Event()
+        def progress(message, step):
+            reports.append((message, step))
+            if step == 4:
+                done.set()
+        self.pool.run(count, 5, progress=progress)
+        self.assertTrue(done.wait(5))
+        self.assertEqual([('Counting', step) for step in range(5)], reports)
+
+    def test_exception(self):
+        self.assertRaises(ValueError, self.pool.run, fail)
+
+    def test_lazy_start(self):
+        pool = recovery_workers.WorkerPool()
+        pool.close()
+        self.assertIsNone(pool._pool)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- encoding:utf-8 -*-
+#
+# This is a free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this software; if not, write to the Free Software Foundation, Inc., 59 Temple
+# Place, Suite 330, Boston, MA 02111-1307 USA
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from Dell import recovery_workspace
+
+class FixedManager(recovery_workspace.WorkspaceManager):
+    """Pretends the volume has a fixed amount of free space"""
+    available = 1000
+
+    def free(self):
+        return self.available
+
+class WorkspaceManagerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.manager = FixedManager(self.root, reserve=100)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_allocate_and_release(self):
+        path = self.manager.allocate('job', 10, 'assembly')
+        self.assertTrue(os.path.isdir(path))
+        self.assertTrue(os.path.basename(path).startswith('assembly-'))
+        with open(os.path.join(path, 'casper'), 'w') as wfd:
+            wfd.write('x' * 5)
+        self.manager.available -= 5
+        summary, details = self.manager.usage()
+        self.assertEqual('1', summary['workspaces'])
+        self.assertEqual('5', summary['used'])
+        self.assertEqual('10', summary['reserved'])
+        self.assertEqual('10', details[0]['needed'])
+
+        self.manager.release('other')
+        self.assertTrue(os.path.isdir(path))
+        self.manager.release('job')
+        self.manager.wait()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual('0', self.manager.usage()[0]['workspaces'])
+
+    def test_insufficient_space(self):
+        self.assertRaises(recovery_workspace.InsufficientSpace,
+                          self.manager.allocate, 'job', 901)
+        self.assertEqual([], os.listdir(self.root))
+
+    def test_reservations_are_budgeted(self):
+        path = self.manager.allocate('first', 600)
+        self.assertRaises(recovery_workspace.InsufficientSpace,
+                          self.manager.allocate, 'second', 400)
+        #space the first workspace already uses is in free() instead
+        with open(os.path.join(path, 'data'), 'w') as wfd:
+            wfd.write('x' * 300)
+        self.manager.available -= 300
+        self.manager.allocate('second', 300)
+
+    def test_allocate_does_not_measure(self):
+        self.manager.allocate('first', 300)
+        with mock.patch('os.walk', side_effect=AssertionError('walked')):
+            self.manager.allocate('second', 300)
+            self.assertRaises(recovery_workspace.InsufficientSpace,
+                              self.manager.allocate, 'third', 301)
+            self.assertEqual('600', self.manager.usage()[0]['reserved'])
+        #the budget starts over once every workspace is released
+        self.manager.release('first')
+        self.manager.release('second')
+        self.manager.wait()
+        self.manager.available = 500
+        self.manager.allocate('third', 400)
+
+    def test_release_all(self):
+        path = self.manager.allocate('job')
+        self.manager.release_all()
+        self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+    unittest.main()
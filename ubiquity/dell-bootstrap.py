@@ -953,8 +953,13 @@ class RPbuilder(Thread):
         self.file_size_thread = sizing_thread
         self.xml_obj = BTOxml()
         self.rec_type=rec_type
+        self.timings = []
         Thread.__init__(self)
 
+    def timed(self, phase, start, size=None):
+        """Records how long a phase took, for the timings in bto.xml"""
+        self.timings.append((phase, start, time.time(), size))
+
     def build_rp(self, cushion=600):
         """Copies content to the recovery partition using a parted wrapper.
            This might be better implemented in python-parted or parted_server/partman,
@@ -984,6 +989,7 @@ manually to proceed.")
             misc.execute_root('mdadm', '--misc', '--action=frozen', self.device)
 
         # Build new partition table
+        start = time.time()
         command = ('parted', '-s', self.device, 'mklabel', 'gpt')
         result = misc.execute_root(*command)
         if result is False:
@@ -1017,15 +1023,18 @@ manually to proceed.")
         result = misc.execute_root(*command)
         if result is False:
             raise RuntimeError("Error creating new %s mb recovery partition on %s" % (rp_size_mb, self.device))
+        self.timed('partitioning', start)
 
         #Build RP filesystem
         self.status("Formatting Partitions", 2)
+        start = time.time()
         command = ('mkfs.msdos', '-n', 'OS', self.device + rp_part)
         while not os.path.exists(command[-1]):
             time.sleep(1)
         result = misc.execute_root(*command)
         if result is False:
             raise RuntimeError("Error creating fat32 filesystem on %s%s" % (self.device, rp_part))
+        self.timed('formatting', start)
 
         #Mount RP
         mount = misc.execute_root('mount', self.device + rp_part, '/mnt')
@@ -1039,12 +1048,14 @@ manually to proceed.")
         self.file_size_thread.start()
 
         #Copy RP Files
+        start = time.time()
         with misc.raised_privileges():
             if os.path.exists(magic.ISO_MOUNT):
                 magic.black_tree("copy", re.compile(".*\.iso$"), magic.ISO_MOUNT, '/mnt')
             magic.black_tree("copy", black_pattern, magic.CDROM_MOUNT, '/mnt')
 
         self.file_size_thread.join()
+        self.timed('copy', start, rp_size)
 
         #find uuid of drive
         with misc.raised_privileges():
@@ -1077,6 +1088,7 @@ manually to proceed.")
             magic.write_seed(seed, keys)
 
         #Check for a grub.cfg - replace as necessary
+        start = time.time()
         files = {'recovery_partition.cfg': 'grub.cfg',
                 }
         for item in files:
@@ -1094,7 +1106,10 @@ manually to proceed.")
         ##If we don't have grub binaries, build them
         grub_files = ['bootx64.efi', 'grubx64.efi']
 
+        self.timed('grub', start)
+
         ##Mount ESP
+        start = time.time()
         mount = misc.execute_root('mount', self.device + esp_part, '/mnt/efi')
         if mount is False:
             raise RuntimeError("Error mounting %s%s" % (self.device, esp_part))
@@ -1135,6 +1150,7 @@ manually to proceed.")
 
         ##clean up ESP mount
         misc.execute_root('umount', '/mnt/efi')
+        self.timed('efi', start)
 
         #Make changes that would normally be done in factory stage1
         ##rename efi directory so we don't offer it to customer boot in NVRAM menu
@@ -1176,6 +1192,9 @@ manually to proceed.")
                     line = rfd.readline().strip()
                 date = line.split()[len(line.split())-1]
                 self.xml_obj.replace_node_contents('date', date)
+            self.xml_obj.clear_timings('rp')
+            for timing in self.timings:
+                self.xml_obj.add_timing('rp', *timing)
             self.xml_obj.write_xml('/mnt/bto.xml')
         misc.execute_root('umount', '/mnt')
 
@@ -30,6 +30,7 @@ import subprocess
 import os
 import Dell.recovery_common as magic
 import dbus
+import dbus.mainloop.glib
 import syslog
 import gi
 